@@ -1,56 +1,103 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, session, redirect, url_for, flash
 import os
-import uuid
-from model_web import initialize_model, get_prediction
-import sqlite3
+from model_web import (initialize_model, start_batcher, enable_prediction_cache, load_for_serving, is_model_ready,
+                       enable_cascade, enable_embedding_store, enable_near_duplicate_index, record_prediction)
+from upload_archive import UploadArchive
+from prediction_jobs import JobQueue
+from prediction_routes import PredictionRoutes
+from database import Database
+from slim_checkpoint import slim_path_for
+from prediction_writer import PredictionWriter
 import hashlib
-from datetime import datetime
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'  # Change this in production!
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
+ARCHIVE_UPLOADS = False  # Keep a copy of every analysed upload in UPLOAD_FOLDER, written off the request thread
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+BULK_MAX_CONTENT_LENGTH = 512 * 1024 * 1024  # Whole request to /predict/bulk; each image still has the 16MB limit
+BULK_MAX_IMAGES = 1000  # Images per /predict/bulk request, counting ZIP members
+BULK_DECODE_WORKERS = 4  # Threads decoding bulk images while the previous batch runs through the model
+BATCH_MAX_SIZE = 8  # Max concurrent /predict requests merged into one forward pass
+BATCH_MAX_WAIT_MS = 10  # How long the first request in a batch waits for others
+PREDICTION_CACHE_SIZE = 1024  # Results kept in memory; older ones stay in prediction_cache.db
+WARMUP_BATCH_SIZES = (1, BATCH_MAX_SIZE)  # Dummy forward passes run before the worker reports ready
+RETRY_AFTER_SECONDS = 5  # Sent with 503 responses while the model is still loading
+CASCADE_MODEL_PATH = 'student.pt'  # Cheap first-stage model from distill.py, used when present
+CASCADE_MODEL_ARCH = 'resnet18'
+CASCADE_THRESHOLD = 0.9  # First-stage confidence needed to answer without the full model
+# Max differing bits of the 64-bit perceptual hash for reusing an earlier prediction; None disables.
+# Fundus photos look alike at thumbnail scale, so validate the radius on your own data before enabling.
+NEAR_DUPLICATE_RADIUS = None
+JOB_WORKER_THREADS = 2  # Threads per process running queued /predict/jobs uploads (they share the micro-batcher)
+JOB_LEASE_SECONDS = 120  # A running job whose worker vanished is retried after this long
+JOB_EVENTS_TIMEOUT = 300  # Longest a server-sent events stream for one job stays open
+EMBEDDING_STORE_PATH = None  # e.g. 'embeddings.f16' to keep pooled features for rescore_embeddings.py
+DATABASE_URL = 'sqlite:///users.db'
+PREDICTION_WRITE_BATCH = 256  # Prediction rows inserted per group commit at most
+PREDICTION_WRITE_DELAY_MS = 50  # Longest a prediction row waits in memory before it is written
+PREDICTION_WRITE_DURABLE = False  # True: /predict answers only after its row's group commit
+HISTORY_PAGE_SIZE = 20  # Rows per history page
+HISTORY_MAX_PAGE_SIZE = 100  # Largest ?limit= accepted by /history/predictions
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-# Create uploads directory if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Uploads are analysed in memory; they only reach the disk when archival is enabled
+upload_archive = UploadArchive(UPLOAD_FOLDER) if ARCHIVE_UPLOADS else None
+
+# SQLite database (replacing MySQL for simplicity), one long-lived WAL connection per thread
+db = Database(DATABASE_URL)
+
+# Asynchronous predictions are queued in users.db, so pending jobs survive restarts
+job_queue = JobQueue(db, lease_seconds=JOB_LEASE_SECONDS, on_saved=record_prediction)
+
+# Prediction rows are written behind the response, many per transaction
+prediction_writer = PredictionWriter(db.insert_predictions, max_batch=PREDICTION_WRITE_BATCH,
+                                     max_delay_ms=PREDICTION_WRITE_DELAY_MS, on_saved=record_prediction)
+
+# Prediction, job, history and health routes, shared with app_heroku.py
+routes = PredictionRoutes(db, job_queue, prediction_writer, upload_archive, allowed_extensions=ALLOWED_EXTENSIONS,
+                          max_image_bytes=MAX_CONTENT_LENGTH, bulk_max_content_length=BULK_MAX_CONTENT_LENGTH,
+                          bulk_max_images=BULK_MAX_IMAGES, bulk_decode_workers=BULK_DECODE_WORKERS,
+                          durable_writes=PREDICTION_WRITE_DURABLE, retry_after_seconds=RETRY_AFTER_SECONDS,
+                          job_events_timeout=JOB_EVENTS_TIMEOUT, history_page_size=HISTORY_PAGE_SIZE,
+                          history_max_page_size=HISTORY_MAX_PAGE_SIZE)
+routes.register(app)
 
-# Initialize SQLite database (replacing MySQL for simplicity)
 def init_db():
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT UNIQUE NOT NULL,
-                  password_hash TEXT NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS predictions
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  filename TEXT,
-                  predicted_class TEXT,
-                  confidence REAL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (user_id) REFERENCES users (id))''')
-    conn.commit()
-    conn.close()
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    db.init_schema()
+    job_queue.create_table()
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-# Initialize database and model
+def setup_model():
+    # Try to load model weights if available: the checkpoint, or just its slim file from slim_checkpoint.py
+    has_weights = os.path.exists('classifier.pt') or os.path.exists(slim_path_for('classifier.pt'))
+    initialize_model('classifier.pt' if has_weights else None)
+    if os.path.exists(CASCADE_MODEL_PATH):
+        enable_cascade(CASCADE_MODEL_PATH, arch=CASCADE_MODEL_ARCH, threshold=CASCADE_THRESHOLD)
+    if EMBEDDING_STORE_PATH:
+        enable_embedding_store(EMBEDDING_STORE_PATH)
+    if NEAR_DUPLICATE_RADIUS is not None:
+        enable_near_duplicate_index(radius=NEAR_DUPLICATE_RADIUS, rows=load_phash_rows())
+    enable_prediction_cache(max_entries=PREDICTION_CACHE_SIZE, db_path='prediction_cache.db')
+
+def load_phash_rows():
+    """Stored hashes and probabilities of earlier predictions, for rebuilding the near-duplicate index"""
+    return db.iter_phash_rows()
+
+def setup_worker():
+    start_batcher(max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+    job_queue.start_workers(routes.run_prediction_job, threads=JOB_WORKER_THREADS, ready=is_model_ready)
+
+# Initialize database now and load the model in the background
 init_db()
-model = initialize_model('classifier.pt' if os.path.exists('classifier.pt') else None)  # Try to load model weights if available
+load_for_serving(setup_model, setup_worker, warmup_batch_sizes=WARMUP_BATCH_SIZES)
 
 @app.route('/')
 def index():
@@ -64,14 +111,10 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute('SELECT id, password_hash FROM users WHERE username = ?', (username,))
-        user = c.fetchone()
-        conn.close()
+        user = db.find_user(username)
         
-        if user and user[1] == hash_password(password):
-            session['user_id'] = user[0]
+        if user and user.password_hash == hash_password(password):
+            session['user_id'] = user.id
             session['username'] = username
             flash('Successfully logged in!', 'success')
             return redirect(url_for('index'))
@@ -90,19 +133,10 @@ def signup():
             flash('Username must be at least 3 characters and password at least 6 characters!', 'error')
             return render_template('signup.html')
         
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        
-        try:
-            c.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                     (username, hash_password(password)))
-            conn.commit()
+        if db.create_user(username, hash_password(password)) is not None:
             flash('Account created successfully! Please log in.', 'success')
             return redirect(url_for('login'))
-        except sqlite3.IntegrityError:
-            flash('Username already exists!', 'error')
-        finally:
-            conn.close()
+        flash('Username already exists!', 'error')
     
     return render_template('signup.html')
 
@@ -112,74 +146,6 @@ def logout():
     flash('Successfully logged out!', 'success')
     return redirect(url_for('index'))
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Please log in first'}), 401
-    
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    if file and allowed_file(file.filename):
-        # Generate unique filename
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        try:
-            # Get prediction
-            result = get_prediction(filepath)
-            
-            if 'error' in result:
-                return jsonify({'error': result['error']}), 500
-            
-            # Save prediction to database
-            conn = sqlite3.connect('users.db')
-            c = conn.cursor()
-            c.execute('''INSERT INTO predictions (user_id, filename, predicted_class, confidence)
-                        VALUES (?, ?, ?, ?)''',
-                     (session['user_id'], filename, result['predicted_class'], result['confidence']))
-            conn.commit()
-            conn.close()
-            
-            # Clean up uploaded file
-            os.remove(filepath)
-            
-            return jsonify({
-                'predicted_class': result['predicted_class'],
-                'confidence': result['confidence'],
-                'all_probabilities': result['all_probabilities']
-            })
-        
-        except Exception as e:
-            # Clean up uploaded file on error
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({'error': str(e)}), 500
-    
-    return jsonify({'error': 'Invalid file type'}), 400
-
-@app.route('/history')
-def history():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    c.execute('''SELECT predicted_class, confidence, created_at 
-                 FROM predictions 
-                 WHERE user_id = ? 
-                 ORDER BY created_at DESC 
-                 LIMIT 20''', (session['user_id'],))
-    predictions = c.fetchall()
-    conn.close()
-    
-    return render_template('history.html', predictions=predictions, username=session.get('username'))
-
 # Initialize database when app starts
 init_db()
 
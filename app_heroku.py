@@ -1,16 +1,24 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, session, redirect, url_for, flash
 import os
-import uuid
-from model_web import initialize_model, get_prediction
+from model_web import (initialize_model, start_batcher, enable_prediction_cache, load_for_serving, is_model_ready,
+                       enable_cascade, enable_embedding_store, enable_near_duplicate_index, record_prediction)
 import hashlib
-from datetime import datetime
-import psycopg2
-from urllib.parse import urlparse
+from database import Database
+from slim_checkpoint import slim_path_for
+from prediction_writer import PredictionWriter
+from upload_archive import UploadArchive
+from prediction_jobs import JobQueue
+from prediction_routes import PredictionRoutes
 
 # Import Heroku configuration
 from heroku_config import (
-    DATABASE_URL, SECRET_KEY, PORT, DEBUG, UPLOAD_FOLDER
+    DATABASE_URL, SECRET_KEY, PORT, DEBUG, UPLOAD_FOLDER, ARCHIVE_UPLOADS, MODEL_PATH, MODEL_ARCH,
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, QUANTIZATION, OPTIMIZE_CPU, TTA_VIEWS,
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_DB, WARMUP_BATCH_SIZES, RETRY_AFTER_SECONDS,
+    CASCADE_MODEL_PATH, CASCADE_MODEL_ARCH, CASCADE_THRESHOLD, EMBEDDING_STORE_PATH,
+    NEAR_DUPLICATE_RADIUS, JOB_WORKER_THREADS, JOB_LEASE_SECONDS, JOB_EVENTS_TIMEOUT,
+    BULK_MAX_CONTENT_LENGTH, BULK_MAX_IMAGES, BULK_DECODE_WORKERS, DB_POOL_SIZE,
+    PREDICTION_WRITE_BATCH, PREDICTION_WRITE_DELAY_MS, PREDICTION_WRITE_DURABLE
 )
 
 app = Flask(__name__)
@@ -19,73 +27,68 @@ app.secret_key = SECRET_KEY
 # Configuration
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+HISTORY_PAGE_SIZE = 20  # Rows per history page
+HISTORY_MAX_PAGE_SIZE = 100  # Largest ?limit= accepted by /history/predictions
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-# Database connection helper
-def get_db_connection():
-    if DATABASE_URL.startswith('sqlite'):
-        import sqlite3
-        conn = sqlite3.connect('users.db')
-        conn.row_factory = sqlite3.Row
-        return conn
-    else:
-        # Parse the URL for PostgreSQL
-        result = urlparse(DATABASE_URL)
-        username = result.username
-        password = result.password
-        database = result.path[1:]
-        host = result.hostname
-        port = result.port
-        
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(
-            database=database,
-            user=username,
-            password=password,
-            host=host,
-            port=port
-        )
-        return conn
+# Uploads are analysed in memory; they only reach the (ephemeral) disk when archival is enabled
+upload_archive = UploadArchive(UPLOAD_FOLDER) if ARCHIVE_UPLOADS else None
+
+# Pooled PostgreSQL connections (or per-thread SQLite ones) shared by every request, job and bulk upload
+db = Database(DATABASE_URL, pool_size=DB_POOL_SIZE)
 
 # Initialize database
-def init_db(db_url=None):
-    if not db_url or db_url.startswith('sqlite'):
-        # SQLite initialization
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS predictions
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    filename TEXT,
-                    predicted_class TEXT,
-                    confidence REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id))''')
-        conn.commit()
-        conn.close()
-    else:
-        # PostgreSQL initialization is handled by init_db.py
-        pass
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def init_db():
+    db.init_schema()
+    job_queue.create_table()
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-# Initialize the database
-init_db(DATABASE_URL)
+# Asynchronous predictions are queued in the application database, so pending jobs survive restarts
+job_queue = JobQueue(db, lease_seconds=JOB_LEASE_SECONDS, on_saved=record_prediction)
 
-# Initialize the model
-initialize_model()
+# Prediction rows are written behind the response, many per transaction
+prediction_writer = PredictionWriter(db.insert_predictions, max_batch=PREDICTION_WRITE_BATCH,
+                                     max_delay_ms=PREDICTION_WRITE_DELAY_MS, on_saved=record_prediction)
+
+# Prediction, job, history and health routes, shared with app.py
+routes = PredictionRoutes(db, job_queue, prediction_writer, upload_archive, allowed_extensions=ALLOWED_EXTENSIONS,
+                          max_image_bytes=MAX_CONTENT_LENGTH, bulk_max_content_length=BULK_MAX_CONTENT_LENGTH,
+                          bulk_max_images=BULK_MAX_IMAGES, bulk_decode_workers=BULK_DECODE_WORKERS,
+                          durable_writes=PREDICTION_WRITE_DURABLE, retry_after_seconds=RETRY_AFTER_SECONDS,
+                          job_events_timeout=JOB_EVENTS_TIMEOUT, history_page_size=HISTORY_PAGE_SIZE,
+                          history_max_page_size=HISTORY_MAX_PAGE_SIZE)
+routes.register(app)
+
+# Initialize the database
+init_db()
+
+# Initialize the model in the background so the worker can answer health checks immediately
+def setup_model():
+    # The checkpoint, or only its slim file when just that was deployed (slim_checkpoint.py)
+    has_weights = os.path.exists(MODEL_PATH) or os.path.exists(slim_path_for(MODEL_PATH))
+    initialize_model(MODEL_PATH if has_weights else None, arch=MODEL_ARCH,
+                     quantization=QUANTIZATION, tta=TTA_VIEWS, optimize=OPTIMIZE_CPU)
+    if CASCADE_MODEL_PATH and os.path.exists(CASCADE_MODEL_PATH):
+        enable_cascade(CASCADE_MODEL_PATH, arch=CASCADE_MODEL_ARCH, threshold=CASCADE_THRESHOLD)
+    if EMBEDDING_STORE_PATH:
+        enable_embedding_store(EMBEDDING_STORE_PATH)
+    if NEAR_DUPLICATE_RADIUS is not None:
+        enable_near_duplicate_index(radius=NEAR_DUPLICATE_RADIUS, rows=load_phash_rows())
+    enable_prediction_cache(max_entries=PREDICTION_CACHE_SIZE, db_path=PREDICTION_CACHE_DB)
+
+def load_phash_rows():
+    """Stored hashes and probabilities of earlier predictions, for rebuilding the near-duplicate index"""
+    return db.iter_phash_rows()
+
+def setup_worker():
+    start_batcher(max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+    job_queue.start_workers(routes.run_prediction_job, threads=JOB_WORKER_THREADS, ready=is_model_ready)
+
+load_for_serving(setup_model, setup_worker, warmup_batch_sizes=WARMUP_BATCH_SIZES)
 
 @app.route('/')
 def index():
@@ -99,22 +102,11 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        user = db.find_user(username)
         
-        # Check if using SQLite or PostgreSQL
-        if DATABASE_URL.startswith('sqlite'):
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-            user = cursor.fetchone()
-        else:
-            cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-            user = cursor.fetchone()
-        
-        conn.close()
-        
-        if user and user[2] == hash_password(password):  # Check password hash
-            session['user_id'] = user[0]
-            session['username'] = user[1]
+        if user and user.password_hash == hash_password(password):  # Check password hash
+            session['user_id'] = user.id
+            session['username'] = user.username
             return redirect(url_for('index'))
         else:
             flash('Invalid username or password', 'error')
@@ -130,26 +122,13 @@ def signup():
         # Hash the password
         password_hash = hash_password(password)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         try:
-            # Check if using SQLite or PostgreSQL
-            if DATABASE_URL.startswith('sqlite'):
-                cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", 
-                            (username, password_hash))
-            else:
-                cursor.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s)", 
-                            (username, password_hash))
-            
-            conn.commit()
-            flash('Account created successfully! Please log in.', 'success')
-            return redirect(url_for('login'))
+            if db.create_user(username, password_hash) is not None:
+                flash('Account created successfully! Please log in.', 'success')
+                return redirect(url_for('login'))
+            flash('Username already exists!', 'error')
         except Exception as e:
-            conn.rollback()
             flash(f'Error creating account: {str(e)}', 'error')
-        finally:
-            conn.close()
     
     return render_template('signup.html')
 
@@ -158,85 +137,5 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    
-    if file and allowed_file(file.filename):
-        # Secure the filename and generate a unique name
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Save the file
-        file.save(file_path)
-        
-        try:
-            # Get prediction
-            result = get_prediction(file_path)
-            
-            # Save prediction to database
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Check if using SQLite or PostgreSQL
-            if DATABASE_URL.startswith('sqlite'):
-                cursor.execute(
-                    "INSERT INTO predictions (user_id, filename, predicted_class, confidence) VALUES (?, ?, ?, ?)",
-                    (session['user_id'], unique_filename, result['class'], result['confidence'])
-                )
-            else:
-                cursor.execute(
-                    "INSERT INTO predictions (user_id, filename, predicted_class, confidence) VALUES (%s, %s, %s, %s)",
-                    (session['user_id'], unique_filename, result['class'], result['confidence'])
-                )
-            
-            conn.commit()
-            conn.close()
-            
-            return jsonify(result), 200
-            
-        except Exception as e:
-            # Clean up the file in case of error
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            return jsonify({'error': str(e)}), 500
-    
-    return jsonify({'error': 'File type not allowed'}), 400
-
-@app.route('/history')
-def history():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if using SQLite or PostgreSQL
-    if DATABASE_URL.startswith('sqlite'):
-        cursor.execute(
-            "SELECT * FROM predictions WHERE user_id = ? ORDER BY created_at DESC",
-            (session['user_id'],)
-        )
-    else:
-        cursor.execute(
-            "SELECT * FROM predictions WHERE user_id = %s ORDER BY created_at DESC",
-            (session['user_id'],)
-        )
-    
-    predictions = cursor.fetchall()
-    conn.close()
-    
-    return render_template('history.html', predictions=predictions)
-
 if __name__ == '__main__':
     app.run(debug=DEBUG, host='0.0.0.0', port=PORT)
\ No newline at end of file
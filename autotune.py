@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Tune CPU threads, worker processes and batch size for inference on this machine
+
+Every combination runs ``workers`` processes side by side, each with
+``threads`` intra-op threads, pushing batches of ``batch_size`` images from
+sampleimages/ through the network for a fixed time. The configuration with
+the best aggregate throughput whose p95 batch latency fits the budget is
+written to runtime_config.json, which initialize_model and gunicorn.conf.py
+read at startup.
+
+Usage:
+    python autotune.py                                   # full sweep, default p95 budget
+    python autotune.py --threads 1 2 4 --workers 1 2 4 --batch-sizes 1 8 --duration 10
+    python autotune.py --max-p95-ms 500 --output runtime_config.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+from runtime_config import RUNTIME_CONFIG_PATH
+
+
+def run_worker(checkpoint, quantization, paths, threads, batch_size, duration, barrier, results):
+    """Body of one benchmark process: time forward passes until the deadline"""
+    import torch
+    from model_web import RetinalBlindnessModel
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    model = RetinalBlindnessModel(checkpoint, batch_size=batch_size, scripted_path=None, quantization=quantization)
+    tensors = [model.preprocess(path) for path in paths]
+    batches = [torch.stack([tensors[(start + i) % len(tensors)] for i in range(batch_size)])
+               for start in range(0, len(tensors), batch_size)]
+    network = model.model.eval()
+
+    with torch.no_grad():
+        network(batches[0])  # Warm up kernels before the timed window
+        barrier.wait()  # Raises BrokenBarrierError once measure() gives up on a dead sibling
+        latencies = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            network(batches[len(latencies) % len(batches)])
+            latencies.append((time.perf_counter() - start) * 1000.0)
+    results.put((len(latencies) * batch_size, latencies))
+
+
+def measure(args, paths, threads, workers, batch_size):
+    """Aggregate images/s and p95 batch latency for one configuration
+
+    A configuration whose worker dies (e.g. killed for running out of
+    memory) or that does not finish within ``args.timeout`` seconds is
+    recorded with an ``error`` instead of hanging the sweep.
+    """
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=run_worker,
+                                 args=(args.checkpoint, args.quantization, paths, threads, batch_size,
+                                       args.duration, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    outcomes = []
+    error = None
+    deadline = time.monotonic() + args.duration + args.timeout
+    while len(outcomes) < workers and error is None:
+        try:
+            outcomes.append(results.get(timeout=1.0))
+            continue
+        except queue.Empty:
+            pass
+        exitcodes = [process.exitcode for process in processes]
+        if any(code not in (None, 0) for code in exitcodes):
+            error = f"worker exited with code {next(code for code in exitcodes if code not in (None, 0))}"
+        elif all(code == 0 for code in exitcodes) and results.empty():
+            error = 'worker exited without reporting a result'
+        elif time.monotonic() > deadline:
+            error = f"no result within {args.duration + args.timeout:.0f} s"
+    if error is not None:
+        barrier.abort()
+        for process in processes:
+            process.terminate()
+    for process in processes:
+        process.join()
+
+    if error is not None:
+        return {
+            'num_threads': threads,
+            'workers': workers,
+            'batch_size': batch_size,
+            'throughput': 0.0,
+            'p95_ms': None,
+            'error': error
+        }
+    images = sum(count for count, _ in outcomes)
+    latencies = sorted(latency for _, worker_latencies in outcomes for latency in worker_latencies)
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else float('inf')
+    return {
+        'num_threads': threads,
+        'workers': workers,
+        'batch_size': batch_size,
+        'throughput': images / args.duration,
+        'p95_ms': p95
+    }
+
+
+def main():
+    from model_web import list_images
+
+    cores = os.cpu_count() or 1
+    powers = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cores]
+    parser = argparse.ArgumentParser(description='Autotune inference threading for this machine')
+    parser.add_argument('--checkpoint', default='classifier.pt')
+    parser.add_argument('--quantization', choices=('dynamic', 'static'))
+    parser.add_argument('--images', default='sampleimages')
+    parser.add_argument('--threads', type=int, nargs='+', default=powers)
+    parser.add_argument('--workers', type=int, nargs='+', default=powers)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds measured per configuration')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='seconds allowed on top of --duration for loading the model before a configuration fails')
+    parser.add_argument('--max-p95-ms', type=float, help='latency budget; default is 2x the best p95 seen')
+    parser.add_argument('--allow-oversubscription', action='store_true',
+                        help='also try workers x threads above the core count')
+    parser.add_argument('--output', default=RUNTIME_CONFIG_PATH)
+    args = parser.parse_args()
+
+    paths = list_images(args.images)
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+
+    results = []
+    for workers in args.workers:
+        for threads in args.threads:
+            if workers * threads > cores and not args.allow_oversubscription:
+                continue
+            for batch_size in args.batch_sizes:
+                result = measure(args, paths, threads, workers, batch_size)
+                results.append(result)
+                if 'error' in result:
+                    print(f"workers {workers:>2}  threads {threads:>2}  batch {batch_size:>3}  "
+                          f"failed: {result['error']}")
+                    continue
+                print(f"workers {workers:>2}  threads {threads:>2}  batch {batch_size:>3}  "
+                      f"{result['throughput']:>8.2f} img/s  p95 {result['p95_ms']:>8.1f} ms")
+    if not results:
+        parser.error('No configuration fits on this machine, pass --allow-oversubscription')
+    measured = [result for result in results if 'error' not in result]
+    if not measured:
+        parser.error('Every configuration failed, see the errors above')
+
+    budget = args.max_p95_ms or 2 * min(result['p95_ms'] for result in measured)
+    within_budget = [result for result in measured if result['p95_ms'] <= budget] or measured
+    best = max(within_budget, key=lambda result: (result['throughput'], -result['p95_ms']))
+
+    config = {
+        'num_threads': best['num_threads'],
+        'num_interop_threads': 1,
+        'workers': best['workers'],
+        'batch_size': best['batch_size'],
+        'measured': {
+            'cpu_count': cores,
+            'throughput': best['throughput'],
+            'p95_ms': best['p95_ms'],
+            'p95_budget_ms': budget,
+            'results': results
+        }
+    }
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+    print(f"\nBest: {best['workers']} workers x {best['num_threads']} threads, batch {best['batch_size']} "
+          f"-> {best['throughput']:.2f} img/s, p95 {best['p95_ms']:.1f} ms (budget {budget:.1f} ms)")
+    print(f"Written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
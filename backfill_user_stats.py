@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Rebuild the per-user screening statistics from the predictions table
+
+``user_prediction_stats`` is kept up to date with every insert and is
+filled once when ``init_db`` first creates it; run this after editing or
+deleting prediction rows by hand (``rescore_embeddings.py --update-db``
+does it for you).
+
+Usage:
+    python backfill_user_stats.py                                  # DATABASE_URL, or users.db
+    python backfill_user_stats.py --database-url sqlite:///users.db
+"""
+import argparse
+import os
+import time
+
+from database import Database
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute user_prediction_stats from the predictions table')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///users.db'))
+    args = parser.parse_args()
+
+    url = args.database_url
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+
+    db = Database(url, pool_size=1)
+    db.init_schema()
+    start = time.perf_counter()
+    users = db.rebuild_user_stats()
+    print(f"Rebuilt statistics for {users} users in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
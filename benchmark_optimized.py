@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Equivalence check and speedup of the graph-optimized CPU execution mode
+
+Builds the eager model and the optimized one (BatchNorm and input
+normalization folded, channels-last, TorchScript conv+ReLU fusion), compares
+their probabilities on sampleimages/ and reports latency for both.
+
+Usage:
+    python benchmark_optimized.py --checkpoint classifier.pt
+    python benchmark_optimized.py --tolerance 1e-4 --batch-size 8
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from model_web import RetinalBlindnessModel, list_images
+
+
+def probabilities(model, paths, batch_size):
+    """Class probabilities for every image, each model using its own preprocessing"""
+    return np.concatenate([model._forward(torch.stack([model.preprocess(path) for path in paths[i:i + batch_size]]))
+                           for i in range(0, len(paths), batch_size)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the optimized CPU mode against eager mode')
+    parser.add_argument('--checkpoint', default='classifier.pt')
+    parser.add_argument('--images', default='sampleimages')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--tolerance', type=float, default=1e-3)
+    args = parser.parse_args()
+
+    eager = RetinalBlindnessModel(args.checkpoint, batch_size=args.batch_size, scripted_path=None)
+    optimized = RetinalBlindnessModel(args.checkpoint, batch_size=args.batch_size, scripted_path=None)
+    report = optimized.optimize_for_cpu(tolerance=args.tolerance, measure=True)
+    if not report['enabled']:
+        print(f"Optimized mode rejected: max abs diff {report['max_abs_diff']:.2e} > {args.tolerance:.0e}")
+        return
+
+    print(f"Synthetic input check: max abs probability diff {report['max_abs_diff']:.2e}, "
+          f"conv+ReLU fusion {'on' if report['fused'] else 'off'}")
+    print(f"Latency per image at batch {args.batch_size}: eager {report['eager_ms_per_image']:.1f} ms, "
+          f"optimized {report['optimized_ms_per_image']:.1f} ms ({report['speedup']:.2f}x)")
+
+    paths = list_images(args.images)
+    if paths and eager.is_trained:
+        expected = probabilities(eager, paths, args.batch_size)
+        actual = probabilities(optimized, paths, args.batch_size)
+        print(f"{len(paths)} images from {args.images}: top-1 agreement "
+              f"{(expected.argmax(axis=1) == actual.argmax(axis=1)).mean():.3f}, "
+              f"max abs probability diff {np.abs(expected - actual).max():.2e}")
+
+
+if __name__ == '__main__':
+    main()
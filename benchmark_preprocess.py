@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of image decode and transform time per image
+
+Compares the original PIL -> ToTensor -> Normalize pipeline against the
+reduced-resolution decode and fused normalization in model_web.
+
+Usage:
+    python benchmark_preprocess.py                      # sampleimages/, 5 rounds
+    python benchmark_preprocess.py --images uploads --rounds 20
+"""
+import argparse
+import time
+
+import torch
+import torchvision
+from PIL import Image
+
+from model_web import IMAGENET_MEAN, IMAGENET_STD, INPUT_SIZE, decode_image, image_to_tensor, list_images
+
+legacy_transforms = torchvision.transforms.Compose([
+    torchvision.transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+    torchvision.transforms.ToTensor(),
+    torchvision.transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+])
+
+
+def legacy_decode(path):
+    return Image.open(path).convert('RGB')
+
+
+def time_stages(paths, rounds, decode, transform):
+    """Mean decode and transform milliseconds per image over all rounds"""
+    decode_time = transform_time = 0.0
+    for _ in range(rounds):
+        for path in paths:
+            start = time.perf_counter()
+            image = decode(path)
+            middle = time.perf_counter()
+            transform(image)
+            transform_time += time.perf_counter() - middle
+            decode_time += middle - start
+    count = rounds * len(paths)
+    return decode_time * 1000.0 / count, transform_time * 1000.0 / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image preprocessing')
+    parser.add_argument('--images', default='sampleimages')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    paths = list_images(args.images)
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+    torch.set_num_threads(1)  # Preprocessing runs on request threads, measure it single threaded
+
+    before = time_stages(paths, args.rounds, legacy_decode, legacy_transforms)
+    after = time_stages(paths, args.rounds, decode_image, image_to_tensor)
+
+    max_diff = max(float((legacy_transforms(legacy_decode(p)) - image_to_tensor(decode_image(p))).abs().max())
+                   for p in paths)
+
+    print(f"Preprocessing {len(paths)} images from {args.images}, {args.rounds} rounds (ms per image)")
+    print(f"{'pipeline':<10}{'decode':>10}{'transform':>12}{'total':>10}")
+    for label, (decode_ms, transform_ms) in (('before', before), ('after', after)):
+        print(f"{label:<10}{decode_ms:>10.2f}{transform_ms:>12.2f}{decode_ms + transform_ms:>10.2f}")
+    print(f"Speedup: {sum(before) / sum(after):.2f}x, max abs difference in normalized inputs: {max_diff:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,11 @@ from tkinter.ttk import *
 from tkinter import messagebox
 from PIL import Image
 import os
+import queue
+import threading
 
-import mysql.connector
-from tkinter.filedialog import askopenfilename, asksaveasfilename
-import mysql.connector as sk
+from tkinter.filedialog import askopenfilenames, askdirectory, asksaveasfilename
+from user_store import open_store
 from model import *
 #from send_sms import *
 print('GUI SYSTEM STARTED...')
@@ -26,67 +27,131 @@ def LogIn():
             password = box2.get()
 
             if len(password):
-                query = "SELECT * FROM THEGREAT"
-
-                sql.execute(query)
-
-                data = sql.fetchall()
-
-                g = 0
-                b = 0
-
-                for i in data:
-                    if i[0] == username:
-                        g = 1
-                    if i[1] == password:
-                        b = 1
-
-
-                if g and b:
+                global y
+                # One indexed row lookup instead of reading the whole table
+                if store.authenticate(username, password):
                     messagebox.showinfo('Hello Sir', 'Welcome to the System')
+                    y = True
                 else:
                     messagebox.showinfo('Sorry', 'Wrong Username or Password')
-
-                global y
-                y = True
             else:
                 messagebox.showinfo("Error", "You must enter a password Sir!!")
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+BATCH_SIZE = 8  # Images per forward pass
+
+results = queue.Queue()  # (path, value, class, error) from the inference thread; None when it is finished
+cancel = threading.Event()
+worker = None
+rows = {}  # results table row -> (path, value, class)
+
+
 def OpenFile():
-    username = box1.get()
     if y:
-        try:
-            a = askopenfilename()
-            print(a)
-            value, classes = main(a)
-            messagebox.showinfo("your report", ("Predicted Label is ", value, "\nPredicted Class is ", classes))
-
-            query = 'UPDATE THEGREAT SET PREDICT = "%s" WHERE USERNAME = "%s"'%(value, username)
-
-            sql.execute(query)
-            #print(query)
-            connection.commit()
-
-            #------********************Only use when required to send message
-            #send(value, classes)
-            #------*********************************************************
-            image = Image.open(a)
-            # plotting image
-            file = image.convert('RGB')
-            plt.imshow(np.array(file))
-            plt.title(f'your report is label : {value} class : {classes}')
-            plt.show()
-            #print(image)
-            print('Thanks for using the system !')
-            #fn, text = os.path.splitext(a) #fn stands for filename
-        except Exception as error:
-            print("File not selected ! Exiting..., Please try again")
+        paths = askopenfilenames(filetypes=[('Images', ' '.join('*' + e for e in IMAGE_EXTENSIONS)),
+                                            ('All files', '*.*')])
+        StartPredictions(list(paths))
+    else:
+        messagebox.showinfo("Hello Sir", "You need to Login first")
 
 
+def OpenFolder():
+    if y:
+        folder = askdirectory()
+        if folder:
+            paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                           if name.lower().endswith(IMAGE_EXTENSIONS))
+            if paths:
+                StartPredictions(paths)
+            else:
+                messagebox.showinfo("Sorry Sir", "No images found in this folder")
     else:
         messagebox.showinfo("Hello Sir", "You need to Login first")
 
 
+def StartPredictions(paths):
+    global worker
+    if not paths:
+        return
+    if worker is not None and worker.is_alive():
+        messagebox.showinfo("Please wait", "Still analysing the previous images")
+        return
+    cancel.clear()
+    progress.configure(maximum=len(paths), value=0)
+    status.configure(text=f"Analysing 0 / {len(paths)} images...")
+    button2.state(['disabled'])
+    button4.state(['disabled'])
+    button5.state(['!disabled'])
+    # The forward passes run off the Tk thread so the window keeps responding
+    worker = threading.Thread(target=RunPredictions, args=(paths, box1.get()), daemon=True)
+    worker.start()
+    root.after(100, PollResults)
+
+
+def RunPredictions(paths, username):
+    try:
+        for path, value, classes, error in iter_predictions(paths, batch_size=BATCH_SIZE):
+            if error is None:
+                store.save_prediction(username, value)
+            results.put((path, value, classes, error))
+            if cancel.is_set():
+                break
+    except Exception as error:
+        results.put((None, None, None, str(error)))
+    finally:
+        results.put(None)
+
+
+def PollResults():
+    # Only the Tk thread touches widgets; the worker hands results over through the queue
+    while True:
+        try:
+            item = results.get_nowait()
+        except queue.Empty:
+            root.after(100, PollResults)
+            return
+        if item is None:
+            break
+        path, value, classes, error = item
+        if path is None:
+            messagebox.showinfo("Error", f"Prediction failed: {error}")
+            continue
+        row = table.insert('', END, values=(os.path.basename(path), '' if value is None else value,
+                                            classes or '', 'Done' if error is None else error))
+        rows[row] = (path, value, classes)
+        table.see(row)
+        progress.configure(value=progress['value'] + 1)
+        status.configure(text=f"Analysing {int(progress['value'])} / {int(progress['maximum'])} images...")
+
+    status.configure(text=f"{'Stopped' if cancel.is_set() else 'Finished'}: {int(progress['value'])} images "
+                          f"analysed. Double-click a row to see the image.")
+    button2.state(['!disabled'])
+    button4.state(['!disabled'])
+    button5.state(['disabled'])
+    print('Thanks for using the system !')
+
+
+def CancelPredictions():
+    cancel.set()
+    status.configure(text="Stopping after the current batch...")
+
+
+def ShowImage(event):
+    if table.focus() in rows:
+        path, value, classes = rows[table.focus()]
+        if value is None:
+            return
+        #------********************Only use when required to send message
+        #send(value, classes)
+        #------*********************************************************
+        image = Image.open(path)
+        # plotting image
+        file = image.convert('RGB')
+        plt.imshow(np.array(file))
+        plt.title(f'your report is label : {value} class : {classes}')
+        plt.show()
+
+
 x = 0
 y = False
 
@@ -102,40 +167,26 @@ def Signup():
         messagebox.showinfo("Error", "You must enter something Sir")
 
     if u:
-        query1 = "SELECT * FROM THEGREAT"
-        sql.execute(query1)
-
-        data = sql.fetchall()
-
-        z = 1
-
-        for i in data:
-            if i[0] == username:
-                messagebox.showinfo("Sorry Sir", "This  username is already registered, try a new one")
-                z = 0
-
-        if z:
-            query = "INSERT INTO THEGREAT (USERNAME, PASSWORD) VALUES('%s', '%s')" % (username, password)
+        if store.register(username, password):
             messagebox.showinfo("signed up", ("Hi ",username ,"\n Now you can login with your credentials !"))
-            sql.execute(query)
-            connection.commit()
+        else:
+            messagebox.showinfo("Sorry Sir", "This  username is already registered, try a new one")
 
 
 #-----------------------------------------------------------------------------------------
 
 
-connection = sk.connect(
-    host="localhost",
-    user="root",
-    password="SOURAVs99@",
-    database="batch_db_new"
-)
-
-sql = connection.cursor()
+# MySQL when the server is reachable, otherwise a local SQLite file for offline clinics
+store = open_store({
+    'host': os.environ.get('BDS_DB_HOST', 'localhost'),
+    'user': os.environ.get('BDS_DB_USER', 'root'),
+    'password': os.environ.get('BDS_DB_PASSWORD', 'SOURAVs99@'),
+    'database': os.environ.get('BDS_DB_NAME', 'batch_db_new')
+}, fallback_path='desktop_users.db')
 
 root = Tk()
 
-root.geometry('700x400')
+root.geometry('800x650')
 root.title("SK's Blindness Detection System")
 root.configure(bg='pale turquoise')
 
@@ -161,9 +212,29 @@ button3.grid(padx=10, pady=20, row=3, column=1)
 button1 = Button(root, text="LogIn", command=LogIn)
 button1.grid(padx=10, pady=20, row=3, column=2)
 
-button2 = Button(root, text="Upload Image", command=OpenFile)
+button2 = Button(root, text="Upload Images", command=OpenFile)
 button2.grid(padx=10, pady=20, row=2, column=3)
 
+button4 = Button(root, text="Upload Folder", command=OpenFolder)
+button4.grid(padx=10, pady=20, row=3, column=3)
+
+button5 = Button(root, text="Stop", command=CancelPredictions, state='disabled')
+button5.grid(padx=10, pady=10, row=4, column=3)
+
+progress = Progressbar(root, orient=HORIZONTAL, mode='determinate')
+progress.grid(padx=10, pady=10, row=4, column=0, columnspan=3, sticky='EW')
+
+status = Label(root, text="Log in, then upload images or a folder", font=('Arial', 10))
+status.grid(padx=10, row=5, column=0, columnspan=4, sticky='W')
+
+table = Treeview(root, columns=('file', 'label', 'class', 'status'), show='headings', height=10)
+for column, heading, width in (('file', 'File', 300), ('label', 'Label', 60), ('class', 'Class', 140),
+                               ('status', 'Status', 200)):
+    table.heading(column, text=heading)
+    table.column(column, width=width)
+table.grid(padx=10, pady=10, row=6, column=0, columnspan=4, sticky='NSEW')
+table.bind('<Double-1>', ShowImage)
+
 # concurrency control in InnoDB
 # Read_locks useful when locks another user trying to update the value in the same row which is allocated for another user , both at the same time
 #SELECT * FROM t1, t2 FOR SHARE OF t1 FOR UPDATE OF t2;
@@ -0,0 +1,139 @@
+# Bulk prediction over many uploaded images or ZIP archives, streamed one result per image
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from model_web import IMAGE_EXTENSIONS, serving_model
+
+
+def _is_image(name):
+    return name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def spool_uploads(files, max_memory=8 * 1024 * 1024):
+    """Copy uploaded files into ``(name, file)`` pairs that outlive the request
+
+    Flask closes ``request.files`` once the view returns, before a streamed
+    response body runs, so the uploads are copied first: small ones stay in
+    memory, larger ones (ZIP archives) roll over to a temporary file. The
+    caller closes the files when it is done with them.
+    """
+    spooled = []
+    try:
+        for storage in files:
+            spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+            spooled.append((storage.filename or 'upload', spool))
+            shutil.copyfileobj(storage.stream, spool)
+            spool.seek(0)
+    except BaseException:
+        close_uploads(spooled)
+        raise
+    return spooled
+
+
+def close_uploads(uploads):
+    for _, spool in uploads:
+        spool.close()
+
+
+def iter_uploads(files, max_images=1000, max_image_bytes=16 * 1024 * 1024):
+    """Yield ``(name, data, error)`` for every image in a list of ``(name, file)`` uploads
+
+    Plain images are read as they are; ZIP archives are opened in place and
+    their members read one at a time, so an archive is never extracted or
+    held in memory as a whole. Directories, macOS metadata and
+    non-image members are skipped. ``error`` is set (and ``data`` None) for
+    files that cannot be used; after ``max_images`` images the rest of the
+    upload is reported as one error.
+    """
+    count = 0
+    for name, stream in files:
+        if name.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(stream)
+            except zipfile.BadZipFile as e:
+                yield name, None, f'Invalid ZIP archive: {e}'
+                continue
+            with archive:
+                for info in archive.infolist():
+                    member = f'{name}/{info.filename}'
+                    if info.is_dir() or '__MACOSX/' in info.filename or not _is_image(info.filename):
+                        continue
+                    if count >= max_images:
+                        yield member, None, f'Bulk upload limit of {max_images} images reached'
+                        return
+                    count += 1
+                    if info.file_size > max_image_bytes:
+                        yield member, None, 'Image too large'
+                        continue
+                    try:
+                        yield member, archive.read(info), None
+                    except Exception as e:  # Encrypted, corrupt or unsupported compression
+                        yield member, None, str(e)
+        elif _is_image(name):
+            if count >= max_images:
+                yield name, None, f'Bulk upload limit of {max_images} images reached'
+                return
+            count += 1
+            yield name, stream.read(), None
+        else:
+            yield name, None, 'Invalid file type'
+
+
+def predict_stream(uploads, save=None, decode_workers=4, batch_size=None):
+    """Yield ``(index, name, result)`` for every upload as soon as its inference batch finishes
+
+    Images are decoded on a pool of ``decode_workers`` threads while the
+    previous batch runs through the model, then stacked into batches of
+    ``batch_size`` (the model's by default) for ``predict_tensors``.
+    ``save(items)`` receives each batch's successful ``(name, result)``
+    pairs, e.g. to insert them in one statement. Output order matches the
+    upload order.
+    """
+    model = serving_model()
+    batch_size = batch_size or model.batch_size
+    window = 2 * batch_size  # Decode one batch ahead of inference, bounding memory to two batches of images
+    uploads = enumerate(uploads)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max(1, decode_workers), thread_name_prefix='bulk-decode') as pool:
+        def fill():
+            while len(pending) < window:
+                try:
+                    index, (name, data, error) = next(uploads)
+                except StopIteration:
+                    return
+                future = pool.submit(model.preprocess, data) if error is None else None
+                pending.append((index, name, future, error))
+
+        fill()
+        while pending:
+            batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            fill()  # Next batch decodes while this one runs through the model
+
+            results = {}
+            tensors, decoded = [], []
+            for index, name, future, error in batch:
+                if future is not None:
+                    try:
+                        tensors.append(future.result())
+                        decoded.append(index)
+                        continue
+                    except Exception as e:
+                        error = str(e)
+                results[index] = {'error': error}
+            for index, result in zip(decoded, model.predict_tensors(tensors)):
+                results[index] = result
+
+            saved = [index for index, _, _, _ in batch if 'error' not in results[index]]
+            if save is not None and saved:
+                try:
+                    save([(name, results[index]) for index, name, _, _ in batch if index in saved])
+                except Exception as e:
+                    print(f"Error saving bulk predictions: {e}")
+                    for index in saved:
+                        results[index] = {'error': f'Prediction could not be saved: {e}'}
+            for index, name, _, _ in batch:
+                yield index, name, results[index]
@@ -0,0 +1,45 @@
+import itertools
+import os
+import time
+
+import pytest
+
+import model_web
+
+_users = itertools.count()
+
+
+def wait_until_ready(timeout=300):
+    deadline = time.monotonic() + timeout
+    while not model_web.is_model_ready():
+        assert model_web.get_model_status()['error'] is None
+        assert time.monotonic() < deadline, 'model did not load'
+        time.sleep(0.2)
+
+
+@pytest.fixture(scope='session')
+def web_app(tmp_path_factory):
+    """app.py with its database and caches in a temporary directory and the model loaded"""
+    # app.py keeps users.db and the caches in the working directory; stay there while the model loads
+    cwd, workdir = os.getcwd(), tmp_path_factory.mktemp('app')
+    os.chdir(workdir)
+    try:
+        import app
+        wait_until_ready()
+    finally:
+        os.chdir(cwd)
+    # Job worker threads keep opening connections after the directory is restored
+    app.db.path = str(workdir / 'users.db')
+    return app
+
+
+@pytest.fixture
+def client(web_app):
+    """A test client logged in as a new user"""
+    username = f'user{next(_users)}'
+    user_id = web_app.db.create_user(username, web_app.hash_password(username))
+    client = web_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['username'] = username
+    return client
@@ -0,0 +1,432 @@
+# Pooled, backend-agnostic database access for the web applications (SQLite or PostgreSQL)
+import base64
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+User = namedtuple('User', ['id', 'username', 'password_hash'])
+HistoryEntry = namedtuple('HistoryEntry', ['id', 'filename', 'predicted_class', 'confidence', 'created_at'])
+
+SCHEMA = {
+    'sqlite': [
+        '''CREATE TABLE IF NOT EXISTS users
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS predictions
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            filename TEXT,
+            predicted_class TEXT,
+            confidence REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            phash INTEGER,
+            probabilities TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id))''',
+    ],
+    'postgres': [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS predictions (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER,
+            filename TEXT,
+            predicted_class TEXT,
+            confidence REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            phash BIGINT,
+            probabilities TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id))''',
+    ],
+}
+
+DR_CLASSES = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
+# One count column per class in user_prediction_stats, e.g. 'Proliferative DR' -> count_proliferative_dr
+CLASS_COLUMNS = {name: 'count_' + name.lower().replace(' ', '_') for name in DR_CLASSES}
+
+# Per-user running totals, updated in the transaction that inserts the predictions they summarize
+STATS_TABLE_DDL = '''CREATE TABLE IF NOT EXISTS user_prediction_stats
+           (user_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            {counts},
+            confidence_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            last_prediction_at TIMESTAMP)'''.format(
+    counts=',\n            '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in CLASS_COLUMNS.values()))
+
+# Covers the history page and its keyset pagination: (user_id, created_at, id) in order, the shown columns alongside
+INDEXES = {
+    'sqlite': ['CREATE INDEX IF NOT EXISTS predictions_user_created ON predictions '
+               '(user_id, created_at, id, predicted_class, confidence, filename)'],
+    'postgres': ['CREATE INDEX IF NOT EXISTS predictions_user_created ON predictions '
+                 '(user_id, created_at, id) INCLUDE (predicted_class, confidence, filename)'],
+}
+
+# Columns added to predictions after the first release, for databases created before them
+ADDED_COLUMNS = {
+    'sqlite': [('phash', 'INTEGER'), ('probabilities', 'TEXT')],
+    'postgres': [('phash', 'BIGINT'), ('probabilities', 'TEXT')],
+}
+
+
+class Database:
+    """Connections for one ``DATABASE_URL``, with the SQL dialect differences in one place
+
+    PostgreSQL connections come from a bounded, thread-safe pool: callers
+    wait for a free connection instead of opening new ones, and broken
+    connections are replaced. SQLite gets one long-lived connection per
+    thread in WAL mode, so readers never block the writer. Queries are
+    written with ``?`` placeholders and translated for psycopg2. Both pools
+    are rebuilt after a fork, so a preloading gunicorn master never shares
+    a connection with its workers.
+    """
+    def __init__(self, url='sqlite:///users.db', pool_size=10, timeout=30):
+        self.url = url
+        self.dialect = 'sqlite' if url.startswith('sqlite') else 'postgres'
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._slots = None
+        self._pid = None
+        self._inherited = []  # Connections from before a fork; kept referenced so the child never closes them
+        self.counters = {'acquired': 0, 'waited': 0, 'wait_seconds': 0.0, 'replaced': 0}
+        if self.dialect == 'sqlite':
+            self.path = url.split(':///', 1)[-1] if ':///' in url else url[len('sqlite:'):]  # sqlite:////abs/path keeps its slash
+            self.IntegrityError = sqlite3.IntegrityError
+        else:
+            import psycopg2
+            self.IntegrityError = psycopg2.IntegrityError
+
+    # Connections
+
+    def _sqlite_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if conn is not None:
+                self._inherited.append(conn)  # Closing a parent's SQLite handle in the child could drop its file locks
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints; WAL never corrupts on a crash
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _postgres_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                from psycopg2.pool import ThreadedConnectionPool
+                if self._pool is not None:
+                    self._inherited.append(self._pool)
+                parsed = urlparse(self.url)
+                self._pool = ThreadedConnectionPool(
+                    1, self.pool_size,
+                    database=parsed.path[1:],
+                    user=parsed.username,
+                    password=parsed.password,
+                    host=parsed.hostname,
+                    port=parsed.port
+                )
+                self._slots = threading.BoundedSemaphore(self.pool_size)
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    @contextlib.contextmanager
+    def connection(self):
+        """A connection for one unit of work: committed on success, rolled back on error
+
+        Not re-entrant: on SQLite a nested block shares the thread's connection and transaction.
+        """
+        if self.dialect == 'sqlite':
+            conn = self._sqlite_connection()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return
+
+        pool, slots = self._postgres_pool()
+        start = time.perf_counter()
+        if not slots.acquire(blocking=False):
+            self._count('waited')
+            if not slots.acquire(timeout=self.timeout):
+                raise RuntimeError(f'No database connection free after {self.timeout:.0f}s')
+        self._count('wait_seconds', time.perf_counter() - start)
+        self._count('acquired')
+        conn = None
+        broken = False
+        try:
+            conn = pool.getconn()
+            if conn.closed:
+                pool.putconn(conn, close=True)
+                self._count('replaced')
+                conn = pool.getconn()
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            import psycopg2
+            broken = conn is None or conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            if conn is not None:
+                if broken:
+                    self._count('replaced')
+                pool.putconn(conn, close=broken)
+            slots.release()
+
+    def _count(self, name, amount=1):
+        with self._lock:  # Every request thread updates these
+            self.counters[name] += amount
+
+    def translate(self, query):
+        """Rewrite ``?`` placeholders for psycopg2 (literal ``%`` must be doubled there)"""
+        if self.dialect == 'postgres':
+            return query.replace('%', '%%').replace('?', '%s')
+        return query
+
+    # Generic query helpers
+
+    def execute(self, query, params=()):
+        """Run a statement and return the number of affected rows"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.translate(query), params)
+            return cursor.rowcount
+
+    def execute_many(self, query, rows):
+        with self.connection() as conn:
+            conn.cursor().executemany(self.translate(query), rows)
+
+    def fetch_one(self, query, params=()):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.translate(query), params)
+            row = cursor.fetchone()
+            return tuple(row) if row is not None else None
+
+    def fetch_all(self, query, params=()):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.translate(query), params)
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def fetch_value(self, query, params=(), default=None):
+        row = self.fetch_one(query, params)
+        return row[0] if row is not None else default
+
+    def iter_rows(self, query, params=(), batch_size=1000):
+        """Yield the rows of a large query without loading them all (server-side cursor on PostgreSQL)"""
+        with self.connection() as conn:
+            if self.dialect == 'postgres':
+                cursor = conn.cursor(name=f'iter_{threading.get_ident()}_{time.monotonic_ns()}')
+                cursor.itersize = batch_size
+            else:
+                cursor = conn.cursor()
+            cursor.execute(self.translate(query), params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+            cursor.close()
+
+    def _insert_rows(self, cursor, table, columns, rows):
+        names = ', '.join(columns)
+        if self.dialect == 'postgres':
+            from psycopg2.extras import execute_values
+            return [row[0] for row in execute_values(
+                cursor, f'INSERT INTO {table} ({names}) VALUES %s RETURNING id', rows,
+                page_size=len(rows), fetch=True)]
+        cursor.executemany(f'INSERT INTO {table} ({names}) VALUES ({", ".join("?" * len(columns))})', rows)
+        # SQLite has a single writer and AUTOINCREMENT only grows, so one transaction's rows get consecutive ids
+        last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def insert_many(self, table, columns, rows):
+        """Insert rows in one transaction and return their ids in order"""
+        if not rows:
+            return []
+        with self.connection() as conn:
+            return self._insert_rows(conn.cursor(), table, columns, rows)
+
+    def insert(self, table, columns, row):
+        return self.insert_many(table, columns, [row])[0]
+
+    # Schema
+
+    def init_schema(self):
+        """Create the application tables and add columns missing from older databases"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA[self.dialect]:
+                cursor.execute(statement)
+            if self.dialect == 'sqlite':
+                cursor.execute('PRAGMA table_info(predictions)')
+                existing = {row[1] for row in cursor.fetchall()}
+                for column, column_type in ADDED_COLUMNS['sqlite']:
+                    if column not in existing:
+                        cursor.execute(f'ALTER TABLE predictions ADD COLUMN {column} {column_type}')
+            else:
+                for column, column_type in ADDED_COLUMNS['postgres']:
+                    cursor.execute(f'ALTER TABLE predictions ADD COLUMN IF NOT EXISTS {column} {column_type}')
+            for statement in INDEXES[self.dialect]:
+                cursor.execute(statement)
+            if self.dialect == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_prediction_stats'")
+                stats_missing = cursor.fetchone() is None
+            else:
+                cursor.execute("SELECT to_regclass('user_prediction_stats') IS NULL")
+                stats_missing = cursor.fetchone()[0]
+            cursor.execute(STATS_TABLE_DDL)
+            if stats_missing:
+                self._backfill_user_stats(cursor)  # First run on a database with history: summarize it once
+
+    # Typed application queries
+
+    def find_user(self, username):
+        row = self.fetch_one('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
+        return User(*row) if row is not None else None
+
+    def create_user(self, username, password_hash):
+        """Insert a user and return its id, or None when the username is taken"""
+        try:
+            return self.insert('users', ('username', 'password_hash'), (username, password_hash))
+        except self.IntegrityError:
+            return None
+
+    def insert_predictions(self, rows, cursor=None):
+        """Insert ``(user_id, filename, predicted_class, confidence, phash, probabilities)`` rows, return ids
+
+        The users' rows in ``user_prediction_stats`` are updated in the same
+        transaction, so the summary never disagrees with the history. With
+        ``cursor`` the rows join the caller's open transaction instead of
+        committing their own.
+        """
+        if not rows:
+            return []
+        if cursor is None:
+            with self.connection() as conn:
+                return self.insert_predictions(rows, conn.cursor())
+        ids = self._insert_rows(cursor, 'predictions', ('user_id', 'filename', 'predicted_class', 'confidence',
+                                                        'phash', 'probabilities'), rows)
+        self._add_user_stats(cursor, rows)
+        return ids
+
+    def _add_user_stats(self, cursor, rows):
+        """Fold inserted prediction rows into the per-user totals (one upsert per user, not per row)"""
+        totals = {}
+        for user_id, _, predicted_class, confidence, _, _ in rows:
+            if user_id is None:
+                continue
+            total = totals.setdefault(user_id, dict.fromkeys(['total', 'confidence_sum', *CLASS_COLUMNS.values()], 0))
+            total['total'] += 1
+            total['confidence_sum'] += float(confidence or 0.0)
+            if predicted_class in CLASS_COLUMNS:
+                total[CLASS_COLUMNS[predicted_class]] += 1
+        if not totals:
+            return
+        columns = ['total', *CLASS_COLUMNS.values(), 'confidence_sum']
+        cursor.executemany(self.translate(
+            f'INSERT INTO user_prediction_stats (user_id, {", ".join(columns)}, last_prediction_at) '
+            f'VALUES (?, {", ".join("?" * len(columns))}, CURRENT_TIMESTAMP) '
+            f'ON CONFLICT (user_id) DO UPDATE SET '
+            + ', '.join(f'{column} = user_prediction_stats.{column} + excluded.{column}' for column in columns)
+            + ', last_prediction_at = excluded.last_prediction_at'),
+            [(user_id, *(total[column] for column in columns)) for user_id, total in sorted(totals.items())])
+
+    def _backfill_user_stats(self, cursor):
+        if self.dialect == 'postgres':
+            cursor.execute('LOCK TABLE user_prediction_stats IN EXCLUSIVE MODE')  # Hold off concurrent inserts
+        cursor.execute('DELETE FROM user_prediction_stats')
+        counts = ', '.join(f"SUM(CASE WHEN predicted_class = '{name}' THEN 1 ELSE 0 END)"
+                           for name in CLASS_COLUMNS)
+        cursor.execute(
+            f'INSERT INTO user_prediction_stats (user_id, total, {", ".join(CLASS_COLUMNS.values())}, '
+            f'confidence_sum, last_prediction_at) '
+            f'SELECT user_id, COUNT(*), {counts}, COALESCE(SUM(confidence), 0), MAX(created_at) '
+            f'FROM predictions WHERE user_id IS NOT NULL GROUP BY user_id')
+        return cursor.rowcount
+
+    def rebuild_user_stats(self):
+        """Recompute ``user_prediction_stats`` from the whole predictions table; returns the number of users"""
+        with self.connection() as conn:
+            return self._backfill_user_stats(conn.cursor())
+
+    def user_stats(self, user_id):
+        """A user's screening summary: one primary-key lookup, however long the history"""
+        columns = ['total', *CLASS_COLUMNS.values(), 'confidence_sum', 'last_prediction_at']
+        row = self.fetch_one(f'SELECT {", ".join(columns)} FROM user_prediction_stats WHERE user_id = ?', (user_id,))
+        values = dict(zip(columns, row)) if row is not None else dict.fromkeys(columns, 0)
+        return {
+            'total': values['total'],
+            'by_class': {name: values[column] for name, column in CLASS_COLUMNS.items()},
+            'mean_confidence': values['confidence_sum'] / values['total'] if values['total'] else None,
+            'last_prediction_at': str(values['last_prediction_at']) if values['total'] else None
+        }
+
+    def prediction_page(self, user_id, limit=20, cursor=None):
+        """One page of a user's history, newest first, and the cursor of the next page (None on the last one)
+
+        Keyset pagination: the cursor encodes the ``(created_at, id)`` of the
+        last row shown and the next page starts right after it, so every page
+        is one index range scan however far back the user goes.
+        """
+        query = 'SELECT id, filename, predicted_class, confidence, created_at FROM predictions WHERE user_id = ?'
+        params = [user_id]
+        if cursor is not None:
+            created_at, last_id = decode_cursor(cursor)
+            query += ' AND (created_at, id) < (?, ?)'
+            params += [created_at, last_id]
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        rows = [HistoryEntry(*row) for row in self.fetch_all(query, params + [limit + 1])]
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    def iter_user_predictions(self, user_id):
+        """Every prediction of a user, newest first, streamed (server-side cursor on PostgreSQL) for exports"""
+        return self.iter_rows('SELECT id, filename, predicted_class, confidence, created_at, probabilities '
+                              'FROM predictions WHERE user_id = ? ORDER BY created_at DESC, id DESC', (user_id,))
+
+    def iter_phash_rows(self):
+        """``(id, phash, probabilities)`` of every hashed prediction, streamed for the near-duplicate index"""
+        return self.iter_rows('SELECT id, phash, probabilities FROM predictions WHERE phash IS NOT NULL')
+
+    def stats(self):
+        stats = {'dialect': self.dialect, 'pool_size': self.pool_size if self.dialect == 'postgres' else None}
+        with self._lock:
+            stats.update(self.counters)
+        return stats
+
+
+def encode_cursor(created_at, prediction_id):
+    """Opaque, URL-safe page cursor for ``prediction_page``"""
+    token = json.dumps([str(created_at), prediction_id]).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """``(created_at, id)`` from a page cursor; raises ValueError if it was not made by encode_cursor"""
+    try:
+        created_at, prediction_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(created_at), int(prediction_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid history cursor: {cursor!r}') from e
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Distill the ResNet-152 classifier into a small student model
+
+The student (ResNet-18, MobileNetV3, ...) gets the same 5-class head and is
+trained on the teacher's temperature-softened probabilities, so any folder
+of unlabeled fundus images works as training data. Everything runs on CPU.
+The result is a normal checkpoint that initialize_model(model_path, arch=...)
+loads.
+
+Usage:
+    python distill.py --images sampleimages --arch resnet18 --epochs 5
+    python distill.py --teacher classifier.pt --arch mobilenet_v3_small --output student.pt --pretrained
+"""
+import argparse
+import random
+
+import torch
+import torch.nn.functional as F
+
+from model_web import ARCHITECTURES, RetinalBlindnessModel, _time_forward, list_images
+
+
+def teacher_log_probs(teacher, inputs, batch_size):
+    """Teacher log-probabilities for every input, computed once up front"""
+    teacher.model.eval()
+    with torch.no_grad():
+        return torch.cat([teacher.model(inputs[i:i + batch_size].to(teacher.device)).cpu()
+                          for i in range(0, len(inputs), batch_size)])
+
+
+def agreement(teacher_logp, student, inputs, batch_size):
+    """Fraction of inputs where the student's top-1 class matches the teacher's"""
+    student.model.eval()
+    with torch.no_grad():
+        student_logp = torch.cat([student.model(inputs[i:i + batch_size].to(student.device)).cpu()
+                                  for i in range(0, len(inputs), batch_size)])
+    return float((student_logp.argmax(dim=1) == teacher_logp.argmax(dim=1)).float().mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill classifier.pt into a smaller student model')
+    parser.add_argument('--teacher', default='classifier.pt')
+    parser.add_argument('--images', default='sampleimages', help='folder of (unlabeled) training images')
+    parser.add_argument('--arch', default='resnet18', choices=sorted(a for a in ARCHITECTURES if a != 'resnet152'))
+    parser.add_argument('--pretrained', action='store_true', help='start from ImageNet backbone weights')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--val-fraction', type=float, default=0.2, help='images held out for the agreement report')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='student.pt')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    teacher = RetinalBlindnessModel(args.teacher, scripted_path=None)
+    if not teacher.is_trained:
+        parser.error(f"Could not load teacher weights from {args.teacher}")
+    student = RetinalBlindnessModel(None, arch=args.arch, scripted_path=None)
+    if args.pretrained:
+        student.model = student._build_model(weights='DEFAULT')
+    for param in student.model.parameters():
+        param.requires_grad = True
+
+    paths = list_images(args.images)
+    if len(paths) < 2:
+        parser.error(f"Need at least 2 images in {args.images}")
+    random.shuffle(paths)
+    val_count = max(1, int(len(paths) * args.val_fraction))
+    val_paths, train_paths = paths[:val_count], paths[val_count:]
+
+    # Horizontal flips double the training set; soft targets are computed per view
+    train = torch.stack([teacher.preprocess(path) for path in train_paths])
+    train = torch.cat([train, torch.flip(train, dims=[3])])
+    val = torch.stack([teacher.preprocess(path) for path in val_paths])
+    train_targets = teacher_log_probs(teacher, train, args.batch_size)
+    val_targets = teacher_log_probs(teacher, val, args.batch_size)
+
+    optimizer = torch.optim.Adam(student.model.parameters(), lr=args.lr)
+    temperature = args.temperature
+    print(f"Distilling {args.arch} on {len(train_paths)} images (+flips), {len(val_paths)} held out")
+    for epoch in range(args.epochs):
+        student.model.train()
+        order = torch.randperm(len(train))
+        total = 0.0
+        for start in range(0, len(train), args.batch_size):
+            index = order[start:start + args.batch_size]
+            if len(index) < 2:
+                continue  # BatchNorm needs more than one sample in training mode
+            # Both heads end in LogSoftmax; dividing log-probabilities by T softens them like logits
+            student_logp = F.log_softmax(student.model(train[index].to(student.device)) / temperature, dim=1)
+            target_logp = F.log_softmax(train_targets[index].to(student.device) / temperature, dim=1)
+            loss = F.kl_div(student_logp, target_logp, log_target=True, reduction='batchmean') * temperature ** 2
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(index)
+        print(f"epoch {epoch + 1}/{args.epochs}  distillation loss {total / len(train):.4f}")
+
+    train_agreement = agreement(train_targets, student, train, args.batch_size)
+    val_agreement = agreement(val_targets, student, val, args.batch_size)
+    example = val[:1].to(teacher.device)
+    teacher_ms = _time_forward(teacher.model.eval(), example)
+    student_ms = _time_forward(student.model.eval(), example)
+
+    torch.save({
+        'arch': args.arch,
+        'model_state_dict': student.model.state_dict(),
+        'teacher': args.teacher,
+        'temperature': temperature,
+        'val_agreement': val_agreement
+    }, args.output)
+
+    print(f"\nTop-1 agreement with teacher: train {train_agreement:.3f}, held out {val_agreement:.3f}")
+    print(f"Latency at batch 1: teacher {teacher_ms:.1f} ms, student {student_ms:.1f} ms "
+          f"(student takes {student_ms / teacher_ms:.2f}x the teacher's time)")
+    print(f"Student written to {args.output}; load it with initialize_model('{args.output}', arch='{args.arch}')")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Append-only, memory-mapped store of penultimate-layer embeddings keyed by prediction id
+import fcntl
+import os
+import threading
+
+import numpy as np
+
+MAGIC = b'RBDEMB01'
+HEADER_SIZE = 16  # MAGIC + little-endian uint64 embedding dimension
+
+
+class EmbeddingStore:
+    """Fixed-size float16 records of (prediction id, pooled feature vector)
+
+    Each append is a single write of one record under an exclusive file
+    lock, so several gunicorn workers can share one file. Reads memory-map
+    the whole file, which makes scanning millions of vectors cheap. A
+    prediction id appended twice resolves to its latest record.
+    """
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = int(dim)
+        self.dtype = np.dtype([('id', '<i8'), ('vector', '<f2', (self.dim,))])
+        self._lock = threading.Lock()
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            stored_dim = read_dim(path)
+            if stored_dim != self.dim:
+                raise ValueError(f"{path} holds {stored_dim}-d embeddings, expected {self.dim}")
+        else:
+            with open(path, 'wb') as f:
+                f.write(MAGIC + np.uint64(self.dim).tobytes())
+
+    def append(self, prediction_id, vector):
+        record = np.zeros(1, dtype=self.dtype)
+        record['id'] = prediction_id
+        record['vector'] = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        with self._lock, open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(record.tobytes())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def records(self):
+        """Memory-mapped view of every complete record (ids and float16 vectors)"""
+        return open_records(self.path)
+
+    def get(self, prediction_id):
+        """Latest stored vector for a prediction id, or None"""
+        records = self.records()
+        matches = np.flatnonzero(records['id'] == prediction_id)
+        if len(matches) == 0:
+            return None
+        return np.asarray(records['vector'][matches[-1]], dtype=np.float32)
+
+    def __len__(self):
+        return len(self.records())
+
+
+def read_dim(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not an embedding store")
+    return int(np.frombuffer(header[len(MAGIC):], dtype='<u8')[0])
+
+
+def open_records(path):
+    """Memory-map the records of a store file without loading it"""
+    dim = read_dim(path)
+    dtype = np.dtype([('id', '<i8'), ('vector', '<f2', (dim,))])
+    count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize  # Ignore a partially written tail
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Export classifier.pt as a frozen TorchScript artifact for fast worker startup
+
+Usage:
+    python export_model.py                              # classifier.pt -> classifier_scripted.pt
+    python export_model.py --checkpoint path/to/classifier.pt --output model.pt
+    python export_model.py --compare                    # also time both startup paths
+"""
+import argparse
+import time
+
+from model_web import RetinalBlindnessModel, SCRIPTED_MODEL_PATH
+
+
+def time_startup(label, repeats, **kwargs):
+    """Construct RetinalBlindnessModel several times and report the mean wall time"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        RetinalBlindnessModel(**kwargs)
+        timings.append(time.perf_counter() - start)
+    mean = sum(timings) / len(timings)
+    print(f"{label:<28} mean {mean:.3f}s  min {min(timings):.3f}s  ({repeats} runs)")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a frozen TorchScript inference model')
+    parser.add_argument('--checkpoint', default='classifier.pt', help='training checkpoint to export')
+    parser.add_argument('--output', default=SCRIPTED_MODEL_PATH, help='where to write the TorchScript file')
+    parser.add_argument('--compare', action='store_true', help='compare startup time of both load paths')
+    parser.add_argument('--repeats', type=int, default=3, help='startup timing repetitions for --compare')
+    args = parser.parse_args()
+
+    model = RetinalBlindnessModel(args.checkpoint, scripted_path=None)
+    model.export_torchscript(args.output)
+
+    if args.compare:
+        print("\nStartup time comparison:")
+        eager = time_startup('eager + load_state_dict', args.repeats, model_path=args.checkpoint, scripted_path=None)
+        scripted = time_startup('frozen TorchScript', args.repeats, model_path=args.checkpoint, scripted_path=args.output)
+        print(f"Speedup: {eager / scripted:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+# Gunicorn settings for serving the web application
+#
+# With PRELOAD_MODEL enabled (the default) the app, and with it the model, is
+# imported once in the master before workers fork. Every worker then reads
+# the same physical weight pages; see model_web.load_for_serving.
+import json
+import os
+
+# Worker count tuned by autotune.py, unless WEB_CONCURRENCY overrides it
+_runtime_config_path = os.environ.get('RUNTIME_CONFIG', 'runtime_config.json')
+_tuned = {}
+if os.path.exists(_runtime_config_path):
+    with open(_runtime_config_path) as f:
+        _tuned = json.load(f)
+
+workers = int(os.environ.get('WEB_CONCURRENCY', _tuned.get('workers', 2)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))  # Concurrent requests per worker feed the micro-batcher
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+preload_app = os.environ.get('PRELOAD_MODEL', 'true').lower() == 'true'
+if preload_app:
+    # Read by model_web when app.py / app_heroku.py is imported in the master
+    os.environ['MODEL_PRELOAD'] = '1'
+
+# Recycling workers re-forks them from the master, which resets any pages that
+# drifted from shared to private over a worker's lifetime
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import model_web
+        model_web.after_fork()
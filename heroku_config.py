@@ -9,6 +9,15 @@ DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
 if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 
+# Pooled PostgreSQL connections per process; cover the gunicorn threads plus the job workers
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+
+# Write-behind prediction rows: flushed at PREDICTION_WRITE_BATCH rows or after PREDICTION_WRITE_DELAY_MS,
+# with PREDICTION_WRITE_DURABLE=true /predict answers only once its row is committed
+PREDICTION_WRITE_BATCH = int(os.environ.get('PREDICTION_WRITE_BATCH', 256))
+PREDICTION_WRITE_DELAY_MS = float(os.environ.get('PREDICTION_WRITE_DELAY_MS', 50))
+PREDICTION_WRITE_DURABLE = os.environ.get('PREDICTION_WRITE_DURABLE', 'False').lower() == 'true'
+
 # Secret key from environment variable
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 
@@ -18,8 +27,52 @@ PORT = int(os.environ.get('PORT', 8081))
 # Debug mode (disable in production)
 DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
 
-# Configure uploads folder
-UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+# Model weights and architecture: classifier.pt (resnet152) or a student from distill.py
+MODEL_PATH = os.environ.get('MODEL_PATH', 'classifier.pt')
+MODEL_ARCH = os.environ.get('MODEL_ARCH', 'resnet152')
+
+# Confidence-gated cascade: a cheap first-stage model answers confident No DR/Mild cases
+CASCADE_MODEL_PATH = os.environ.get('CASCADE_MODEL_PATH', 'student.pt')
+CASCADE_MODEL_ARCH = os.environ.get('CASCADE_MODEL_ARCH', 'resnet18')
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', 0.9))
+
+# Perceptual-hash reuse of earlier predictions: max differing bits of the 64-bit hash, unset to disable
+NEAR_DUPLICATE_RADIUS = int(os.environ['NEAR_DUPLICATE_RADIUS']) if os.environ.get('NEAR_DUPLICATE_RADIUS') else None
+
+# /predict/bulk: request size limit, images per request, decode threads
+BULK_MAX_CONTENT_LENGTH = int(os.environ.get('BULK_MAX_CONTENT_MB', 512)) * 1024 * 1024
+BULK_MAX_IMAGES = int(os.environ.get('BULK_MAX_IMAGES', 1000))
+BULK_DECODE_WORKERS = int(os.environ.get('BULK_DECODE_WORKERS', 4))
+
+# Asynchronous /predict/jobs: worker threads per process, lease before an abandoned job is retried, SSE stream limit
+JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 2))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 120))
+JOB_EVENTS_TIMEOUT = float(os.environ.get('JOB_EVENTS_TIMEOUT', 300))
+
+# Append-only store of pooled features per prediction for rescore_embeddings.py; unset to disable
+EMBEDDING_STORE_PATH = os.environ.get('EMBEDDING_STORE_PATH') or None
 
-# Create uploads directory if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
\ No newline at end of file
+# Micro-batching of concurrent /predict requests
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+
+# INT8 quantized inference: unset for fp32, 'dynamic' or 'static' (see quantization_report.py)
+QUANTIZATION = os.environ.get('QUANTIZATION') or None
+
+# Graph-optimized fp32 CPU mode (BatchNorm/normalization folding, channels-last, conv+ReLU fusion)
+OPTIMIZE_CPU = os.environ.get('OPTIMIZE_CPU', 'False').lower() == 'true'
+
+# Test-time augmentation: comma separated view names from model_web.TTA_VIEWS, e.g. "identity,hflip"
+TTA_VIEWS = [name.strip() for name in os.environ.get('TTA_VIEWS', '').split(',') if name.strip()] or None
+
+# Content-addressed prediction cache: in-memory LRU size and SQLite file backing it
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+PREDICTION_CACHE_DB = os.environ.get('PREDICTION_CACHE_DB', 'prediction_cache.db')
+
+# Model warmup before the worker reports ready on /readyz
+WARMUP_BATCH_SIZES = [int(size) for size in os.environ.get('WARMUP_BATCH_SIZES', f'1,{BATCH_MAX_SIZE}').split(',')]
+RETRY_AFTER_SECONDS = int(os.environ.get('RETRY_AFTER_SECONDS', 5))
+
+# Uploads are analysed in memory; set ARCHIVE_UPLOADS=true to also keep a copy in UPLOAD_FOLDER
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+ARCHIVE_UPLOADS = os.environ.get('ARCHIVE_UPLOADS', 'False').lower() == 'true'
\ No newline at end of file
@@ -1,6 +1,6 @@
 import os
-import psycopg2
-from urllib.parse import urlparse
+from database import Database
+from prediction_jobs import JobQueue
 
 # Get database URL from environment
 database_url = os.environ.get('DATABASE_URL')
@@ -15,49 +15,10 @@ if not database_url:
     init_db()
     exit(0)
 
-# Parse the URL
-result = urlparse(database_url)
-username = result.username
-password = result.password
-database = result.path[1:]
-host = result.hostname
-port = result.port
+# Create the users and predictions tables (adding columns missing from older databases)
+db = Database(database_url, pool_size=1)
+db.init_schema()
 
-# Connect to the database
-conn = psycopg2.connect(
-    database=database,
-    user=username,
-    password=password,
-    host=host,
-    port=port
-)
-
-# Create tables
-with conn.cursor() as cur:
-    # Create users table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Create predictions table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS predictions (
-        id SERIAL PRIMARY KEY,
-        user_id INTEGER,
-        filename TEXT,
-        predicted_class TEXT,
-        confidence REAL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    conn.commit()
-    print("Database tables created successfully.")
-
-conn.close()
\ No newline at end of file
+# Persistent queue behind /predict/jobs
+JobQueue(db).create_table()
+print("Database tables created successfully.")
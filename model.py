@@ -15,6 +15,7 @@ from torch.optim import lr_scheduler
 import random
 import os
 import sys
+from slim_checkpoint import slim_path_for, supports_mmap, load_slim_state_dict
 
 print('Imported packages')
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -43,6 +44,19 @@ optimizer = torch.optim.Adam(filter(lambda p:p.requires_grad,model.parameters())
 scheduler = lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.1)
 
 def load_model(path):
+    # Inference-only weights written by slim_checkpoint.py skip the unused optimizer state
+    slim_path = slim_path_for(path)
+    if os.path.exists(slim_path) and (not os.path.exists(path) or os.path.getmtime(slim_path) >= os.path.getmtime(path)):
+        state_dict = load_slim_state_dict(slim_path, arch='resnet152')
+        if not supports_mmap():
+            model.load_state_dict(state_dict)
+            return model
+        # Build on the meta device and adopt the memory-mapped tensors instead of copying them
+        with torch.device('meta'):
+            slim_model = models.resnet152(pretrained=False)
+            slim_model.fc = nn.Sequential(nn.Linear(num_ftrs, 512),nn.ReLU(),nn.Linear(512,out_ftrs),nn.LogSoftmax(dim=1))
+        slim_model.load_state_dict(state_dict, assign=True)
+        return slim_model.float().to(device)
     checkpoint = torch.load(path,map_location='cpu')
     model.load_state_dict(checkpoint['model_state_dict'])
     optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
@@ -73,13 +87,37 @@ print("Model loaded Succesfully")
 classes = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
 test_transforms = torchvision.transforms.Compose([
     torchvision.transforms.Resize((224, 224)),
-    torchvision.transforms.RandomHorizontalFlip(p=0.5),
     torchvision.transforms.ToTensor(),
     torchvision.transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
 ])
 def main(path):
     x, y = inference(model, path, test_transforms, classes)
     return x, y
+def iter_predictions(paths, batch_size=8):
+    """Yield (path, value, class, error) for each image, batch_size images per forward pass
+
+    Results of a batch are yielded as soon as it finishes; an image that
+    cannot be opened gets an error and no value instead of stopping the rest.
+    """
+    model.eval()
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        images, errors = [], {}
+        for i, path in enumerate(chunk):
+            try:
+                images.append((i, test_transforms(Image.open(path).convert('RGB'))))
+            except Exception as e:
+                errors[i] = str(e)
+        values = {}
+        if images:
+            with torch.no_grad():
+                out = model(torch.stack([img for _, img in images]).to(device))
+            values = dict(zip([i for i, _ in images], torch.exp(out).argmax(dim=1).tolist()))
+        for i, path in enumerate(chunk):
+            if i in values:
+                yield path, values[i], classes[values[i]], None
+            else:
+                yield path, None, None, errors[i]
 # if __name__ == '__model__':
 #     # test_dir = '../Desktop/eye'
 #     # folders = os.listdir(test_dir)
@@ -2,62 +2,181 @@
 import numpy as np
 import torch
 from torch import nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 import torchvision
 from torchvision import models
 from PIL import Image
+from collections import Counter, deque
+import contextlib
+import copy
+import gc
+import hashlib
+import io
+import json
 import os
+import queue
+import threading
+import time
+
+from runtime_config import RUNTIME_CONFIG_PATH, load_runtime_config, apply_thread_settings
+from slim_checkpoint import slim_path_for, supports_mmap, load_slim_state_dict
 
 print('Imported packages for web application')
 
 class RetinalBlindnessModel:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, batch_size=16, scripted_path=None,
+                 quantization=None, calibration_dir='sampleimages', tta=None, fast_preprocess=True,
+                 prefer_slim=True, optimize=False, arch='resnet152'):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.classes = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
         self.is_trained = False  # Default to untrained
-        
-        # Initialize model
-        self.model = models.resnet152(weights=None)
-        num_ftrs = self.model.fc.in_features
-        out_ftrs = 5
-        self.model.fc = nn.Sequential(
-            nn.Linear(num_ftrs, 512),
-            nn.ReLU(),
-            nn.Linear(512, out_ftrs),
-            nn.LogSoftmax(dim=1)
-        )
-        
-        # Unfreeze specific layers
-        for name, child in self.model.named_children():
-            if name in ['layer2', 'layer3', 'layer4', 'fc']:
-                for param in child.parameters():
-                    param.requires_grad = True
-            else:
-                for param in child.parameters():
-                    param.requires_grad = False
-        
-        self.model.to(self.device)
+        if arch not in ARCHITECTURES:
+            raise ValueError(f"Unknown architecture {arch!r}, expected one of {sorted(ARCHITECTURES)}")
+        self.arch = arch  # resnet152 teacher, or a smaller student from distill.py
+        self.batch_size = max(1, int(batch_size))  # Max images per forward pass in predict_batch
+        self.tta_views = _resolve_tta_views(tta)  # Empty tuple means deterministic single-view inference
+        self.fast_preprocess = fast_preprocess  # Reduced-size decode + fused normalization instead of test_transforms
+        self.prefer_slim = prefer_slim  # Load <checkpoint>_slim.pt instead of the training checkpoint when present
         
         # Define transforms
         self.test_transforms = torchvision.transforms.Compose([
             torchvision.transforms.Resize((224, 224)),
-            torchvision.transforms.RandomHorizontalFlip(p=0.5),
             torchvision.transforms.ToTensor(),
-            torchvision.transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
+            torchvision.transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
         ])
         
+        if quantization and optimize:
+            raise ValueError('Choose either quantization or the optimized fp32 mode, not both')
+        
+        self.quantization = None
+        self.optimized = False  # Graph-optimized mode from optimize_for_cpu
+        self.channels_last = False
+        self.input_normalized = True  # False once ImageNet normalization is folded into conv1
+        self.weights_path = None  # File the trained weights came from, used by fingerprint()
+        self.weights_mmapped = False  # Parameters are backed by a read-only file mapping
+        self.capture_embeddings = False  # Attach the head's pooled input features to results, see enable_embeddings
+        self.embedding_dim = None
+        self._embedding_local = threading.local()  # Per-thread slot the head hook writes features into
+
+        # Prefer a frozen TorchScript artifact: no Python model construction or state-dict copy.
+        # Quantization and the optimized mode need the eager model, so they take the checkpoint path.
+        if (not quantization and not optimize and scripted_path and os.path.exists(scripted_path)
+                and not _is_stale(scripted_path, model_path) and self.load_scripted(scripted_path)):
+            return
+        
+        # With a memory-mappable slim file the weights are adopted as-is, so skip allocating random init
+        slim_path = self._slim_path(model_path, warn=False) if model_path else None
+        self.model = self._build_model(on_meta=bool(slim_path) and supports_mmap())
+        
         # Load model weights if provided
-        if model_path and os.path.exists(model_path):
+        if slim_path or (model_path and os.path.exists(model_path)):
             self.load_model(model_path)
         else:
             print("Warning: No model weights loaded. Using untrained model.")
             print("For demo purposes, predictions will be random.")
             self.is_trained = False
+        
+        if quantization:
+            self.quantize(quantization, calibration_dir)
+        if optimize:
+            self.optimize_for_cpu()
+    
+    def _build_model(self, on_meta=False, weights=None):
+        """Construct the backbone for ``self.arch`` with the custom 5-class head
+
+        ``on_meta`` builds it without allocating or initializing weights, for
+        callers that immediately assign loaded tensors. ``weights`` selects
+        torchvision backbone weights, used when training a distilled student.
+        """
+        with torch.device('meta') if on_meta else contextlib.nullcontext():
+            model = getattr(models, self.arch)(weights=weights)
+            head = ARCHITECTURES[self.arch]
+            num_ftrs = _head_in_features(getattr(model, head))
+            setattr(model, head, classifier_head(num_ftrs, len(self.classes)))
+        
+        # Unfreeze specific layers
+        for name, child in model.named_children():
+            if name in ['layer2', 'layer3', 'layer4', 'fc']:
+                for param in child.parameters():
+                    param.requires_grad = True
+            else:
+                for param in child.parameters():
+                    param.requires_grad = False
+        
+        return model if on_meta else model.to(self.device)
+    
+    def _on_meta(self):
+        return next(self.model.parameters()).is_meta
+    
+    def _slim_path(self, model_path, warn=True):
+        """The usable slim checkpoint for ``model_path``, or None"""
+        slim_path = slim_path_for(model_path)
+        if self.prefer_slim and os.path.exists(slim_path) and not _is_stale(slim_path, model_path, warn=warn):
+            return slim_path
+        return None
+    
+    def load_scripted(self, path):
+        """Load a frozen TorchScript model written by export_torchscript
+
+        Returns False without loading when the file was exported from another
+        architecture or cannot be loaded, so the caller falls back to the
+        checkpoint or slim weights.
+        """
+        extra_files = {'arch': ''}
+        try:
+            model = torch.jit.load(path, map_location=self.device, _extra_files=extra_files)
+        except Exception as e:
+            print(f"Error loading TorchScript model from {path}: {e}")
+            print("Falling back to the checkpoint weights...")
+            return False
+        arch = extra_files['arch'] or 'resnet152'
+        if isinstance(arch, bytes):
+            arch = arch.decode()
+        if arch != self.arch:
+            print(f"Skipping {path}: exported from {arch}, expected {self.arch}")
+            return False
+        model.eval()
+        try:
+            # Device-specific rewrites (MKLDNN weight folding) are applied here, never saved: they do not reload
+            model = torch.jit.optimize_for_inference(model)
+        except Exception as e:
+            print(f"Running {path} without optimize_for_inference: {e}")
+        self.model = model
+        self.weights_path = path
+        self.is_trained = True
+        print(f"TorchScript model loaded successfully from {path}")
+        return True
+    
+    def export_torchscript(self, path):
+        """Write the loaded model as a frozen TorchScript file (load_scripted optimizes it for inference)"""
+        if not self.is_trained:
+            raise RuntimeError('Refusing to export an untrained model')
+        self.model.eval()
+        example = torch.zeros(1, 3, 224, 224, device=self.device)
+        with torch.no_grad():
+            scripted = torch.jit.trace(self.model, example)
+            frozen = torch.jit.freeze(scripted)
+            frozen(example)  # Sanity check the exported graph runs
+        torch.jit.save(frozen, path, _extra_files={'arch': self.arch})
+        print(f"TorchScript model exported to {path}")
+        return path
     
     def load_model(self, path):
-        """Load pre-trained model weights"""
+        """Load pre-trained model weights, preferring the inference-only slim file next to them"""
+        slim_path = self._slim_path(path)
+        if slim_path:
+            self.load_slim(slim_path)
+            return
+        if self._on_meta():
+            self.model = self._build_model()
         try:
             checkpoint = torch.load(path, map_location=self.device)
+            arch = checkpoint.get('arch', 'resnet152')  # classifier.pt predates the arch key
+            if arch != self.arch:
+                raise ValueError(f"{path} holds a {arch} model, expected {self.arch}")
             self.model.load_state_dict(checkpoint['model_state_dict'])
+            self.weights_path = path
             self.is_trained = True
             print(f"Model loaded successfully from {path}")
         except Exception as e:
@@ -65,71 +184,1050 @@ class RetinalBlindnessModel:
             print("Using untrained model...")
             self.is_trained = False
     
+    def load_slim(self, path):
+        """Load an inference-only checkpoint written by slim_checkpoint.py"""
+        try:
+            state_dict = load_slim_state_dict(path, arch=self.arch)
+            if self._on_meta():
+                # Adopt the memory-mapped tensors instead of copying them into fresh parameters;
+                # fp16/bf16 storage is upcast here, which does allocate
+                self.model.load_state_dict(state_dict, assign=True)
+                self.model = self.model.float().to(self.device)
+                self.weights_mmapped = supports_mmap() and all(
+                    tensor.dtype == torch.float32 for tensor in state_dict.values() if tensor.is_floating_point())
+            else:
+                self.model.load_state_dict(state_dict)
+            self.weights_path = path
+            self.is_trained = True
+            print(f"Slim model loaded successfully from {path}")
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            print("Using untrained model...")
+            if self._on_meta():
+                self.model = self._build_model()
+            self.is_trained = False
+    
+    def fingerprint(self):
+        """Hash identifying the loaded weights and every setting that affects predictions
+
+        Returns None for an untrained model, whose random predictions must not be cached.
+        """
+        if not self.is_trained or not self.weights_path:
+            return None
+        digest = hashlib.sha256()
+        with open(self.weights_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        config = {
+            'arch': self.arch,
+            'classes': self.classes,
+            'input_size': INPUT_SIZE,
+            'fast_preprocess': self.fast_preprocess,
+            'tta_views': list(self.tta_views),
+            'quantization': self.quantization,
+            'optimized': self.optimized
+        }
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        return digest.hexdigest()
+    
+    def quantize(self, mode, calibration_dir='sampleimages', max_calibration_images=64):
+        """Convert the loaded fp32 model to INT8 for CPU inference
+
+        ``'dynamic'`` quantizes the weights of the Linear layers in the ``fc``
+        head and quantizes activations on the fly. ``'static'`` runs FX graph
+        mode post-training quantization over the whole network, calibrating
+        activation ranges on images from ``calibration_dir``. Quantized
+        kernels only run on CPU, so the model is moved there first.
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode {mode!r}, expected one of {QUANTIZATION_MODES}")
+        from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        self.device = torch.device("cpu")
+        model = self.model.to(self.device).eval()
+
+        if mode == 'dynamic':
+            self.model = quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        else:
+            images = list_images(calibration_dir)[:max_calibration_images]
+            if not images:
+                raise ValueError(f"No calibration images found in {calibration_dir}")
+            qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+            example = torch.zeros(1, 3, 224, 224)
+            prepared = prepare_fx(model, qconfig_mapping, example_inputs=(example,))
+            with torch.no_grad():
+                for start in range(0, len(images), self.batch_size):
+                    chunk = images[start:start + self.batch_size]
+                    prepared(torch.stack([self.preprocess(path) for path in chunk]))
+            self.model = convert_fx(prepared)
+            print(f"Calibrated static quantization on {len(images)} images from {calibration_dir}")
+
+        self.quantization = mode
+        print(f"Model quantized to INT8 ({mode})")
+    
+    def optimize_for_cpu(self, tolerance=1e-3, measure=False):
+        """Switch to a graph-optimized fp32 execution mode built from the eager model
+
+        Every BatchNorm is folded into its convolution and the ImageNet
+        mean/std normalization into ``conv1``, so inputs become raw [0, 1]
+        pixels. Border padding uses the channel mean, which keeps the fold
+        exact. The network runs in channels-last layout and is frozen with
+        TorchScript so the backend can fuse conv+ReLU (oneDNN on x86). The
+        result is checked against eager mode and discarded if any
+        probability differs by more than ``tolerance``. Returns a report
+        dict, including eager vs optimized latency when ``measure`` is set.
+        """
+        if self.quantization or isinstance(self.model, torch.jit.ScriptModule):
+            raise ValueError('optimize_for_cpu needs the eager fp32 model')
+        if not self.arch.startswith('resnet'):
+            raise ValueError('optimize_for_cpu supports ResNet architectures only')
+        eager = self.model.eval()
+        optimized = _fold_batchnorm(copy.deepcopy(eager))
+        _fold_input_normalization(optimized, IMAGENET_MEAN, IMAGENET_STD)
+        optimized = optimized.to(memory_format=torch.channels_last)
+
+        generator = torch.Generator().manual_seed(0)
+        raw = torch.rand(2, 3, INPUT_SIZE, INPUT_SIZE, generator=generator).to(self.device)
+        normalized = raw.sub(_PIXEL_MEAN.to(self.device)).div(_PIXEL_STD.to(self.device))
+        example = raw.contiguous(memory_format=torch.channels_last)
+
+        fused = False
+        with torch.no_grad():
+            try:
+                traced = torch.jit.trace(optimized, example)
+                optimized = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+                fused = True
+            except Exception as e:
+                print(f"Conv+ReLU fusion unavailable on this backend ({e}), using the folded eager model")
+            expected = torch.exp(eager(normalized))
+            actual = torch.exp(optimized(example))
+        max_abs_diff = float((expected - actual).abs().max())
+
+        report = {'max_abs_diff': max_abs_diff, 'tolerance': tolerance, 'fused': fused, 'enabled': False}
+        if max_abs_diff > tolerance:
+            print(f"Warning: optimized model differs from eager by {max_abs_diff:.2e} (> {tolerance:.0e}), "
+                  f"keeping the eager model")
+            return report
+
+        if measure:
+            batch = torch.rand(self.batch_size, 3, INPUT_SIZE, INPUT_SIZE, generator=generator).to(self.device)
+            report['eager_ms_per_image'] = _time_forward(eager, batch.sub(_PIXEL_MEAN.to(self.device))
+                                                         .div(_PIXEL_STD.to(self.device)))
+            report['optimized_ms_per_image'] = _time_forward(optimized, batch.contiguous(
+                memory_format=torch.channels_last))
+            report['speedup'] = report['eager_ms_per_image'] / report['optimized_ms_per_image']
+
+        self.model = optimized
+        self.optimized = True
+        self.channels_last = True
+        self.input_normalized = False
+        self.weights_mmapped = False  # Folding wrote new weight tensors
+        self.test_transforms = torchvision.transforms.Compose([
+            torchvision.transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+            torchvision.transforms.ToTensor()
+        ])
+        report['enabled'] = True
+        print(f"Optimized CPU mode enabled (max abs diff vs eager {max_abs_diff:.2e})")
+        return report
+    
+    def warmup(self, batch_sizes=(1,), rounds=2):
+        """Run dummy forward passes so one-time kernel setup happens before real traffic"""
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            for _ in range(rounds):
+                self._forward(torch.zeros(batch_size, 3, INPUT_SIZE, INPUT_SIZE))
+        print(f"Warmup at batch sizes {list(batch_sizes)} took {time.perf_counter() - start:.2f}s")
+
+    def enable_embeddings(self):
+        """Attach the pooled features fed to the classifier head to every result as ``'embedding'``
+
+        The features (2048-d for ResNet-152) come from a forward hook on the
+        head, so they cost nothing extra to compute; with TTA they are
+        averaged over the views. TorchScript artifacts, the optimized mode and
+        static quantization have no head module to hook. Returns the
+        embedding width, or None when embeddings are unavailable.
+        """
+        if self.capture_embeddings:
+            return self.embedding_dim
+        head = getattr(self.model, ARCHITECTURES[self.arch], None)
+        if (not self.is_trained or self.quantization == 'static'
+                or isinstance(self.model, torch.jit.ScriptModule) or not isinstance(head, nn.Module)):
+            return None
+
+        local = self._embedding_local
+
+        def capture(module, inputs, output):
+            if getattr(local, 'active', False):
+                local.features = inputs[0]
+
+        head.register_forward_hook(capture)
+        self.embedding_dim = next(module.in_features for module in head.modules() if hasattr(module, 'in_features'))
+        self.capture_embeddings = True
+        return self.embedding_dim
+
     def predict(self, image_path):
-        """Make prediction on uploaded image"""
+        """Make prediction on uploaded image: a path, file-like stream or raw bytes"""
+        return self.predict_batch([image_path])[0]
+
+    def predict_batch(self, paths_or_file_objects):
+        """Make predictions on a list of image paths, file objects or bytes
+
+        Images are decoded and transformed one by one, then stacked and
+        passed through the model in chunks of ``self.batch_size``. A result
+        dict with the same shape as ``predict`` is returned for every input,
+        in order; an image that fails to decode gets ``{'error': ...}``
+        without affecting the rest of the batch.
+        """
+        results = [None] * len(paths_or_file_objects)
+        tensors = []
+        indices = []
+
+        for i, source in enumerate(paths_or_file_objects):
+            try:
+                tensors.append(self.preprocess(source))
+                indices.append(i)
+            except Exception as e:
+                print(f"Error loading image {i} in batch: {str(e)}")
+                results[i] = {'error': str(e)}
+
+        for i, result in zip(indices, self.predict_tensors(tensors)):
+            results[i] = result
+        return results
+
+    def preprocess(self, source):
+        """Decode an image path, file object or bytes into a (3, 224, 224) model input tensor
+
+        Inputs are ImageNet-normalized unless the optimized mode folded that into the network.
+        """
+        source = _as_stream(source)
+        if self.fast_preprocess:
+            return image_to_tensor(decode_image(source), normalize=self.input_normalized)
+        image = Image.open(source).convert('RGB')
+        return self.test_transforms(image)
+
+    def predict_tensors(self, tensors):
+        """Run already preprocessed image tensors through the model in batch_size chunks"""
+        results = []
+        for start in range(0, len(tensors), self.batch_size):
+            chunk = tensors[start:start + self.batch_size]
+            try:
+                batch = torch.stack(chunk)
+                if self.capture_embeddings:
+                    probabilities, embeddings = self._forward(batch, with_embeddings=True)
+                else:
+                    probabilities, embeddings = self._forward(batch), [None] * len(chunk)
+                chunk_results = [self._format_result(probs) for probs in probabilities]
+                for result, embedding in zip(chunk_results, embeddings):
+                    if embedding is not None:
+                        result['embedding'] = embedding
+                results.extend(chunk_results)
+            except Exception as e:
+                import traceback
+                print(f"Error in prediction: {str(e)}")
+                print(traceback.format_exc())
+                results.extend({'error': str(e)} for _ in chunk)
+        return results
+
+    def _forward(self, batch, with_embeddings=False):
+        """Run one forward pass and return class probabilities as an (N, 5) array
+
+        With ``with_embeddings`` (see ``enable_embeddings``) returns
+        ``(probabilities, embeddings)``, the embeddings as an (N, D) float16 array.
+        """
+        # For demo purposes, generate random predictions if model is untrained
+        if not hasattr(self, 'is_trained') or not self.is_trained:
+            print("Using random predictions for demo")
+            random_probs = np.random.rand(batch.shape[0], len(self.classes))
+            return random_probs / random_probs.sum(axis=1, keepdims=True)  # Normalize to sum to 1
+
+        self.model.eval()
+        local = self._embedding_local
+        local.active = with_embeddings
         try:
-            # Open and preprocess image
-            image = Image.open(image_path).convert('RGB')
-            img_tensor = self.test_transforms(image).unsqueeze(0)
-            
-            # For demo purposes, generate random predictions if model is untrained
-            if not hasattr(self, 'is_trained') or not self.is_trained:
-                print("Using random predictions for demo")
-                # Generate random probabilities
-                import numpy as np
-                random_probs = np.random.rand(5)
-                random_probs = random_probs / random_probs.sum()  # Normalize to sum to 1
-                
-                # Find the highest probability class
-                predicted_class_idx = np.argmax(random_probs)
-                predicted_class = self.classes[predicted_class_idx]
-                confidence = random_probs[predicted_class_idx]
-                
-                return {
-                    'predicted_class': predicted_class,
-                    'predicted_class_idx': int(predicted_class_idx),
-                    'confidence': float(confidence),
-                    'all_probabilities': dict(zip(self.classes, random_probs.astype(float)))
-                }
-            
-            # Make prediction with trained model
-            self.model.eval()
             with torch.no_grad():
-                output = self.model(img_tensor.to(self.device))
-                probabilities = torch.exp(output)
-                top_p, top_class = probabilities.topk(1, dim=1)
-                
-                predicted_class_idx = top_class.item()
-                predicted_class = self.classes[predicted_class_idx]
-                confidence = top_p.item()
-                
-                # Get all class probabilities
-                all_probs = probabilities.squeeze().cpu().numpy()
-                
-                return {
-                    'predicted_class': predicted_class,
-                    'predicted_class_idx': predicted_class_idx,
-                    'confidence': float(confidence),
-                    'all_probabilities': dict(zip(self.classes, all_probs.astype(float)))
-                }
-        
+                batch = batch.to(self.device)
+                views = len(self.tta_views) or 1
+                if not self.tta_views:
+                    probabilities = torch.exp(self.model(self._layout(batch)))
+                else:
+                    # Test-time augmentation: every view of every image in one forward pass,
+                    # laid out view-major, then probabilities averaged per image
+                    stacked = torch.cat([TTA_VIEWS[name](batch) for name in self.tta_views])
+                    probabilities = torch.exp(self.model(self._layout(stacked)))
+                    probabilities = probabilities.view(views, batch.shape[0], -1).mean(dim=0)
+                if not with_embeddings:
+                    return probabilities.cpu().numpy()
+                features = local.features.reshape(views, batch.shape[0], -1).mean(dim=0)
+                return probabilities.cpu().numpy(), features.to(torch.float16).cpu().numpy()
+        finally:
+            local.active = False
+            local.features = None
+
+    def _layout(self, batch):
+        """Match the memory format the model runs in"""
+        if self.channels_last:
+            return batch.contiguous(memory_format=torch.channels_last)
+        return batch
+
+    def _format_result(self, probs):
+        """Build the prediction dict returned to callers from one row of probabilities"""
+        predicted_class_idx = int(np.argmax(probs))
+        return {
+            'predicted_class': self.classes[predicted_class_idx],
+            'predicted_class_idx': predicted_class_idx,
+            'confidence': float(probs[predicted_class_idx]),
+            'all_probabilities': dict(zip(self.classes, probs.astype(float)))
+        }
+
+QUANTIZATION_MODES = ('dynamic', 'static')
+
+# Supported backbones and the attribute holding their classifier head
+ARCHITECTURES = {
+    'resnet152': 'fc',
+    'resnet18': 'fc',
+    'resnet34': 'fc',
+    'mobilenet_v3_small': 'classifier',
+    'mobilenet_v3_large': 'classifier',
+}
+
+INPUT_SIZE = 224
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+# ToTensor's /255 and Normalize folded into a single per-channel multiply-add on uint8 pixels
+_PIXEL_SCALE = torch.tensor([1.0 / (255.0 * std) for std in IMAGENET_STD]).view(3, 1, 1)
+_PIXEL_SHIFT = torch.tensor([-mean / std for mean, std in zip(IMAGENET_MEAN, IMAGENET_STD)]).view(3, 1, 1)
+_PIXEL_MEAN = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+_PIXEL_STD = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+# Test-time augmentation views, applied to normalized (N, 3, H, W) batches
+TTA_VIEWS = {
+    'identity': lambda x: x,
+    'hflip': lambda x: torch.flip(x, dims=[3]),
+    'vflip': lambda x: torch.flip(x, dims=[2]),
+    'rotate+10': lambda x: torchvision.transforms.functional.rotate(x, 10),
+    'rotate-10': lambda x: torchvision.transforms.functional.rotate(x, -10),
+}
+DEFAULT_TTA_VIEWS = ('identity', 'hflip')
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+
+
+def _as_stream(source):
+    """Wrap raw bytes so PIL can open them; paths and file objects pass through"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def _read_bytes(source):
+    """The full contents of an image path, file object or bytes"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def list_images(directory):
+    """Sorted paths of the image files directly inside ``directory``"""
+    if not directory or not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS]
+
+
+def _head_in_features(head):
+    """Input width of a torchvision classifier head (a Linear, or a Sequential starting with one)"""
+    if isinstance(head, nn.Linear):
+        return head.in_features
+    return next(module for module in head.modules() if isinstance(module, nn.Linear)).in_features
+
+
+def classifier_head(in_features, num_classes):
+    """The custom head replacing the torchvision classifier: log-probabilities over the DR classes"""
+    return nn.Sequential(
+        nn.Linear(in_features, 512),
+        nn.ReLU(),
+        nn.Linear(512, num_classes),
+        nn.LogSoftmax(dim=1)
+    )
+
+
+def decode_image(source, size=INPUT_SIZE):
+    """Decode an image straight to a size x size RGB image, skipping work on large uploads
+
+    JPEGs use draft mode, so libjpeg decodes at the smallest 1/2, 1/4 or 1/8
+    scale that still covers ``size``. Other formats are box-reduced by an
+    integer factor before the final bilinear resample (``reducing_gap``),
+    which is much cheaper than resampling a multi-megapixel image directly.
+    """
+    image = Image.open(source)
+    if image.format == 'JPEG':
+        image.draft('RGB', (size, size))
+    if image.mode not in ('RGB', 'L'):
+        # Drop alpha and palettes first: resizing RGBA premultiplies, turning transparent pixels black
+        image = image.convert('RGB')
+    image = image.resize((size, size), Image.BILINEAR, reducing_gap=2.0)
+    return image.convert('RGB')
+
+
+def image_to_tensor(image, normalize=True):
+    """Convert an RGB PIL image to a normalized (3, H, W) float tensor in one vectorized step
+
+    With ``normalize=False`` pixels are only scaled to [0, 1], for models that fold the normalization.
+    """
+    pixels = torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1).contiguous()
+    if not normalize:
+        return pixels.float().div_(255.0)
+    return pixels.float().mul_(_PIXEL_SCALE).add_(_PIXEL_SHIFT)
+
+
+class _MeanPad(nn.Module):
+    """Pad raw [0, 1] pixels with the per-channel mean, which is zero padding after normalization"""
+    def __init__(self, padding, mean):
+        super().__init__()
+        self.padding = padding
+        self.register_buffer('mean', torch.tensor(mean).view(1, 3, 1, 1))
+
+    def forward(self, x):
+        return F.pad(x - self.mean, [self.padding] * 4) + self.mean
+
+
+def _fold_batchnorm(model):
+    """Fold every BatchNorm of a torchvision ResNet into the preceding convolution (eval mode)"""
+    model.eval()
+    model.conv1 = fuse_conv_bn_eval(model.conv1, model.bn1)
+    model.bn1 = nn.Identity()
+    for layer in (model.layer1, model.layer2, model.layer3, model.layer4):
+        for block in layer:
+            for i in (1, 2, 3):
+                conv, bn = getattr(block, f'conv{i}', None), getattr(block, f'bn{i}', None)
+                if conv is not None and bn is not None:
+                    setattr(block, f'conv{i}', fuse_conv_bn_eval(conv, bn))
+                    setattr(block, f'bn{i}', nn.Identity())
+            if block.downsample is not None:
+                block.downsample = fuse_conv_bn_eval(block.downsample[0], block.downsample[1])
+    return model
+
+
+def _fold_input_normalization(model, mean, std):
+    """Fold (x - mean) / std into conv1 so the model consumes raw [0, 1] pixels"""
+    conv = model.conv1
+    with torch.no_grad():
+        inv_std = 1.0 / torch.tensor(std, device=conv.weight.device).view(1, 3, 1, 1)
+        mean_over_std = torch.tensor(mean, device=conv.weight.device).view(1, 3, 1, 1) * inv_std
+        if conv.bias is None:
+            conv.bias = nn.Parameter(torch.zeros(conv.out_channels, device=conv.weight.device))
+        conv.bias -= (conv.weight * mean_over_std).sum(dim=(1, 2, 3))
+        conv.weight *= inv_std
+    padding = conv.padding[0]
+    conv.padding = (0, 0)
+    model.conv1 = nn.Sequential(_MeanPad(padding, mean), conv).to(conv.weight.device)
+    return model
+
+
+def _time_forward(model, batch, repeats=5):
+    """Mean milliseconds per image over a few forward passes after one warmup pass"""
+    with torch.no_grad():
+        model(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(batch)
+    return (time.perf_counter() - start) * 1000.0 / (repeats * batch.shape[0])
+
+
+def _resolve_tta_views(tta):
+    """Normalize the ``tta`` option: falsy -> no TTA, True -> default views, else a list of view names"""
+    if not tta:
+        return ()
+    views = DEFAULT_TTA_VIEWS if tta is True else tuple(tta)
+    unknown = [name for name in views if name not in TTA_VIEWS]
+    if unknown:
+        raise ValueError(f"Unknown TTA views {unknown}, expected names from {sorted(TTA_VIEWS)}")
+    return views
+
+
+def _is_stale(derived_path, model_path, warn=True):
+    """True when the checkpoint is newer than an artifact derived from it"""
+    if model_path and os.path.exists(model_path) and os.path.getmtime(model_path) > os.path.getmtime(derived_path):
+        if warn:
+            print(f"Warning: {derived_path} is older than {model_path}, ignoring it. Re-export it.")
+        return True
+    return False
+
+
+class _PendingPrediction:
+    """A single queued request waiting for its slot in a micro-batch"""
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+
+
+class MicroBatcher:
+    """Merge concurrent single-image requests into batched forward passes
+
+    Callers decode their own image on the request thread and then block in
+    ``submit``. A single background thread takes the first queued request,
+    keeps collecting more for up to ``max_wait_ms`` (or until
+    ``max_batch_size`` is reached), runs one forward pass and hands every
+    caller its own result. A caller waits at most ``timeout_seconds`` and
+    gets an error result instead, and a failed forward pass reports its
+    error to every caller in the batch.
+    """
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10, latency_window=1000, timeout_seconds=30):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = float(timeout_seconds)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_depths = Counter()
+        self._latencies = deque(maxlen=latency_window)
+        self._requests = 0
+        self._timeouts = 0
+        self._failed_batches = 0
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, source):
+        """Queue one image and block until its prediction is ready"""
+        try:
+            tensor = self.model.preprocess(source)
         except Exception as e:
-            import traceback
-            print(f"Error in prediction: {str(e)}")
-            print(traceback.format_exc())
+            print(f"Error loading image: {str(e)}")
             return {'error': str(e)}
 
+        pending = _PendingPrediction(tensor)
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            return {'error': f'Prediction timed out after {self.timeout:g} seconds'}
+        return pending.result
+
+    def _collect(self):
+        """Block for the first request, then gather more until the window closes"""
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                depth = self._queue.qsize()
+                results = self.model.predict_tensors([pending.tensor for pending in batch])
+
+                now = time.monotonic()
+                with self._lock:
+                    self._requests += len(batch)
+                    self._batch_sizes[len(batch)] += 1
+                    self._queue_depths[depth] += 1
+                    self._latencies.extend((now - pending.enqueued_at) * 1000.0 for pending in batch)
+
+                for pending, result in zip(batch, results):
+                    pending.result = result
+            except Exception as e:
+                print(f"Error in batched prediction: {str(e)}")
+                with self._lock:
+                    self._failed_batches += 1
+                for pending in batch:
+                    pending.result = {'error': str(e)}
+            finally:
+                # Every caller is released, even when the model returned too few results
+                for pending in batch:
+                    if pending.result is None:
+                        pending.result = {'error': 'No prediction was returned for this image'}
+                    pending.done.set()
+
+    def stats(self):
+        """Return queue depth, batch-size histogram and latency percentiles"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            batches = sum(self._batch_sizes.values())
+
+            def percentile(q):
+                if not latencies:
+                    return None
+                return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'requests': self._requests,
+                'batches': batches,
+                'failed_batches': self._failed_batches,
+                'timeouts': self._timeouts,
+                'mean_batch_size': self._requests / batches if batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'queue_depth_histogram': dict(sorted(self._queue_depths.items())),
+                'latency_ms': {'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99)}
+            }
+
+class ModelCascade:
+    """Answer confident, mild cases with a cheap model and escalate the rest to the full one
+
+    The first stage answers when its top-class probability reaches
+    ``threshold`` and the class is below ``escalate_from`` (Moderate by
+    default); anything uncertain, failed, or Moderate-or-worse is re-run on
+    the full model. Results carry ``'stage': 'first'`` or ``'full'``. The
+    cascade exposes the same preprocess/predict interface as
+    RetinalBlindnessModel so the batcher and cache can wrap it.
+    """
+    def __init__(self, first, full, threshold=0.9, escalate_from='Moderate'):
+        self.first = first
+        self.full = full
+        self.threshold = float(threshold)
+        self.escalate_from_idx = full.classes.index(escalate_from)
+        self.classes = full.classes
+        self.batch_size = full.batch_size
+        self.is_trained = first.is_trained and full.is_trained
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._escalations = 0
+        # Relative cost of one image through each stage, used to report compute saved
+        batch = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+        self.first_ms = _time_forward(lambda x: first._forward(x), batch, repeats=2)
+        self.full_ms = _time_forward(lambda x: full._forward(x), batch, repeats=2)
+
+    def preprocess(self, source):
+        return self.full.preprocess(source)
+
+    def predict(self, image_path):
+        return self.predict_batch([image_path])[0]
+
+    def predict_batch(self, paths_or_file_objects):
+        results = [None] * len(paths_or_file_objects)
+        tensors = []
+        indices = []
+        for i, source in enumerate(paths_or_file_objects):
+            try:
+                tensors.append(self.preprocess(source))
+                indices.append(i)
+            except Exception as e:
+                print(f"Error loading image {i} in batch: {str(e)}")
+                results[i] = {'error': str(e)}
+        for i, result in zip(indices, self.predict_tensors(tensors)):
+            results[i] = result
+        return results
+
+    def predict_tensors(self, tensors):
+        """Run the first stage on every tensor and the full model only on escalated ones"""
+        if not tensors:
+            return []
+        first_inputs = [_convert_input(t, self.full.input_normalized, self.first.input_normalized) for t in tensors]
+        results = self.first.predict_tensors(first_inputs)
+        escalate = [i for i, result in enumerate(results)
+                    if 'error' in result
+                    or result['confidence'] < self.threshold
+                    or result['predicted_class_idx'] >= self.escalate_from_idx]
+
+        for i, result in enumerate(results):
+            result['stage'] = 'first'
+        if escalate:
+            full_results = self.full.predict_tensors([tensors[i] for i in escalate])
+            for i, full_result in zip(escalate, full_results):
+                full_result['stage'] = 'full'
+                if 'error' not in results[i]:
+                    full_result['first_stage_confidence'] = results[i]['confidence']
+                results[i] = full_result
+
+        with self._lock:
+            self._requests += len(tensors)
+            self._escalations += len(escalate)
+        return results
+
+    def warmup(self, batch_sizes=(1,), rounds=2):
+        self.first.warmup(batch_sizes, rounds)
+        self.full.warmup(batch_sizes, rounds)
+
+    def fingerprint(self):
+        first, full = self.first.fingerprint(), self.full.fingerprint()
+        if first is None or full is None:
+            return None
+        config = f"{first}:{full}:{self.threshold}:{self.escalate_from_idx}"
+        return hashlib.sha256(config.encode()).hexdigest()
+
+    def stats(self):
+        """Escalation rate and average compute saved per request versus always running the full model"""
+        with self._lock:
+            requests, escalations = self._requests, self._escalations
+        spent = requests * self.first_ms + escalations * self.full_ms
+        saved = requests * self.full_ms - spent
+        return {
+            'threshold': self.threshold,
+            'escalate_from': self.classes[self.escalate_from_idx],
+            'requests': requests,
+            'escalations': escalations,
+            'escalation_rate': escalations / requests if requests else 0.0,
+            'first_stage_ms': self.first_ms,
+            'full_model_ms': self.full_ms,
+            'avg_compute_saved_ms': saved / requests if requests else 0.0,
+            'avg_compute_saved_fraction': saved / (requests * self.full_ms) if requests else 0.0
+        }
+
+
+def _convert_input(tensor, from_normalized, to_normalized):
+    """Convert a preprocessed tensor between normalized and raw [0, 1] pixel inputs"""
+    if from_normalized == to_normalized:
+        return tensor
+    mean, std = _PIXEL_MEAN[0], _PIXEL_STD[0]
+    if from_normalized:
+        return tensor * std + mean
+    return (tensor - mean) / std
+
+
 # Global model instance (will be initialized in Flask app)
 model_instance = None
+cascade_instance = None
+batcher_instance = None
+cache_instance = None
+embedding_store_instance = None
+near_duplicate_instance = None
+
+# Background loading state, see load_in_background
+_model_ready = threading.Event()
+_model_load_error = None
 
-def initialize_model(model_path=None):
-    """Initialize the global model instance"""
-    global model_instance
-    model_instance = RetinalBlindnessModel(model_path)
+# Set by gunicorn.conf.py when the app is imported in the pre-forking master
+PRELOAD_ENV = 'MODEL_PRELOAD'
+_after_fork_steps = None
+
+# Settings from runtime_config.json applied by initialize_model
+runtime_config = {}
+
+# Default location of the frozen TorchScript artifact written by export_model.py
+SCRIPTED_MODEL_PATH = 'classifier_scripted.pt'
+
+def initialize_model(model_path=None, batch_size=None, scripted_path=SCRIPTED_MODEL_PATH,
+                     quantization=None, calibration_dir='sampleimages', tta=None,
+                     runtime_config_path=RUNTIME_CONFIG_PATH, optimize=False, arch='resnet152'):
+    """Initialize the global model instance
+
+    ``quantization`` may be ``'dynamic'`` (INT8 fc head) or ``'static'``
+    (INT8 backbone calibrated on ``calibration_dir``); see
+    quantization_report.py before enabling either in production.
+    ``tta`` enables test-time augmentation: ``True`` for ``DEFAULT_TTA_VIEWS``
+    or a list of names from ``TTA_VIEWS``. ``optimize`` builds the folded,
+    channels-last fp32 graph (see ``optimize_for_cpu``). ``arch`` selects
+    a distilled student written by distill.py, e.g. ``'resnet18'``.
+    Thread counts and the default ``batch_size`` come from the file written
+    by autotune.py when it exists.
+    """
+    global model_instance, runtime_config
+    runtime_config = load_runtime_config(runtime_config_path)
+    apply_thread_settings(runtime_config)
+    if batch_size is None:
+        batch_size = runtime_config.get('batch_size', 16)
+    model_instance = RetinalBlindnessModel(model_path, batch_size=batch_size, scripted_path=scripted_path,
+                                           quantization=quantization, calibration_dir=calibration_dir, tta=tta,
+                                           optimize=optimize, arch=arch)
     return model_instance
 
-def get_prediction(image_path):
-    """Get prediction from the global model instance"""
+def load_in_background(setup, warmup_batch_sizes=(1,)):
+    """Run ``setup`` and a warmup on a background thread, then mark the model ready
+
+    ``setup`` must call ``initialize_model`` (and may start the batcher or
+    cache). Until it finishes, ``is_model_ready`` is False so routes can
+    answer with 503 instead of blocking on the load.
+    """
+    def run():
+        global _model_load_error
+        try:
+            start = time.perf_counter()
+            setup()
+            if model_instance is None:
+                raise RuntimeError('setup did not initialize the model')
+            serving_model().warmup(warmup_batch_sizes)
+            _model_ready.set()
+            print(f"Model ready after {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            import traceback
+            _model_load_error = str(e)
+            print(f"Error loading model: {e}")
+            print(traceback.format_exc())
+
+    _model_ready.clear()
+    thread = threading.Thread(target=run, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+def load_for_serving(setup, worker_setup=None, warmup_batch_sizes=(1,)):
+    """Load the model for the web server, sharing weights between workers when pre-forking
+
+    ``setup`` loads the model (``initialize_model``, cache); ``worker_setup``
+    starts anything that owns threads (the micro-batcher), since threads do
+    not survive a fork. Normally both run on a background thread. When
+    ``MODEL_PRELOAD=1`` (gunicorn master with ``preload_app``), ``setup``
+    runs synchronously, the weights are moved to shared memory and the
+    heap is frozen out of the garbage collector so forked workers keep
+    sharing those pages; each worker then calls ``after_fork``.
+    """
+    global _after_fork_steps
+    if os.environ.get(PRELOAD_ENV) != '1':
+        def run():
+            setup()
+            if worker_setup is not None:
+                worker_setup()
+        return load_in_background(run, warmup_batch_sizes)
+
+    start = time.perf_counter()
+    setup()
+    share_model_memory()
+    _after_fork_steps = (worker_setup, warmup_batch_sizes)
+    # Objects tracked by the GC get their headers written on every collection, which would
+    # copy their pages into each worker; freezing moves them out of the collector's reach
+    gc.collect()
+    gc.freeze()
+    print(f"Model preloaded in master after {time.perf_counter() - start:.2f}s")
+    return None
+
+def after_fork():
+    """Start per-worker threads and warm up in a worker forked from a preloaded master"""
+    if _after_fork_steps is None:
+        return None
+    worker_setup, warmup_batch_sizes = _after_fork_steps
+    apply_thread_settings(runtime_config)  # Thread pools are per process, size them again in the worker
+    return load_in_background(worker_setup or (lambda: None), warmup_batch_sizes)
+
+def share_model_memory():
+    """Move model weights to shared memory so forked workers never copy them"""
+    models_to_share = [model_instance] + ([cascade_instance.first] if cascade_instance is not None else [])
+    for model in models_to_share:
+        if model is None or not isinstance(model.model, nn.Module):
+            continue
+        if model.weights_mmapped:
+            continue  # Already read-only page-cache pages shared by every process
+        model.model.share_memory()
+
+def get_memory_usage(pid='self'):
+    """RSS, PSS and unique (private) memory of a process in MB, from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+    except OSError:
+        return None  # Not Linux, or the process is gone
+    unique = fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0)
+    return {
+        'pid': os.getpid() if pid == 'self' else int(pid),
+        'rss_mb': fields.get('Rss', 0.0),
+        'pss_mb': fields.get('Pss', 0.0),
+        'unique_mb': unique,
+        'shared_mb': fields.get('Rss', 0.0) - unique
+    }
+
+def is_model_ready():
+    """True once background loading and warmup have completed"""
+    return _model_ready.is_set()
+
+def get_model_status():
+    """Readiness details for health endpoints"""
+    return {
+        'ready': _model_ready.is_set(),
+        'error': _model_load_error,
+        'trained': bool(model_instance is not None and model_instance.is_trained)
+    }
+
+def enable_cascade(first_stage_path, arch='resnet18', threshold=0.9, escalate_from='Moderate'):
+    """Put a cheap first-stage model (e.g. a distilled student) in front of the global model"""
+    global cascade_instance
+    if model_instance is None:
+        raise RuntimeError('Model not initialized')
+    first = RetinalBlindnessModel(first_stage_path, batch_size=model_instance.batch_size, scripted_path=None,
+                                  arch=arch, tta=list(model_instance.tta_views) or None)
+    if not first.is_trained or not model_instance.is_trained:
+        print("Cascade disabled: both stages need trained weights")
+        cascade_instance = None
+        return None
+    cascade_instance = ModelCascade(first, model_instance, threshold=threshold, escalate_from=escalate_from)
+    return cascade_instance
+
+def get_cascade_stats():
+    """Get escalation counters, or None when the cascade is off"""
+    if cascade_instance is None:
+        return None
+    return cascade_instance.stats()
+
+def serving_model():
+    """The cascade when enabled, else the global model instance"""
+    return cascade_instance if cascade_instance is not None else model_instance
+
+def start_batcher(max_batch_size=8, max_wait_ms=10, timeout_seconds=30):
+    """Route get_prediction through a micro-batcher on the global model instance"""
+    global batcher_instance
+    if model_instance is None:
+        raise RuntimeError('Model not initialized')
+    batcher_instance = MicroBatcher(serving_model(), max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    timeout_seconds=timeout_seconds)
+    return batcher_instance
+
+def get_batcher_stats():
+    """Get micro-batching metrics, or None when the batcher is not running"""
+    if batcher_instance is None:
+        return None
+    return batcher_instance.stats()
+
+def enable_prediction_cache(max_entries=1024, db_path='prediction_cache.db'):
+    """Serve repeated uploads of identical bytes from a content-addressed cache"""
+    global cache_instance
+    if model_instance is None:
+        raise RuntimeError('Model not initialized')
+    fingerprint = serving_model().fingerprint()
+    if fingerprint is None:
+        print("Prediction cache disabled: no trained weights loaded")
+        cache_instance = None
+        return None
+    from prediction_cache import PredictionCache
+    cache_instance = PredictionCache(fingerprint, max_entries=max_entries, db_path=db_path)
+    return cache_instance
+
+def get_cache_stats():
+    """Get prediction cache hit/miss counters, or None when caching is off"""
+    if cache_instance is None:
+        return None
+    return cache_instance.stats()
+
+def enable_embedding_store(path='embeddings.f16'):
+    """Keep the full model's pooled features for every computed prediction in an append-only file
+
+    Results then carry an ``'embedding'`` array; routes hand it to
+    ``store_embedding`` once the prediction row has an id. Cache hits and
+    answers from the cascade's first stage carry none. rescore_embeddings.py
+    applies a new head checkpoint to the stored vectors without re-reading images.
+    """
+    global embedding_store_instance
+    if model_instance is None:
+        raise RuntimeError('Model not initialized')
+    dim = model_instance.enable_embeddings()
+    if dim is None:
+        print("Embedding store disabled: needs trained eager weights (not TorchScript, optimized or static INT8)")
+        embedding_store_instance = None
+        return None
+    from embedding_store import EmbeddingStore
+    embedding_store_instance = EmbeddingStore(path, dim)
+    return embedding_store_instance
+
+def store_embedding(prediction_id, result):
+    """Move ``result['embedding']`` into the embedding store under a predictions-table id
+
+    Always removes the key so the result stays JSON-serializable; returns True when a vector was stored.
+    """
+    embedding = result.pop('embedding', None)
+    if embedding is None or embedding_store_instance is None:
+        return False
+    embedding_store_instance.append(prediction_id, embedding)
+    return True
+
+def enable_near_duplicate_index(radius=4, rows=()):
+    """Answer re-encoded, resized or slightly cropped re-uploads from earlier predictions
+
+    A 64-bit difference hash of each upload is looked up before the model
+    runs; a stored prediction within ``radius`` differing bits is returned
+    with ``'near_duplicate': True``. ``rows`` yields ``(prediction_id,
+    phash, probabilities)`` from the predictions table, as stored by the
+    routes, to rebuild the index at startup.
+    """
+    global near_duplicate_instance
+    if model_instance is None:
+        raise RuntimeError('Model not initialized')
+    if not serving_model().is_trained:
+        print("Near-duplicate index disabled: no trained weights loaded")
+        near_duplicate_instance = None
+        return None
+    from near_duplicate_index import NearDuplicateIndex, to_unsigned
+    start = time.perf_counter()
+    index = NearDuplicateIndex(model_instance.classes, radius=radius)
+    for prediction_id, phash, probabilities in rows:
+        if phash is None or not probabilities:
+            continue
+        if isinstance(probabilities, str):
+            probabilities = json.loads(probabilities)
+        index.add(prediction_id, to_unsigned(phash), probabilities)
+    near_duplicate_instance = index
+    print(f"Near-duplicate index rebuilt with {len(index)} hashes in {time.perf_counter() - start:.2f}s")
+    return index
+
+def get_near_duplicate_stats():
+    """Get near-duplicate lookup counters, or None when the index is off"""
+    if near_duplicate_instance is None:
+        return None
+    return near_duplicate_instance.stats()
+
+def stored_phash(result):
+    """The result's perceptual hash as a signed 64-bit value for the predictions.phash column"""
+    if result.get('phash') is None:
+        return None
+    from near_duplicate_index import to_signed
+    return to_signed(result['phash'])
+
+def record_prediction(prediction_id, result):
+    """Hand a result just saved as predictions row ``prediction_id`` to the embedding store and near-duplicate index
+
+    Removes the non-JSON ``'embedding'`` key from ``result``.
+    """
+    store_embedding(prediction_id, result)
+    if (near_duplicate_instance is not None and result.get('phash') is not None
+            and not result.get('near_duplicate') and 'error' not in result):
+        near_duplicate_instance.add(prediction_id, result['phash'], result['all_probabilities'])
+
+def _predict_uncached(image_path):
+    if batcher_instance is not None:
+        return batcher_instance.submit(image_path)
+    return serving_model().predict(image_path)
+
+def _predict_fresh(data):
+    """Near-duplicate lookup, then the model, for the bytes of one upload"""
+    phash = None
+    if near_duplicate_instance is not None:
+        from near_duplicate_index import dhash
+        try:
+            phash = dhash(io.BytesIO(data))
+        except Exception:
+            phash = None  # Undecodable; the model path reports the error
+        reused = near_duplicate_instance.lookup(phash) if phash is not None else None
+        if reused is not None:
+            reused['phash'] = phash
+            return reused
+    result = _predict_uncached(io.BytesIO(data))
+    if phash is not None and 'error' not in result:
+        result['phash'] = phash
+    return result
+
+def get_prediction(source):
+    """Get prediction from the global model instance
+
+    ``source`` is an image path, a file-like stream (e.g. the upload's
+    request stream) or the upload bytes; nothing is written to disk.
+    """
     if model_instance is None:
         return {'error': 'Model not initialized'}
-    return model_instance.predict(image_path)
+    if cache_instance is None and near_duplicate_instance is None:
+        return _predict_uncached(_as_stream(source))
+    data = _read_bytes(source)
+    if cache_instance is not None:
+        return cache_instance.get_or_compute(data, lambda: _predict_fresh(data))
+    return _predict_fresh(data)
+
+def get_prediction_batch(paths_or_file_objects):
+    """Get predictions for several images from the global model instance"""
+    if model_instance is None:
+        return [{'error': 'Model not initialized'} for _ in paths_or_file_objects]
+    return serving_model().predict_batch(paths_or_file_objects)
@@ -0,0 +1,139 @@
+# Perceptual-hash index that finds earlier predictions for re-encoded or slightly altered uploads
+import itertools
+import threading
+from array import array
+from collections import Counter
+
+from PIL import Image
+
+HASH_BITS = 64
+CHUNKS = 4  # Multi-index hashing: the 64-bit hash is split into four 16-bit keys
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(source, hash_size=8):
+    """64-bit difference hash of an image path or file object
+
+    The image is shrunk to a (hash_size + 1) x hash_size grayscale thumbnail
+    and each bit records whether a pixel is brighter than its right-hand
+    neighbour, so re-encoding, resizing and small crops flip only a few bits.
+    JPEGs are decoded at 1/8 scale via draft mode.
+    """
+    image = Image.open(source)
+    if image.format == 'JPEG':
+        image.draft('L', (hash_size * 8, hash_size * 8))
+    image = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_signed(value):
+    """Store a 64-bit hash in a signed BIGINT/INTEGER column"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """Hamming-radius search over perceptual hashes of earlier predictions
+
+    Multi-index hashing: every hash is filed under each of its four 16-bit
+    chunks. Two hashes within distance ``radius`` agree to within
+    ``radius // 4`` bits on at least one chunk (pigeonhole), so a lookup
+    only probes the buckets of those nearby chunk values and verifies the
+    few candidates: about 1-2 ms per lookup at a million entries for
+    radius 4. Probes per chunk grow from 17 (radius 4-7) to 137 (radius
+    8-11), so keep the radius below 8. Per entry only the hash, prediction
+    id and class probabilities are kept, in compact arrays.
+    """
+    def __init__(self, classes, radius=4):
+        self.classes = list(classes)
+        self.radius = int(radius)
+        self._hashes = array('Q')
+        self._ids = array('q')
+        self._probabilities = array('f')  # len(classes) values per entry
+        self._buckets = [{} for _ in range(CHUNKS)]
+        self._probe_masks = [sum(1 << bit for bit in bits)
+                             for flips in range(self.radius // CHUNKS + 1)
+                             for bits in itertools.combinations(range(CHUNK_BITS), flips)]
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, prediction_id, phash, probabilities):
+        """File a prediction's hash; identical hashes already present are skipped"""
+        probabilities = [float(probabilities[name]) for name in self.classes] \
+            if isinstance(probabilities, dict) else [float(p) for p in probabilities]
+        with self._lock:
+            if any(self._hashes[entry] == phash for entry in self._buckets[0].get(phash & CHUNK_MASK, ())):
+                return False
+            entry = len(self._hashes)
+            self._hashes.append(phash)
+            self._ids.append(int(prediction_id))
+            self._probabilities.extend(probabilities)
+            for chunk, bucket in enumerate(self._buckets):
+                bucket.setdefault((phash >> (chunk * CHUNK_BITS)) & CHUNK_MASK, []).append(entry)
+            return True
+
+    def _find(self, phash):
+        """(entry, distance) of the closest hash within the radius, or None"""
+        best = None
+        seen = set()
+        hashes = self._hashes
+        for chunk, bucket in enumerate(self._buckets):
+            key = (phash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            for mask in self._probe_masks:
+                for entry in bucket.get(key ^ mask, ()):
+                    if entry in seen:
+                        continue
+                    seen.add(entry)
+                    distance = bin(phash ^ hashes[entry]).count('1')
+                    if distance <= self.radius and (best is None or distance < best[1]):
+                        best = (entry, distance)
+                        if distance == 0:
+                            return best
+        return best
+
+    def lookup(self, phash):
+        """The stored prediction closest to ``phash`` within the radius, as a result dict, or None"""
+        found = self._find(phash)
+        with self._lock:  # Lookups run on every request thread; Counter increments are not atomic
+            self.counters['lookups'] += 1
+            if found is not None:
+                self.counters['hits'] += 1
+        if found is None:
+            return None
+        entry, distance = found
+        width = len(self.classes)
+        probabilities = self._probabilities[entry * width:(entry + 1) * width]
+        predicted_class_idx = max(range(width), key=probabilities.__getitem__)
+        return {
+            'predicted_class': self.classes[predicted_class_idx],
+            'predicted_class_idx': predicted_class_idx,
+            'confidence': float(probabilities[predicted_class_idx]),
+            'all_probabilities': dict(zip(self.classes, map(float, probabilities))),
+            'near_duplicate': True,
+            'near_duplicate_of': self._ids[entry],
+            'hamming_distance': distance
+        }
+
+    def stats(self):
+        with self._lock:
+            lookups, hits = self.counters['lookups'], self.counters['hits']
+        return {
+            'entries': len(self),
+            'radius': self.radius,
+            'lookups': lookups,
+            'hits': hits,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,151 @@
+# Content-addressed prediction cache for the web application
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+
+
+class _InFlight:
+    """A computation other requests for the same key can wait on"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+# Result keys handed only to the request that ran the model, never cached or shared
+TRANSIENT_KEYS = ('embedding',)
+
+
+class PredictionCache:
+    """Two-tier cache of prediction results keyed on uploaded bytes
+
+    Keys are the SHA-256 of the model fingerprint plus the raw upload, so a
+    new checkpoint or preprocessing setting never returns stale results.
+    Lookups go to a bounded in-memory LRU first and then to an SQLite table
+    that survives restarts. Concurrent requests for the same key share one
+    computation instead of each running the model.
+    """
+    def __init__(self, fingerprint, max_entries=1024, db_path='prediction_cache.db'):
+        self.fingerprint = fingerprint
+        self.max_entries = max(1, int(max_entries))
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = Counter()
+
+        if self.db_path:
+            # Schema setup uses a throwaway connection so none outlives a fork of this process
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS prediction_cache
+                            (key TEXT PRIMARY KEY,
+                             fingerprint TEXT NOT NULL,
+                             result TEXT NOT NULL,
+                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            # Entries from other checkpoints/configs can never be hit again
+            conn.execute('DELETE FROM prediction_cache WHERE fingerprint != ?', (self.fingerprint,))
+            conn.commit()
+            conn.close()
+
+    def _connection(self):
+        """One long-lived SQLite connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def key(self, data):
+        digest = hashlib.sha256(self.fingerprint.encode())
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _disk_get(self, key):
+        if not self.db_path:
+            return None
+        row = self._connection().execute('SELECT result FROM prediction_cache WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _disk_put(self, key, result):
+        if not self.db_path:
+            return
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO prediction_cache (key, fingerprint, result) VALUES (?, ?, ?)',
+                     (key, self.fingerprint, json.dumps(result)))
+        conn.commit()
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def get_or_compute(self, data, compute):
+        """Return the cached result for ``data`` or call ``compute()`` exactly once to produce it
+
+        Results containing an ``'error'`` key are handed back but never cached.
+        Keys in ``TRANSIENT_KEYS`` reach only the caller whose ``compute()`` ran.
+        """
+        key = self.key(data)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self._memory[key]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _InFlight()
+            else:
+                self.counters['shared'] += 1
+
+        if not leader:
+            flight.done.wait()
+            return flight.result
+
+        try:
+            result = self._disk_get(key)
+            with self._lock:
+                self.counters['disk_hits' if result is not None else 'misses'] += 1
+            computed = None
+            if result is None:
+                computed = compute()
+                result = {name: value for name, value in computed.items() if name not in TRANSIENT_KEYS}
+                if 'error' not in result:
+                    self._disk_put(key, result)
+            if 'error' not in result:
+                self._remember(key, result)
+            flight.result = result
+            return computed if computed is not None else result
+        except Exception as e:
+            flight.result = {'error': str(e)}
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def stats(self):
+        """Hit/miss counters and current in-memory size"""
+        with self._lock:
+            counters = dict(self.counters)
+            entries = len(self._memory)
+        hits = counters.get('memory_hits', 0) + counters.get('disk_hits', 0) + counters.get('shared', 0)
+        lookups = hits + counters.get('misses', 0)
+        return {
+            'memory_hits': counters.get('memory_hits', 0),
+            'disk_hits': counters.get('disk_hits', 0),
+            'shared': counters.get('shared', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'memory_entries': entries,
+            'max_entries': self.max_entries
+        }
@@ -0,0 +1,307 @@
+# Persistent prediction job queue stored in the application database (SQLite or PostgreSQL)
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+JOB_TABLE_DDL = {
+    'sqlite': '''CREATE TABLE IF NOT EXISTS prediction_jobs
+                 (id TEXT PRIMARY KEY,
+                  user_id INTEGER,
+                  filename TEXT,
+                  image BLOB,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  available_at REAL NOT NULL,
+                  leased_until REAL,
+                  result TEXT,
+                  error TEXT,
+                  created_at REAL NOT NULL,
+                  finished_at REAL)''',
+    'postgres': '''CREATE TABLE IF NOT EXISTS prediction_jobs (
+                  id TEXT PRIMARY KEY,
+                  user_id INTEGER,
+                  filename TEXT,
+                  image BYTEA,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  available_at DOUBLE PRECISION NOT NULL,
+                  leased_until DOUBLE PRECISION,
+                  result TEXT,
+                  error TEXT,
+                  created_at DOUBLE PRECISION NOT NULL,
+                  finished_at DOUBLE PRECISION)''',
+}
+JOB_INDEX_DDL = 'CREATE INDEX IF NOT EXISTS prediction_jobs_status ON prediction_jobs (status, created_at)'
+
+
+class JobQueue:
+    """Prediction jobs queued in a database table and run by in-process worker threads
+
+    ``db`` is the application's ``database.Database``, so jobs survive
+    restarts without an external broker and share its connections. Any
+    worker process may claim a queued job; a claim is a lease, and a job
+    whose worker died (lease expired) is claimed again, up to
+    ``max_attempts`` times. Workers renew the lease while a job runs, and a
+    worker whose lease was lost cannot complete or fail the job any more: the
+    attempt number is the fencing token. Failed attempts are retried with a
+    short backoff. The upload bytes are dropped from the row once the job ends.
+
+    ``on_saved(prediction_id, payload)`` is called for each prediction row a
+    completed job wrote, after its commit, like ``PredictionWriter`` does.
+    """
+    def __init__(self, db, lease_seconds=120, max_attempts=3, poll_interval=0.5, on_saved=None):
+        if db.dialect not in JOB_TABLE_DDL:
+            raise ValueError(f"Unknown dialect {db.dialect!r}, expected one of {sorted(JOB_TABLE_DDL)}")
+        self.db = db
+        self.dialect = db.dialect
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = max(1, int(max_attempts))
+        self.poll_interval = float(poll_interval)
+        self.on_saved = on_saved
+        self._changed = threading.Condition()  # Notified when this process submits or finishes a job
+        self._stop = threading.Event()
+        self._threads = []
+        self.counters = Counter()
+
+    def create_table(self):
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(JOB_TABLE_DDL[self.dialect])
+            cursor.execute(JOB_INDEX_DDL)
+
+    def submit(self, user_id, filename, data):
+        """Queue an upload for prediction and return its job id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.db.execute('INSERT INTO prediction_jobs (id, user_id, filename, image, available_at, created_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', (job_id, user_id, filename, bytes(data), now, now))
+        self.counters['submitted'] += 1
+        self._notify()
+        return job_id
+
+    def get(self, job_id, user_id=None):
+        """Status, result and error of a job, or None when it does not exist (or belongs to someone else)"""
+        row = self.db.fetch_one('SELECT id, user_id, status, attempts, result, error, created_at, finished_at '
+                                'FROM prediction_jobs WHERE id = ?', (job_id,))
+        if row is None or (user_id is not None and row[1] != user_id):
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[2],
+            'attempts': row[3],
+            'result': json.loads(row[4]) if row[4] else None,
+            'error': row[5],
+            'created_at': row[6],
+            'finished_at': row[7]
+        }
+
+    def claim(self):
+        """Lease the oldest runnable job (queued, or running with an expired lease), or return None"""
+        sql = self.db.translate
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            if self.dialect == 'sqlite':
+                cursor.execute('BEGIN IMMEDIATE')  # Take the write lock before reading, so two workers never pick the same row
+            while True:
+                now = time.time()
+                cursor.execute(sql(
+                    "SELECT id, user_id, filename, image, attempts FROM prediction_jobs "
+                    "WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND leased_until < ?) "
+                    "ORDER BY created_at LIMIT 1" + (' FOR UPDATE SKIP LOCKED' if self.dialect == 'postgres' else '')),
+                    (now, now))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                job_id, user_id, filename, image, attempts = row
+                if attempts >= self.max_attempts:
+                    # Its worker died on every attempt; give up rather than crash-looping
+                    cursor.execute(sql("UPDATE prediction_jobs SET status = 'failed', image = NULL, "
+                                       "error = ?, finished_at = ? WHERE id = ?"),
+                                   (f'Abandoned after {attempts} attempts', now, job_id))
+                    self.counters['abandoned'] += 1
+                    continue
+                cursor.execute(sql("UPDATE prediction_jobs SET status = 'running', attempts = attempts + 1, "
+                                   "leased_until = ? WHERE id = ?"), (now + self.lease_seconds, job_id))
+                if attempts:
+                    self.counters['retried'] += 1
+                return {'job_id': job_id, 'user_id': user_id, 'filename': filename,
+                        'image': bytes(image), 'attempt': attempts + 1}
+
+    # Only the worker holding the current, unexpired lease may change a running job
+    LEASE_HELD = "id = ? AND status = 'running' AND attempts = ? AND leased_until >= ?"
+
+    def renew(self, job_id, attempt):
+        """Extend the lease of a running job; False when this attempt no longer holds it"""
+        now = time.time()
+        renewed = self.db.execute("UPDATE prediction_jobs SET leased_until = ? WHERE " + self.LEASE_HELD,
+                                  (now + self.lease_seconds, job_id, attempt, now))
+        return renewed == 1
+
+    def complete(self, job_id, result, attempt, rows=(), payloads=()):
+        """Mark the job done and insert its prediction ``rows`` in one transaction
+
+        ``rows`` and ``payloads`` are what ``PredictionWriter.submit`` takes.
+        Returns False without writing anything when the lease was lost, so an
+        attempt that outlived its lease never saves a second copy of the
+        prediction or counts it twice in the user's stats.
+        """
+        now = time.time()
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.db.translate("UPDATE prediction_jobs SET status = 'done', image = NULL, result = ?, "
+                                             "finished_at = ? WHERE " + self.LEASE_HELD),
+                           (json.dumps(result), now, job_id, attempt, now))
+            if cursor.rowcount != 1:
+                self.counters['lease_lost'] += 1
+                return False
+            ids = self.db.insert_predictions(list(rows), cursor)
+        self.counters['done'] += 1
+        self._notify()
+        if self.on_saved is not None:
+            for prediction_id, payload in zip(ids, payloads):
+                try:
+                    self.on_saved(prediction_id, payload)
+                except Exception as e:
+                    print(f"Error after saving prediction {prediction_id}: {e}")
+        return True
+
+    def fail(self, job_id, error, attempt, retry=True):
+        """Record a failed attempt: requeue with backoff, or fail the job for good after max_attempts
+
+        Without ``retry`` the job fails at once. Returns False when the lease
+        was lost and the job was left alone.
+        """
+        now = time.time()
+        if retry and attempt < self.max_attempts:
+            changed = self.db.execute("UPDATE prediction_jobs SET status = 'queued', leased_until = NULL, "
+                                      "available_at = ?, error = ? WHERE " + self.LEASE_HELD,
+                                      (now + 2 ** attempt, error, job_id, attempt, now))
+            outcome = 'retries_scheduled'
+        else:
+            changed = self.db.execute("UPDATE prediction_jobs SET status = 'failed', image = NULL, error = ?, "
+                                      "finished_at = ? WHERE " + self.LEASE_HELD,
+                                      (error, now, job_id, attempt, now))
+            outcome = 'failed'
+        if changed != 1:
+            self.counters['lease_lost'] += 1
+            return False
+        self.counters[outcome] += 1
+        self._notify()
+        return True
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait(self, timeout):
+        """Sleep until this process submits or finishes a job, or ``timeout`` seconds pass"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def start_workers(self, handler, threads=1, ready=None):
+        """Run ``handler(job)`` for claimed jobs on ``threads`` daemon threads
+
+        ``handler`` returns the JSON result to store, or ``(result, rows,
+        payloads)`` to also insert prediction rows in the transaction that
+        marks the job done (see ``complete``). A result with an ``'error'``
+        key fails the job without retrying (e.g. an undecodable image), while
+        an exception counts as a failed attempt and is retried. The lease is
+        renewed every third of ``lease_seconds`` while the handler runs.
+        Workers idle until ``ready()`` is true.
+        """
+        for i in range(threads):
+            thread = threading.Thread(target=self._work, args=(handler, ready),
+                                      name=f'prediction-jobs-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self, handler, ready):
+        while not self._stop.is_set():
+            if ready is not None and not ready():
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                job = self.claim()
+            except Exception as e:
+                print(f"Error claiming prediction job: {e}")
+                self._stop.wait(self.poll_interval)
+                continue
+            if job is None:
+                self.wait(self.poll_interval)
+                continue
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job, done),
+                                         name=f"prediction-job-lease-{job['job_id'][:8]}", daemon=True)
+            heartbeat.start()
+            try:
+                output = handler(job)
+            except Exception as e:
+                import traceback
+                print(f"Error in prediction job {job['job_id']} (attempt {job['attempt']}): {e}")
+                print(traceback.format_exc())
+                self.fail(job['job_id'], str(e), job['attempt'])
+                continue
+            finally:
+                done.set()
+                heartbeat.join()
+            result, rows, payloads = output if isinstance(output, tuple) else (output, (), ())
+            try:
+                if 'error' in result:
+                    saved = self.fail(job['job_id'], result['error'], job['attempt'], retry=False)
+                else:
+                    saved = self.complete(job['job_id'], result, job['attempt'], rows, payloads)
+            except Exception as e:
+                print(f"Error finishing prediction job {job['job_id']}: {e}")
+                continue
+            if not saved:
+                print(f"Prediction job {job['job_id']} attempt {job['attempt']} lost its lease; result discarded")
+
+    def _heartbeat(self, job, done):
+        """Renew the job's lease until ``done`` is set or the lease turns out to be lost"""
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                if not self.renew(job['job_id'], job['attempt']):
+                    return
+            except Exception as e:
+                print(f"Error renewing the lease of prediction job {job['job_id']}: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._notify()
+
+    def events(self, job_id, user_id=None, timeout=300, keepalive=15):
+        """Server-sent events for one job: a ``status`` event per change until it is done or failed"""
+        deadline = time.time() + timeout
+        last_status = None
+        last_sent = time.time()
+        while time.time() < deadline:
+            job = self.get(job_id, user_id)
+            if job is None:
+                yield 'event: error\ndata: {"error": "Job not found"}\n\n'
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                last_sent = time.time()
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+                if last_status in ('done', 'failed'):
+                    return
+            elif time.time() - last_sent >= keepalive:
+                last_sent = time.time()
+                yield ': keep-alive\n\n'
+            self.wait(self.poll_interval)
+
+    def stats(self):
+        """Job counts by status in the database plus this process's counters"""
+        try:
+            rows = self.db.fetch_all('SELECT status, COUNT(*) FROM prediction_jobs GROUP BY status')
+        except Exception as e:
+            return {'error': str(e)}
+        stats = {status: 0 for status in JOB_STATUSES}
+        stats.update({status: count for status, count in rows})
+        stats['workers'] = sum(thread.is_alive() for thread in self._threads)
+        stats['process'] = dict(self.counters)
+        return stats
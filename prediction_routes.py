@@ -0,0 +1,326 @@
+# Prediction, job, history and health routes shared by app.py and app_heroku.py
+import csv
+import io
+import json
+import uuid
+
+from flask import Request, Response, jsonify, redirect, render_template, request, session, stream_with_context, url_for
+from werkzeug.utils import secure_filename
+
+from bulk_predict import close_uploads, iter_uploads, predict_stream, spool_uploads
+from model_web import (get_prediction, get_batcher_stats, get_cache_stats, get_cascade_stats,
+                       get_near_duplicate_stats, get_memory_usage, get_model_status, is_model_ready, stored_phash)
+
+
+def prediction_response(result):
+    """The fields of a prediction result returned to the client"""
+    return {
+        'predicted_class': result['predicted_class'],
+        'confidence': result['confidence'],
+        'all_probabilities': result['all_probabilities'],
+        'stage': result.get('stage', 'full'),
+        'near_duplicate': result.get('near_duplicate', False)
+    }
+
+
+def prediction_row(user_id, filename, result):
+    """The predictions-table row for one result, as Database.insert_predictions takes it"""
+    return (user_id, filename, result['predicted_class'], result['confidence'],
+            stored_phash(result), json.dumps(result['all_probabilities']))
+
+
+class PredictionRoutes:
+    """Saving predictions and the routes that make and read them, on top of one app's backends
+
+    Each app builds its ``Database``, ``JobQueue``, ``PredictionWriter`` and
+    optional ``UploadArchive`` from its own configuration and calls
+    ``register(app)``; login, signup and the page routes stay in the app.
+    """
+    def __init__(self, db, job_queue, prediction_writer, upload_archive=None,
+                 allowed_extensions=('png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'),
+                 max_image_bytes=16 * 1024 * 1024, bulk_max_content_length=512 * 1024 * 1024,
+                 bulk_max_images=1000, bulk_decode_workers=4, durable_writes=False, retry_after_seconds=5,
+                 job_events_timeout=300, history_page_size=20, history_max_page_size=100):
+        self.db = db
+        self.job_queue = job_queue
+        self.prediction_writer = prediction_writer
+        self.upload_archive = upload_archive
+        self.allowed_extensions = set(allowed_extensions)
+        self.max_image_bytes = max_image_bytes
+        self.bulk_max_content_length = bulk_max_content_length
+        self.bulk_max_images = bulk_max_images
+        self.bulk_decode_workers = bulk_decode_workers
+        self.durable_writes = durable_writes
+        self.retry_after_seconds = retry_after_seconds
+        self.job_events_timeout = job_events_timeout
+        self.history_page_size = history_page_size
+        self.history_max_page_size = history_max_page_size
+
+    def allowed_file(self, filename):
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
+
+    def save_predictions(self, user_id, items, durable=None):
+        """Queue ``(filename, result)`` prediction rows for the next group commit and return a future for their ids
+
+        With ``durable`` (default: the app's setting) the call blocks until
+        the rows are committed (and raises if the write failed). After the
+        commit each result is passed on to the embedding store and
+        near-duplicate index.
+        """
+        future = self.prediction_writer.submit([prediction_row(user_id, filename, result) for filename, result in items],
+                                               [dict(result) for _, result in items])  # The writer's own copies
+        if durable if durable is not None else self.durable_writes:
+            future.result()
+        return future
+
+    def save_prediction(self, user_id, filename, result, durable=None):
+        """Queue one prediction row; see save_predictions"""
+        return self.save_predictions(user_id, [(filename, result)], durable)
+
+    def run_prediction_job(self, job):
+        """Job queue handler: predict on the queued upload and return its row for the job's completing transaction
+
+        The row is written together with the job's ``done`` status, so a
+        retried job is never saved (or counted in the user's stats) twice.
+        """
+        result = get_prediction(job['image'])
+        if 'error' in result:
+            return {'error': result['error']}
+        if self.upload_archive is not None:
+            self.upload_archive.submit(job['filename'], job['image'])
+        return prediction_response(result), [prediction_row(job['user_id'], job['filename'], result)], [dict(result)]
+
+    def metrics(self):
+        return {
+            'batching': get_batcher_stats(),
+            'prediction_cache': get_cache_stats(),
+            'cascade': get_cascade_stats(),
+            'near_duplicates': get_near_duplicate_stats(),
+            'jobs': self.job_queue.stats(),
+            'database': self.db.stats(),
+            'prediction_writes': self.prediction_writer.stats(),
+            'memory': get_memory_usage()
+        }
+
+    def register(self, app):
+        """Add the prediction, job, history and health routes to ``app`` under their usual endpoint names"""
+        routes = self
+        db = self.db
+        job_queue = self.job_queue
+        bulk_max_content_length = self.bulk_max_content_length
+
+        class UploadRequest(Request):
+            """Raise the request size limit for the bulk endpoint only"""
+            @property
+            def max_content_length(self):
+                if self.path == '/predict/bulk':
+                    return bulk_max_content_length
+                return super().max_content_length
+
+        app.request_class = UploadRequest
+
+        def model_loading():
+            return jsonify({'error': 'Model is still loading, please try again shortly'}), 503, \
+                {'Retry-After': str(routes.retry_after_seconds)}
+
+        @app.route('/predict', methods=['POST'])
+        def predict():
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+
+            if not is_model_ready():
+                return model_loading()
+
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file uploaded'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
+
+            if file and routes.allowed_file(file.filename):
+                # Generate unique filename
+                filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
+
+                try:
+                    # Decode straight from the request stream; bytes are only kept when they get archived
+                    upload = file.read() if routes.upload_archive is not None else file.stream
+                    result = get_prediction(upload)
+
+                    if 'error' in result:
+                        return jsonify({'error': result['error']}), 500
+
+                    # Save prediction to database
+                    routes.save_prediction(session['user_id'], filename, result)
+
+                    if routes.upload_archive is not None:
+                        routes.upload_archive.submit(filename, upload)
+
+                    return jsonify(prediction_response(result))
+
+                except Exception as e:
+                    return jsonify({'error': str(e)}), 500
+
+            return jsonify({'error': 'Invalid file type'}), 400
+
+        @app.route('/predict/bulk', methods=['POST'])
+        def predict_bulk():
+            """Predict on many images and/or ZIP archives, streaming one NDJSON line per image as it finishes"""
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+
+            if not is_model_ready():
+                return model_loading()
+
+            files = request.files.getlist('files') + request.files.getlist('file')
+            if not files:
+                return jsonify({'error': 'No files uploaded'}), 400
+
+            user_id = session['user_id']
+            # Copied now: Flask closes request.files before the streamed body below runs
+            files = spool_uploads(files)
+
+            def save(items):
+                # One group commit per inference batch; durable, so a failed write is reported on the batch's lines
+                routes.save_predictions(user_id, [(str(uuid.uuid4()) + '_' + secure_filename(name.rsplit('/', 1)[-1]),
+                                                   result) for name, result in items], durable=True)
+
+            def lines():
+                count = errors = 0
+                try:
+                    uploads = iter_uploads(files, max_images=routes.bulk_max_images,
+                                           max_image_bytes=routes.max_image_bytes)
+                    for index, name, result in predict_stream(uploads, save, decode_workers=routes.bulk_decode_workers):
+                        count += 1
+                        if 'error' in result:
+                            errors += 1
+                            line = {'index': index, 'filename': name, 'error': result['error']}
+                        else:
+                            line = {'index': index, 'filename': name, **prediction_response(result)}
+                        yield json.dumps(line) + '\n'
+                finally:
+                    close_uploads(files)
+                yield json.dumps({'done': True, 'images': count, 'errors': errors}) + '\n'
+
+            return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+        @app.route('/predict/jobs', methods=['POST'])
+        def create_prediction_job():
+            """Queue an upload and return at once; poll the job or follow its events for the result"""
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file uploaded'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
+
+            if not routes.allowed_file(file.filename):
+                return jsonify({'error': 'Invalid file type'}), 400
+
+            filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
+            job_id = job_queue.submit(session['user_id'], filename, file.read())
+            status_url = url_for('prediction_job', job_id=job_id)
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': status_url,
+                'events_url': url_for('prediction_job_events', job_id=job_id)
+            }), 202, {'Location': status_url}
+
+        @app.route('/predict/jobs/<job_id>')
+        def prediction_job(job_id):
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+            job = job_queue.get(job_id, session['user_id'])
+            if job is None:
+                return jsonify({'error': 'Job not found'}), 404
+            return jsonify(job)
+
+        @app.route('/predict/jobs/<job_id>/events')
+        def prediction_job_events(job_id):
+            """Server-sent events: one 'status' event per change of the job until it is done or failed"""
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+            events = job_queue.events(job_id, session['user_id'], timeout=routes.job_events_timeout)
+            return Response(stream_with_context(events), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        @app.route('/history')
+        def history():
+            if 'user_id' not in session:
+                return redirect(url_for('login'))
+
+            # First page rendered server-side; the page fetches older ones from /history/predictions on demand
+            predictions, next_cursor = db.prediction_page(session['user_id'], limit=routes.history_page_size)
+            stats = db.user_stats(session['user_id'])
+
+            return render_template('history.html', predictions=predictions, next_cursor=next_cursor, stats=stats,
+                                   username=session.get('username'))
+
+        @app.route('/stats')
+        def user_stats():
+            """Screening summary of the logged-in user, read from the incrementally maintained stats table"""
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+            return jsonify(db.user_stats(session['user_id']))
+
+        @app.route('/history/predictions')
+        def history_page():
+            """One page of the user's history as JSON; pass ``next_cursor`` back as ``?cursor=`` for the next page"""
+            if 'user_id' not in session:
+                return jsonify({'error': 'Please log in first'}), 401
+
+            limit = min(max(request.args.get('limit', routes.history_page_size, type=int), 1),
+                        routes.history_max_page_size)
+            try:
+                rows, next_cursor = db.prediction_page(session['user_id'], limit, request.args.get('cursor'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            return jsonify({
+                'predictions': [dict(row._asdict(), created_at=str(row.created_at)) for row in rows],
+                'next_cursor': next_cursor
+            })
+
+        @app.route('/history/export.csv')
+        def export_history():
+            """The user's whole history as CSV, streamed from a server-side cursor instead of loaded at once"""
+            if 'user_id' not in session:
+                return redirect(url_for('login'))
+
+            user_id = session['user_id']
+
+            def lines():
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(['id', 'filename', 'predicted_class', 'confidence', 'created_at', 'probabilities'])
+                for row in db.iter_user_predictions(user_id):
+                    writer.writerow(row)
+                    if buffer.tell() >= 64 * 1024:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+
+            return Response(stream_with_context(lines()), mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=prediction_history.csv'})
+
+        @app.route('/healthz')
+        def healthz():
+            return jsonify({'status': 'ok'})
+
+        @app.route('/readyz')
+        def readyz():
+            status = get_model_status()
+            if not status['ready']:
+                return jsonify(status), 503, {'Retry-After': str(routes.retry_after_seconds)}
+            return jsonify(status)
+
+        @app.route('/metrics')
+        def metrics():
+            return jsonify(routes.metrics())
+
+        return app
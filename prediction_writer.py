@@ -0,0 +1,174 @@
+# Write-behind buffer that persists prediction rows in group commits
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+class _PendingWrite:
+    """Rows from one caller waiting for the next flush"""
+    __slots__ = ('rows', 'payloads', 'future', 'enqueued_at')
+
+    def __init__(self, rows, payloads):
+        self.rows = rows
+        self.payloads = payloads
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class PredictionWriter:
+    """Collect prediction rows in memory and insert them with one transaction per flush
+
+    ``insert(rows)`` writes a list of rows in a single transaction and
+    returns their ids (``Database.insert_predictions``). A background thread
+    flushes once ``max_batch`` rows are waiting or the oldest has waited
+    ``max_delay_ms``, and whatever is left when the process exits, so
+    request threads never wait on the database write lock. ``submit``
+    returns a future for the ids: write-behind callers ignore it, durable
+    callers block on it until their group commit is done.
+    ``on_saved(prediction_id, payload)`` runs for every row after it is
+    committed. The thread starts on first use in each process, so a writer
+    created before a gunicorn fork works in every worker.
+    """
+    def __init__(self, insert, max_batch=256, max_delay_ms=50, on_saved=None, lag_window=1000):
+        self.insert = insert
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max(0.0, float(max_delay_ms)) / 1000.0
+        self.on_saved = on_saved
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._flush_sizes = Counter()
+        self._lags = deque(maxlen=lag_window)
+        self._pending = 0
+        self._rows = 0
+        self._errors = 0
+        atexit.register(self.close)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pending = 0
+                self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def submit(self, rows, payloads=None):
+        """Queue rows for the next group commit and return a future for their ids"""
+        pending = _PendingWrite(list(rows), list(payloads) if payloads is not None else [None] * len(rows))
+        if self._closed:
+            self._flush([pending])  # Shutting down: nothing will flush later, so write now
+            return pending.future
+        pending_queue = self._start()
+        with self._lock:
+            self._pending += len(pending.rows)
+        pending_queue.put(pending)
+        return pending.future
+
+    def _collect(self, first):
+        """Gather more writes after ``first`` until max_batch rows or the delay window closes"""
+        batch = [first]
+        count = len(first.rows)
+        deadline = first.enqueued_at + self.max_delay
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                self._queue.put(None)  # Flush this batch first, then stop
+                break
+            batch.append(pending)
+            count += len(pending.rows)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._flush(self._collect(first))
+
+    def _flush(self, batch):
+        rows = [row for pending in batch for row in pending.rows]
+        try:
+            ids = self.insert(rows)
+        except Exception as e:
+            print(f"Error writing {len(rows)} predictions: {e}")
+            with self._lock:
+                self._errors += len(rows)
+                self._pending -= len(rows)
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._rows += len(rows)
+            self._pending -= len(rows)
+            self._flush_sizes[1 << (len(rows) - 1).bit_length()] += 1  # Power-of-two buckets
+            self._lags.extend((now - pending.enqueued_at) * 1000.0 for pending in batch)
+
+        start = 0
+        for pending in batch:
+            pending_ids = ids[start:start + len(pending.rows)]
+            start += len(pending.rows)
+            if self.on_saved is not None:
+                for prediction_id, payload in zip(pending_ids, pending.payloads):
+                    try:
+                        self.on_saved(prediction_id, payload)
+                    except Exception as e:
+                        print(f"Error recording prediction {prediction_id}: {e}")
+            pending.future.set_result(pending_ids)
+
+    def close(self, timeout=30):
+        """Flush everything still queued and stop the writer thread"""
+        self._closed = True
+        with self._lock:
+            running = self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+        if running:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            # Writes queued behind the stop marker by threads that raced with close()
+            leftover = []
+            while True:
+                try:
+                    pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is not None:
+                    leftover.append(pending)
+            if leftover:
+                self._flush(leftover)
+
+    def stats(self):
+        """Return rows waiting, flush-size histogram and commit lag percentiles"""
+        with self._lock:
+            lags = sorted(self._lags)
+            flushes = sum(self._flush_sizes.values())
+
+            def percentile(q):
+                if not lags:
+                    return None
+                return lags[min(len(lags) - 1, int(q * len(lags)))]
+
+            return {
+                'max_batch': self.max_batch,
+                'max_delay_ms': self.max_delay * 1000.0,
+                'pending_rows': self._pending,
+                'rows': self._rows,
+                'errors': self._errors,
+                'flushes': flushes,
+                'mean_flush_size': self._rows / flushes if flushes else 0.0,
+                'flush_size_histogram': dict(sorted(self._flush_sizes.items())),
+                'lag_ms': {'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                           'max': lags[-1] if lags else None}
+            }
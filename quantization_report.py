@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Accuracy-parity and cost report for INT8 quantized inference
+
+Runs the fp32 model and each quantized mode over the same images and prints
+top-1 agreement, probability drift, per-image latency and serialized model size
+(the bytes of the saved state dict, not the memory the process uses).
+
+Usage:
+    python quantization_report.py --checkpoint classifier.pt --images sampleimages
+    python quantization_report.py --modes dynamic --json report.json
+"""
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import torch
+
+from model_web import RetinalBlindnessModel, QUANTIZATION_MODES, list_images
+
+
+def serialized_bytes(model):
+    """Size of the state dict as torch.save writes it, in bytes"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def run(model, batch, repeats):
+    """Return probabilities for the batch and the mean latency per image in ms"""
+    probabilities = model._forward(batch)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model._forward(batch)
+    elapsed = (time.perf_counter() - start) / repeats
+    return probabilities, elapsed * 1000.0 / batch.shape[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare INT8 quantized inference against fp32')
+    parser.add_argument('--checkpoint', default='classifier.pt')
+    parser.add_argument('--images', default='sampleimages', help='evaluation images')
+    parser.add_argument('--calibration', default='sampleimages', help='calibration images for static mode')
+    parser.add_argument('--modes', nargs='+', default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument('--repeats', type=int, default=3, help='timed passes over the evaluation set')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    reference = RetinalBlindnessModel(args.checkpoint, scripted_path=None)
+    if not reference.is_trained:
+        parser.error(f"Could not load trained weights from {args.checkpoint}")
+    reference.device = torch.device("cpu")
+    reference.model.to(reference.device)
+
+    # Preprocess once so every model sees identical inputs
+    paths = list_images(args.images)
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+    batch = torch.stack([reference.preprocess(path) for path in paths])
+
+    fp32_probs, fp32_latency = run(reference, batch, args.repeats)
+    fp32_top1 = fp32_probs.argmax(axis=1)
+    report = {
+        'images': len(paths),
+        'fp32': {'latency_ms_per_image': fp32_latency, 'serialized_bytes': serialized_bytes(reference.model)}
+    }
+
+    for mode in args.modes:
+        model = RetinalBlindnessModel(args.checkpoint, scripted_path=None,
+                                      quantization=mode, calibration_dir=args.calibration)
+        probs, latency = run(model, batch, args.repeats)
+        drift = np.abs(probs - fp32_probs)
+        report[mode] = {
+            'top1_agreement': float((probs.argmax(axis=1) == fp32_top1).mean()),
+            'max_prob_drift': float(drift.max()),
+            'mean_prob_drift': float(drift.mean()),
+            'latency_ms_per_image': latency,
+            'speedup': fp32_latency / latency,
+            'serialized_bytes': serialized_bytes(model.model)
+        }
+
+    print(f"\nQuantization report over {len(paths)} images from {args.images}")
+    print(f"{'mode':<10}{'top-1 agree':>12}{'max drift':>11}{'mean drift':>12}{'ms/img':>9}{'speedup':>9}{'saved MB':>10}")
+    print(f"{'fp32':<10}{'-':>12}{'-':>11}{'-':>12}{fp32_latency:>9.1f}{1.0:>9.2f}{report['fp32']['serialized_bytes'] / 2**20:>10.1f}")
+    for mode in args.modes:
+        row = report[mode]
+        print(f"{mode:<10}{row['top1_agreement']:>12.3f}{row['max_prob_drift']:>11.4f}{row['mean_prob_drift']:>12.4f}"
+              f"{row['latency_ms_per_image']:>9.1f}{row['speedup']:>9.2f}{row['serialized_bytes'] / 2**20:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
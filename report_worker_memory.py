@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Report per-worker memory of a running gunicorn server
+
+Unique memory (private pages) is what each extra worker really costs; with
+the model preloaded in the master it should be far below the ~230 MB of
+ResNet-152 weights, which show up as shared instead.
+
+Usage:
+    python report_worker_memory.py <gunicorn master pid>
+"""
+import sys
+
+from model_web import get_memory_usage
+
+
+def child_pids(pid):
+    """Direct children of a process, from /proc/<pid>/task/*/children"""
+    children = []
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        children.extend(int(child) for child in f.read().split())
+    return children
+
+
+def main():
+    if len(sys.argv) != 2:
+        print('please provide the pid of the gunicorn master !')
+        sys.exit(1)
+    master = int(sys.argv[1])
+
+    print(f"{'role':<8}{'pid':>8}{'rss MB':>10}{'pss MB':>10}{'unique MB':>11}{'shared MB':>11}")
+    rows = [('master', get_memory_usage(master))] + [('worker', get_memory_usage(pid)) for pid in child_pids(master)]
+    for role, usage in rows:
+        if usage is None:
+            continue
+        print(f"{role:<8}{usage['pid']:>8}{usage['rss_mb']:>10.1f}{usage['pss_mb']:>10.1f}"
+              f"{usage['unique_mb']:>11.1f}{usage['shared_mb']:>11.1f}")
+
+    total_pss = sum(usage['pss_mb'] for _, usage in rows if usage)
+    print(f"Total PSS (actual host memory used by the server): {total_pss:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Runtime (CPU threading and batching) configuration for inference processes
+#
+# autotune.py measures the current machine and writes runtime_config.json;
+# model_web.initialize_model and gunicorn.conf.py read it at startup.
+import json
+import os
+
+import torch
+
+RUNTIME_CONFIG_PATH = os.environ.get('RUNTIME_CONFIG', 'runtime_config.json')
+
+
+def load_runtime_config(path=RUNTIME_CONFIG_PATH):
+    """Read the tuned settings, or an empty dict when the file is missing or unreadable"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring runtime config {path}: {e}")
+        return {}
+
+
+def apply_thread_settings(config):
+    """Size this process's intra-op and inter-op thread pools from the config
+
+    The inter-op pool can only be sized before it is first used, so a late
+    call keeps the existing pool and only changes the intra-op thread count.
+    """
+    num_threads = config.get('num_threads')
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    interop_threads = config.get('num_interop_threads')
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError:
+            pass  # Already started in this process
+    if num_threads or interop_threads:
+        print(f"Using {torch.get_num_threads()} intra-op and {torch.get_num_interop_threads()} inter-op threads")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Inference-only slim checkpoints
+
+classifier.pt holds the model weights plus the Adam optimizer state, which
+inference never uses. This writes only the model state dict, optionally in
+fp16/bf16 storage, next to the original as <name>_slim.pt. On PyTorch 2.1+
+the slim file is memory-mapped when loaded, so workers on one host share
+the same page-cache pages instead of each holding a private copy. fp16/bf16
+files halve disk and page cache but are upcast to fp32 at load, which
+allocates private memory again; keep fp32 storage for zero-copy loading.
+
+Usage:
+    python slim_checkpoint.py                              # classifier.pt -> classifier_slim.pt
+    python slim_checkpoint.py --checkpoint path/classifier.pt --dtype float16
+    python slim_checkpoint.py --measure                    # peak RSS and load time, original vs slim
+"""
+import argparse
+import inspect
+import os
+import subprocess
+import sys
+
+import torch
+
+SLIM_FORMAT = 'slim-v1'
+STORAGE_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+def slim_path_for(checkpoint_path):
+    """Where the slim file for a checkpoint lives: classifier.pt -> classifier_slim.pt"""
+    root, ext = os.path.splitext(checkpoint_path)
+    return f"{root}_slim{ext or '.pt'}"
+
+
+def supports_mmap():
+    """True when torch.load can memory-map files and load_state_dict can adopt the tensors"""
+    return ('mmap' in inspect.signature(torch.load).parameters
+            and 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters)
+
+
+def write_slim_checkpoint(checkpoint_path, output_path=None, dtype='float32'):
+    """Write the model weights of a training checkpoint without the optimizer state"""
+    output_path = output_path or slim_path_for(checkpoint_path)
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    storage_dtype = STORAGE_DTYPES[dtype]
+    state_dict = {
+        name: tensor.to(storage_dtype) if tensor.is_floating_point() else tensor
+        for name, tensor in checkpoint['model_state_dict'].items()
+    }
+    arch = checkpoint.get('arch', 'resnet152')  # classifier.pt predates the arch key
+    # The zipfile serialization format is required for memory-mapped loading
+    torch.save({'format': SLIM_FORMAT, 'arch': arch, 'dtype': dtype, 'model_state_dict': state_dict}, output_path)
+    print(f"Slim checkpoint written to {output_path} "
+          f"({os.path.getsize(checkpoint_path) / 2**20:.1f} MB -> {os.path.getsize(output_path) / 2**20:.1f} MB)")
+    return output_path
+
+
+def load_slim_state_dict(path, arch=None):
+    """Load a slim state dict, memory-mapped when this PyTorch supports it
+
+    With ``arch``, raise ValueError when the file holds another architecture.
+    """
+    if supports_mmap():
+        slim = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    else:
+        slim = torch.load(path, map_location='cpu')
+    if slim.get('format') != SLIM_FORMAT:
+        raise ValueError(f"{path} is not a slim checkpoint")
+    slim_arch = slim.get('arch', 'resnet152')  # Slim files written before the arch key
+    if arch is not None and slim_arch != arch:
+        raise ValueError(f"{path} holds a {slim_arch} model, expected {arch}")
+    return slim['model_state_dict']
+
+
+MEASURE_SNIPPET = '''
+import resource, sys, time
+start = time.perf_counter()
+from model_web import RetinalBlindnessModel
+model = RetinalBlindnessModel(sys.argv[1], scripted_path=None, prefer_slim=sys.argv[2] == "1")
+elapsed = time.perf_counter() - start
+assert model.is_trained, "weights failed to load"
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def measure(checkpoint_path, prefer_slim):
+    """Load time and peak RSS (MB) of a fresh process building the web model"""
+    output = subprocess.run([sys.executable, '-c', MEASURE_SNIPPET, checkpoint_path, '1' if prefer_slim else '0'],
+                            check=True, capture_output=True, text=True).stdout.split()
+    elapsed, max_rss_kb = float(output[-2]), int(output[-1])
+    return elapsed, max_rss_kb / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write an inference-only checkpoint')
+    parser.add_argument('--checkpoint', default='classifier.pt')
+    parser.add_argument('--output', help='defaults to <checkpoint>_slim.pt')
+    parser.add_argument('--dtype', default='float32', choices=sorted(STORAGE_DTYPES))
+    parser.add_argument('--measure', action='store_true', help='compare peak RSS and load time afterwards')
+    args = parser.parse_args()
+
+    output_path = write_slim_checkpoint(args.checkpoint, args.output, args.dtype)
+
+    if args.measure:
+        if args.output and os.path.abspath(output_path) != os.path.abspath(slim_path_for(args.checkpoint)):
+            parser.error('--measure needs the slim file at its default location')
+        print(f"\n{'checkpoint':<12}{'load s':>10}{'peak RSS MB':>14}")
+        for label, prefer_slim in (('original', False), ('slim', True)):
+            elapsed, rss = measure(args.checkpoint, prefer_slim)
+            print(f"{label:<12}{elapsed:>10.2f}{rss:>14.1f}")
+        if not supports_mmap():
+            print("Note: this PyTorch cannot memory-map checkpoints (needs 2.1+), slim files load with a copy")
+
+
+if __name__ == '__main__':
+    main()
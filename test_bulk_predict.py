@@ -0,0 +1,48 @@
+import io
+import json
+import zipfile
+
+from PIL import Image
+
+import model_web
+
+
+def image_bytes(color, fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def post_bulk(client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('eyes/left.png', image_bytes('red'))
+        zf.writestr('eyes/notes.txt', 'not an image')
+        zf.writestr('__MACOSX/eyes/._left.png', b'metadata')
+    archive.seek(0)
+    response = client.post('/predict/bulk', data={
+        'files': [(io.BytesIO(image_bytes('green', 'JPEG')), 'right.jpg'),
+                  (archive, 'batch.zip'),
+                  (io.BytesIO(b'text'), 'readme.txt')]
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_bulk_upload_is_read_before_the_response_streams(client):
+    lines = post_bulk(client)
+    assert lines[-1] == {'done': True, 'images': 3, 'errors': 1}
+    by_name = {line['filename']: line for line in lines[:-1]}
+    assert set(by_name) == {'right.jpg', 'batch.zip/eyes/left.png', 'readme.txt'}
+    assert by_name['readme.txt']['error'] == 'Invalid file type'
+    for name in ('right.jpg', 'batch.zip/eyes/left.png'):
+        assert 'error' not in by_name[name], by_name[name]
+        assert by_name[name]['predicted_class'] in model_web.model_instance.classes
+
+
+def test_bulk_upload_through_the_cascade(client, monkeypatch):
+    full = model_web.model_instance
+    monkeypatch.setattr(model_web, 'cascade_instance', model_web.ModelCascade(full, full))
+    lines = post_bulk(client)
+    assert lines[-1]['errors'] == 1
+    assert all('stage' in line for line in lines[:-1] if 'error' not in line)
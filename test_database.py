@@ -0,0 +1,65 @@
+import sys
+
+import pytest
+
+import benchmark_db
+from database import Database, DR_CLASSES, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(f"sqlite:///{tmp_path / 'users.db'}")
+    db.init_schema()
+    return db
+
+
+def summary(stats):
+    return dict(stats, last_prediction_at=None, mean_confidence=pytest.approx(stats['mean_confidence']))
+
+
+def test_translate_rewrites_placeholders_for_postgres(db):
+    query = "SELECT id FROM users WHERE username = ? AND filename LIKE '%.png' AND id > ?"
+    assert db.translate(query) == query
+    db.dialect = 'postgres'  # translate only looks at the dialect, so no server is needed
+    assert db.translate(query) == "SELECT id FROM users WHERE username = %s AND filename LIKE '%%.png' AND id > %s"
+
+
+def test_cursor_round_trip_and_bad_cursors():
+    cursor = encode_cursor('2026-01-02 03:04:05', 42)
+    assert '=' not in cursor and decode_cursor(cursor) == ('2026-01-02 03:04:05', 42)
+    for bad in ('not-a-cursor', encode_cursor('2026-01-02', 'x'), 'WzFd', '', '!!!'):
+        with pytest.raises(ValueError, match='Invalid history cursor'):
+            decode_cursor(bad)
+
+
+def test_keyset_pages_cover_rows_sharing_a_timestamp(db):
+    user_id = db.create_user('alice', 'x')
+    ids = db.insert_predictions([(user_id, f'{i}.png', DR_CLASSES[0], 0.9, None, '[]') for i in range(5)])
+    seen, cursor = [], None
+    while True:
+        rows, cursor = db.prediction_page(user_id, limit=2, cursor=cursor)
+        seen += [row.id for row in rows]
+        if cursor is None:
+            break
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_incremental_user_stats_match_full_recount(db):
+    users = [db.create_user(name, 'x') for name in ('alice', 'bob', 'carol')]
+    for batch in range(4):
+        db.insert_predictions([(users[(batch + i) % 2], f'{batch}_{i}.png', DR_CLASSES[(batch * 3 + i) % 5],
+                                0.5 + i / 20, None, '[]') for i in range(batch + 3)])
+    db.insert_predictions([(None, 'anonymous.png', DR_CLASSES[0], 0.9, None, '[]')])
+
+    incremental = {user_id: summary(db.user_stats(user_id)) for user_id in users}
+    assert incremental[users[2]]['total'] == 0
+    assert db.rebuild_user_stats() == 2
+    assert {user_id: summary(db.user_stats(user_id)) for user_id in users} == incremental
+
+
+def test_benchmark_leaves_no_rows_behind(db, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['benchmark_db.py', '--database-url', f'sqlite:///{db.path}',
+                                      '--requests', '20', '--threads', '2'])
+    benchmark_db.main()
+    for table in ('users', 'predictions', 'user_prediction_stats'):
+        assert db.fetch_value(f'SELECT COUNT(*) FROM {table}') == 0, table
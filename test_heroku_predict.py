@@ -0,0 +1,76 @@
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import model_web
+
+
+@pytest.fixture(scope='module')
+def heroku(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('heroku')
+    checkpoint = workdir / 'student.pt'
+    untrained = model_web.RetinalBlindnessModel(None, arch='resnet18', scripted_path=None)
+    torch.save({'arch': 'resnet18', 'model_state_dict': untrained.model.state_dict()}, checkpoint)
+
+    env = {
+        'DATABASE_URL': f'sqlite:///{workdir / "users.db"}',
+        'MODEL_PATH': str(checkpoint),
+        'MODEL_ARCH': 'resnet18',
+        'CASCADE_MODEL_PATH': '',
+        'EMBEDDING_STORE_PATH': str(workdir / 'embeddings.f16'),
+        'PREDICTION_CACHE_DB': str(workdir / 'prediction_cache.db'),
+        'UPLOAD_FOLDER': str(workdir / 'uploads'),
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        import app_heroku
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    deadline = time.monotonic() + 300
+    while not model_web.is_model_ready():
+        assert model_web.get_model_status()['error'] is None
+        assert time.monotonic() < deadline, 'model did not load'
+        time.sleep(0.2)
+    assert model_web.embedding_store_instance is not None
+    user_id = app_heroku.db.create_user('heroku', app_heroku.hash_password('heroku'))
+    client = app_heroku.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['username'] = 'heroku'
+    return app_heroku, client
+
+
+def upload(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    buffer.seek(0)
+    return {'file': (buffer, f'eye{seed}.png')}
+
+
+def test_predict_with_embedding_store(heroku):
+    app_heroku, client = heroku
+    for seed in range(3):
+        response = client.post('/predict', data=upload(seed), content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        body = response.get_json()
+        assert 'embedding' not in body
+        assert body['predicted_class'] in model_web.model_instance.classes
+
+    # The rows are written behind the responses; their embeddings follow each group commit
+    deadline = time.monotonic() + 10
+    while len(model_web.embedding_store_instance) < 3:
+        assert time.monotonic() < deadline, app_heroku.prediction_writer.stats()
+        time.sleep(0.05)
+    assert len(model_web.embedding_store_instance.records()) == 3
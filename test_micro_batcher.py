@@ -0,0 +1,75 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from model_web import MicroBatcher, RetinalBlindnessModel
+
+COLORS = ['red', 'green', 'blue', 'yellow', 'purple', 'orange']
+
+
+@pytest.fixture(scope='module')
+def model():
+    model = RetinalBlindnessModel(None, arch='resnet18', scripted_path=None)
+    model.is_trained = True  # Run the randomly initialized network instead of the demo's random outputs
+    return model
+
+
+def image(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_batches_concurrent_requests_and_routes_results(model):
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=200)
+    with ThreadPoolExecutor(len(COLORS)) as pool:
+        results = list(pool.map(lambda color: batcher.submit(image(color)), COLORS))
+
+    for color, result in zip(COLORS, results):
+        expected = model.predict_tensors([model.preprocess(image(color))])[0]
+        assert result['predicted_class'] == expected['predicted_class']
+        assert np.allclose(list(result['all_probabilities'].values()),
+                           list(expected['all_probabilities'].values()), atol=1e-5)
+
+    stats = batcher.stats()
+    assert stats['requests'] == len(COLORS)
+    assert max(stats['batch_size_histogram']) == 4  # The window merged requests, up to the size limit
+    assert stats['batches'] == 2
+
+
+class FailingModel:
+    def __init__(self, model, release=None):
+        self.model = model
+        self.release = release
+
+    def preprocess(self, source):
+        return self.model.preprocess(source)
+
+    def predict_tensors(self, tensors):
+        if self.release is not None:
+            self.release.wait(5)
+        raise RuntimeError('out of memory')
+
+
+def test_failed_batch_reports_error_to_every_caller(model):
+    batcher = MicroBatcher(FailingModel(model), max_batch_size=4, max_wait_ms=100)
+    with ThreadPoolExecutor(3) as pool:
+        results = list(pool.map(lambda color: batcher.submit(image(color)), COLORS[:3]))
+    assert results == [{'error': 'out of memory'}] * 3
+    assert batcher.stats()['failed_batches'] >= 1
+    assert batcher.submit(image('red')) == {'error': 'out of memory'}  # The batcher thread survived
+
+
+def test_submit_times_out(model):
+    release = threading.Event()
+    batcher = MicroBatcher(FailingModel(model, release), max_wait_ms=0, timeout_seconds=0.1)
+    try:
+        assert 'timed out' in batcher.submit(image('red'))['error']
+        assert batcher.stats()['timeouts'] == 1
+    finally:
+        release.set()
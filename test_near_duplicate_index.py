@@ -0,0 +1,67 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image, ImageDraw
+
+from near_duplicate_index import CHUNK_BITS, NearDuplicateIndex, dhash, to_signed, to_unsigned
+
+CLASSES = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
+BASE = 0x0123456789ABCDEF
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def spread(count):
+    """``count`` bit positions spread round-robin over the four chunks"""
+    return [(i % 4) * CHUNK_BITS + i // 4 for i in range(count)]
+
+
+@pytest.mark.parametrize('radius', [0, 3, 4, 7, 8])
+@pytest.mark.parametrize('layout', ['spread', 'one_chunk'])
+def test_lookup_finds_hashes_exactly_up_to_the_radius(radius, layout):
+    index = NearDuplicateIndex(CLASSES, radius=radius)
+    index.add(7, BASE, [0.1, 0.6, 0.1, 0.1, 0.1])
+    bits = spread(radius + 1) if layout == 'spread' else list(range(radius + 1))
+
+    at_radius = index.lookup(flip(BASE, bits[:radius]))
+    assert at_radius['near_duplicate_of'] == 7 and at_radius['hamming_distance'] == radius
+    assert at_radius['predicted_class'] == 'Mild'
+    assert index.lookup(flip(BASE, bits)) is None
+
+
+def test_lookup_prefers_the_closest_entry():
+    index = NearDuplicateIndex(CLASSES, radius=6)
+    index.add(1, flip(BASE, spread(5)), [1, 0, 0, 0, 0])
+    index.add(2, flip(BASE, spread(2)), [0, 0, 1, 0, 0])
+    assert index.lookup(BASE)['near_duplicate_of'] == 2
+    assert not index.add(3, flip(BASE, spread(2)), [0, 0, 0, 1, 0])  # Identical hash is not filed twice
+    assert len(index) == 2
+
+
+def test_counters_are_exact_under_concurrent_lookups():
+    index = NearDuplicateIndex(CLASSES, radius=4)
+    index.add(1, BASE, [1, 0, 0, 0, 0])
+    probes = [BASE, flip(BASE, spread(8))] * 500
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(index.lookup, probes))
+    stats = index.stats()
+    assert stats['lookups'] == 1000 and stats['hits'] == 500 and stats['hit_rate'] == 0.5
+
+
+def test_dhash_survives_reencoding_and_signed_storage():
+    image = Image.new('L', (256, 192), 0)
+    ImageDraw.Draw(image).ellipse((40, 30, 200, 170), fill=200)
+    png, jpeg = io.BytesIO(), io.BytesIO()
+    image.save(png, format='PNG')
+    image.resize((200, 150)).save(jpeg, format='JPEG', quality=70)
+    png.seek(0)
+    jpeg.seek(0)
+
+    original, reencoded = dhash(png), dhash(jpeg)
+    assert bin(original ^ reencoded).count('1') <= 4
+    assert to_unsigned(to_signed(original)) == original and -2 ** 63 <= to_signed(original) < 2 ** 63
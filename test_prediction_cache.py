@@ -0,0 +1,53 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prediction_cache import PredictionCache
+
+
+def result(name):
+    return {'predicted_class': name, 'confidence': 0.9}
+
+
+def test_lru_evicts_least_recently_used_from_memory_only(tmp_path):
+    cache = PredictionCache('model-a', max_entries=2, db_path=str(tmp_path / 'cache.db'))
+    for data in (b'a', b'b'):
+        cache.get_or_compute(data, lambda: result(data.decode()))
+    assert cache.get_or_compute(b'a', lambda: result('recomputed')) == result('a')  # Now most recently used
+    cache.get_or_compute(b'c', lambda: result('c'))
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['memory_entries'] == 2 and stats['memory_hits'] == 1
+    assert cache.get_or_compute(b'b', lambda: result('recomputed')) == result('b')  # Back from SQLite
+    assert cache.stats()['disk_hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_new_fingerprint_and_errors_are_not_served_from_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    PredictionCache('model-a', db_path=path).get_or_compute(b'a', lambda: result('old'))
+    cache = PredictionCache('model-b', db_path=path)
+    assert cache.get_or_compute(b'a', lambda: {'error': 'bad image'}) == {'error': 'bad image'}
+    assert cache.get_or_compute(b'a', lambda: result('new')) == result('new')
+    assert cache.stats()['misses'] == 2
+
+
+def test_concurrent_requests_share_one_computation(tmp_path):
+    cache = PredictionCache('model-a', db_path=str(tmp_path / 'cache.db'))
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return dict(result('shared'), embedding=[0.5])
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(cache.get_or_compute, b'same image', compute) for _ in range(4)]
+        while cache.stats()['shared'] < 3:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert sum('embedding' in r for r in results) == 1  # Only the caller that ran the model sees it
+    assert all(r['predicted_class'] == 'shared' for r in results)
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from database import Database, DR_CLASSES
+from prediction_jobs import JobQueue
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(f"sqlite:///{tmp_path / 'jobs.db'}")
+    db.init_schema()
+    return db
+
+
+def make_queue(db, **kwargs):
+    queue = JobQueue(db, **kwargs)
+    queue.create_table()
+    return queue
+
+
+def row_for(job):
+    return (job['user_id'], job['filename'], DR_CLASSES[0], 0.9, None, '[]')
+
+
+def prediction_count(db):
+    return db.fetch_value('SELECT COUNT(*) FROM predictions')
+
+
+def test_claim_leases_oldest_job_once(db):
+    queue = make_queue(db)
+    first = queue.submit(1, 'a.png', b'a')
+    queue.submit(1, 'b.png', b'b')
+
+    job = queue.claim()
+    assert job['job_id'] == first and job['attempt'] == 1 and job['image'] == b'a'
+    assert queue.claim()['filename'] == 'b.png'
+    assert queue.claim() is None
+    assert queue.get(first)['status'] == 'running'
+
+
+def test_expired_lease_is_reclaimed_and_stale_attempt_cannot_complete(db):
+    queue = make_queue(db, lease_seconds=0.1)
+    user_id = db.create_user('alice', 'x')
+    job_id = queue.submit(user_id, 'eye.png', b'img')
+
+    stale = queue.claim()
+    time.sleep(0.15)
+    retry = queue.claim()
+    assert retry['job_id'] == job_id and retry['attempt'] == 2
+    assert queue.counters['retried'] == 1
+
+    assert not queue.complete(job_id, {'predicted_class': 'x'}, stale['attempt'], [row_for(stale)])
+    assert not queue.fail(job_id, 'boom', stale['attempt'])
+    assert prediction_count(db) == 0 and queue.get(job_id)['status'] == 'running'
+
+    assert queue.complete(job_id, {'predicted_class': 'x'}, retry['attempt'], [row_for(retry)])
+    assert not queue.complete(job_id, {'predicted_class': 'x'}, retry['attempt'], [row_for(retry)])
+    assert prediction_count(db) == 1
+    assert db.user_stats(user_id)['total'] == 1
+    assert queue.get(job_id)['status'] == 'done'
+
+
+def test_failed_attempt_backs_off_then_gives_up(db):
+    queue = make_queue(db, max_attempts=2)
+    job_id = queue.submit(1, 'eye.png', b'img')
+
+    job = queue.claim()
+    before = time.time()
+    assert queue.fail(job_id, 'boom', job['attempt'])
+    available_at = db.fetch_value('SELECT available_at FROM prediction_jobs WHERE id = ?', (job_id,))
+    assert available_at >= before + 2 ** job['attempt']
+    assert queue.get(job_id)['status'] == 'queued' and queue.claim() is None
+
+    db.execute('UPDATE prediction_jobs SET available_at = 0 WHERE id = ?', (job_id,))
+    job = queue.claim()
+    assert job['attempt'] == 2
+    assert queue.fail(job_id, 'boom again', job['attempt'])
+    status = queue.get(job_id)
+    assert status['status'] == 'failed' and status['error'] == 'boom again'
+
+
+def test_job_abandoned_after_max_attempts_of_lost_leases(db):
+    queue = make_queue(db, lease_seconds=0.05, max_attempts=2)
+    job_id = queue.submit(1, 'eye.png', b'img')
+
+    for attempt in (1, 2):
+        assert queue.claim()['attempt'] == attempt
+        time.sleep(0.08)
+    assert queue.claim() is None
+    status = queue.get(job_id)
+    assert status['status'] == 'failed' and status['error'] == 'Abandoned after 2 attempts'
+    assert queue.counters['abandoned'] == 1
+
+
+def test_worker_renews_lease_of_long_job_and_saves_once(db):
+    user_id = db.create_user('bob', 'x')
+    saved = []
+    queue = make_queue(db, lease_seconds=0.3, poll_interval=0.05,
+                       on_saved=lambda prediction_id, payload: saved.append((prediction_id, payload)))
+    other = make_queue(db, lease_seconds=0.3)  # Another process polling the same table
+    job_id = queue.submit(user_id, 'eye.png', b'img')
+    started = threading.Event()
+
+    def handler(job):
+        started.set()
+        time.sleep(1.0)  # Over three leases
+        return {'predicted_class': DR_CLASSES[0]}, [row_for(job)], [{'id': job['job_id']}]
+
+    queue.start_workers(handler)
+    try:
+        assert started.wait(5)
+        deadline = time.monotonic() + 5
+        while queue.get(job_id)['status'] != 'done':
+            assert other.claim() is None
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        queue.stop()
+
+    status = queue.get(job_id)
+    assert status['attempts'] == 1 and status['result'] == {'predicted_class': DR_CLASSES[0]}
+    assert prediction_count(db) == 1 and db.user_stats(user_id)['total'] == 1
+    assert [payload for _, payload in saved] == [{'id': job_id}]
@@ -0,0 +1,59 @@
+import io
+import time
+
+from PIL import Image
+
+
+def upload(color='red', name='eye.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return {'file': (buffer, name)}
+
+
+def test_predict_then_history_stats_and_export(web_app, client):
+    for color in ('red', 'green', 'blue'):
+        response = client.post('/predict', data=upload(color), content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        assert set(response.get_json()) == {'predicted_class', 'confidence', 'all_probabilities', 'stage',
+                                            'near_duplicate'}
+    assert client.post('/predict', data=upload(name='notes.txt'),
+                       content_type='multipart/form-data').status_code == 400
+
+    deadline = time.monotonic() + 10
+    while client.get('/stats').get_json()['total'] < 3:
+        assert time.monotonic() < deadline, web_app.prediction_writer.stats()
+        time.sleep(0.05)
+
+    first = client.get('/history/predictions?limit=2').get_json()
+    assert len(first['predictions']) == 2 and first['next_cursor']
+    second = client.get(f"/history/predictions?limit=2&cursor={first['next_cursor']}").get_json()
+    assert len(second['predictions']) == 1 and second['next_cursor'] is None
+    ids = [row['id'] for row in first['predictions'] + second['predictions']]
+    assert ids == sorted(ids, reverse=True)
+    assert client.get('/history/predictions?cursor=not-a-cursor').status_code == 400
+
+    export = client.get('/history/export.csv').get_data(as_text=True).splitlines()
+    assert export[0].startswith('id,filename,predicted_class') and len(export) == 4
+
+
+def test_prediction_job_runs_to_done(client):
+    response = client.post('/predict/jobs', data=upload(), content_type='multipart/form-data')
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    deadline = time.monotonic() + 30
+    while (job := client.get(status_url).get_json())['status'] not in ('done', 'failed'):
+        assert time.monotonic() < deadline, job
+        time.sleep(0.1)
+    assert job['status'] == 'done', job
+    assert job['attempts'] == 1
+    assert client.get('/stats').get_json()['total'] == 1
+
+
+def test_health_and_metrics(web_app):
+    client = web_app.app.test_client()
+    assert client.get('/healthz').get_json() == {'status': 'ok'}
+    assert client.get('/readyz').status_code == 200
+    metrics = client.get('/metrics').get_json()
+    assert {'batching', 'jobs', 'database', 'prediction_writes'} <= set(metrics)
+    assert client.post('/predict', data=upload(), content_type='multipart/form-data').status_code == 401
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from prediction_writer import PredictionWriter
+
+
+class FakeInsert:
+    """Records each flush and hands out sequential ids like Database.insert_predictions"""
+    def __init__(self, delay=0.0, error=None):
+        self.flushes = []
+        self.delay = delay
+        self.error = error
+        self._lock = threading.Lock()
+
+    def __call__(self, rows):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            start = sum(map(len, self.flushes))
+            self.flushes.append(list(rows))
+        return list(range(start + 1, start + len(rows) + 1))
+
+
+def test_group_commit_routes_ids_and_payloads():
+    insert = FakeInsert()
+    saved = []
+    writer = PredictionWriter(insert, max_delay_ms=200, on_saved=lambda *args: saved.append(args))
+    futures = [writer.submit([('row', i, j) for j in range(i + 1)], [f'payload {i}.{j}' for j in range(i + 1)])
+               for i in range(3)]
+
+    assert [future.result(5) for future in futures] == [[1], [2, 3], [4, 5, 6]]
+    assert len(insert.flushes) == 1  # All three callers shared one transaction
+    assert saved[0] == (1, 'payload 0.0') and saved[-1] == (6, 'payload 2.2')
+    stats = writer.stats()
+    assert stats['rows'] == 6 and stats['flushes'] == 1 and stats['pending_rows'] == 0
+    writer.close()
+
+
+def test_full_batch_flushes_without_waiting_for_the_delay():
+    insert = FakeInsert()
+    writer = PredictionWriter(insert, max_batch=2, max_delay_ms=10000)
+    start = time.monotonic()
+    futures = [writer.submit([('row', i)]) for i in range(2)]
+    assert [future.result(5) for future in futures] == [[1], [2]]
+    assert time.monotonic() - start < 5
+    writer.close()
+
+
+def test_failed_write_raises_in_durable_futures():
+    writer = PredictionWriter(FakeInsert(error=RuntimeError('database is locked')), max_delay_ms=0)
+    future = writer.submit([('row', 1)])
+    with pytest.raises(RuntimeError, match='database is locked'):
+        future.result(5)
+    assert writer.stats()['errors'] == 1
+    writer.close()
+
+
+def test_close_drains_queued_rows_and_writes_later_ones_directly():
+    insert = FakeInsert(delay=0.05)
+    writer = PredictionWriter(insert, max_batch=2, max_delay_ms=1000)
+    futures = [writer.submit([('row', i)]) for i in range(5)]
+    writer.close()
+    assert all(future.done() for future in futures)
+    assert sorted(row for flush in insert.flushes for row in flush) == [('row', i) for i in range(5)]
+
+    late = writer.submit([('row', 5)])
+    assert late.done() and late.result() == [6]
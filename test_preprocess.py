@@ -0,0 +1,41 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from model_web import RetinalBlindnessModel
+
+
+@pytest.fixture(scope='module')
+def models():
+    fast = RetinalBlindnessModel(None, arch='resnet18', scripted_path=None)
+    reference = RetinalBlindnessModel(None, arch='resnet18', scripted_path=None, fast_preprocess=False)
+    return fast, reference
+
+
+def encode(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def rgba_fundus(width=640, height=480):
+    """Random colours with a fully transparent border, like a cropped fundus photo exported as PNG"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    y, x = np.ogrid[:height, :width]
+    inside = (x - width / 2) ** 2 + (y - height / 2) ** 2 < (min(width, height) / 2) ** 2
+    pixels[..., 3] = np.where(inside, 255, 0)
+    return Image.fromarray(pixels, 'RGBA')
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'LA', 'P'])
+def test_fast_preprocess_matches_reference_transform(models, mode):
+    fast, reference = models
+    image = rgba_fundus()
+    if mode != 'RGBA':
+        image = image.convert(mode)
+    data = encode(image)
+    assert Image.open(io.BytesIO(data)).mode == mode
+    assert np.abs(fast.preprocess(data).numpy() - reference.preprocess(data).numpy()).max() < 1e-4
@@ -0,0 +1,18 @@
+import pytest
+import torch
+
+from model_web import RetinalBlindnessModel
+from slim_checkpoint import load_slim_state_dict, write_slim_checkpoint
+
+
+def test_slim_checkpoint_keeps_arch(tmp_path):
+    checkpoint = tmp_path / 'student.pt'
+    untrained = RetinalBlindnessModel(None, arch='resnet18', scripted_path=None)
+    torch.save({'arch': 'resnet18', 'model_state_dict': untrained.model.state_dict()}, checkpoint)
+    slim_path = write_slim_checkpoint(str(checkpoint))
+
+    model = RetinalBlindnessModel(str(checkpoint), arch='resnet18', scripted_path=None)
+    assert model.is_trained and model.weights_path == slim_path
+
+    with pytest.raises(ValueError, match='holds a resnet18 model, expected resnet152'):
+        load_slim_state_dict(slim_path, arch='resnet152')
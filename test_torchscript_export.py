@@ -0,0 +1,33 @@
+import numpy as np
+import torch
+
+from model_web import RetinalBlindnessModel
+
+
+def test_exported_torchscript_reloads_with_matching_outputs(tmp_path):
+    checkpoint = tmp_path / 'student.pt'
+    untrained = RetinalBlindnessModel(None, arch='resnet18', scripted_path=None)
+    torch.save({'arch': 'resnet18', 'model_state_dict': untrained.model.state_dict()}, checkpoint)
+
+    eager = RetinalBlindnessModel(str(checkpoint), arch='resnet18', scripted_path=None, prefer_slim=False)
+    scripted_path = str(tmp_path / 'student_scripted.pt')
+    eager.export_torchscript(scripted_path)
+
+    scripted = RetinalBlindnessModel(str(checkpoint), arch='resnet18', scripted_path=scripted_path)
+    assert scripted.weights_path == scripted_path
+    assert isinstance(scripted.model, torch.jit.ScriptModule)
+
+    batch = torch.randn(2, 3, 224, 224)
+    assert np.allclose(eager._forward(batch), scripted._forward(batch), atol=1e-4)
+
+
+def test_unloadable_torchscript_falls_back_to_checkpoint(tmp_path):
+    checkpoint = tmp_path / 'student.pt'
+    untrained = RetinalBlindnessModel(None, arch='resnet18', scripted_path=None)
+    torch.save({'arch': 'resnet18', 'model_state_dict': untrained.model.state_dict()}, checkpoint)
+    broken = tmp_path / 'student_scripted.pt'
+    broken.write_bytes(b'not a torchscript archive')
+
+    model = RetinalBlindnessModel(str(checkpoint), arch='resnet18', scripted_path=str(broken), prefer_slim=False)
+    assert model.is_trained
+    assert model.weights_path == str(checkpoint)
@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from user_store import sqlite_store
+
+
+def seed_users(store, count, start=0):
+    with store.pool.connection() as conn:
+        conn.executemany('INSERT INTO THEGREAT (USERNAME, PASSWORD) VALUES (?, ?)',
+                         ((f'user{i}', f'password{i}') for i in range(start, start + count)))
+
+
+def median_login_ms(store, usernames, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        for username in usernames:
+            start = time.perf_counter()
+            assert store.authenticate(username, 'password' + username[4:])
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def test_login_is_constant_time_in_user_count(tmp_path):
+    store = sqlite_store(str(tmp_path / 'users.db'))
+    seed_users(store, 1000)
+    small = median_login_ms(store, [f'user{i}' for i in range(0, 1000, 50)])
+
+    seed_users(store, 99000, start=1000)
+    large = median_login_ms(store, [f'user{i}' for i in range(0, 100000, 5000)])
+
+    # A scan of 100k rows would be ~100x slower than of 1k; an index lookup stays flat
+    assert large < small * 3 + 0.05, f'login took {small:.3f} ms at 1k users and {large:.3f} ms at 100k'
+
+    with store.pool.connection() as conn:
+        plan = ' '.join(str(row) for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT PASSWORD FROM THEGREAT WHERE USERNAME = ? LIMIT 1', ('user1',)))
+    assert 'THEGREAT_USERNAME' in plan
+    store.close()
+
+
+def test_login_signup_and_prediction(tmp_path):
+    store = sqlite_store(str(tmp_path / 'users.db'))
+    assert store.register('alice', 's3cret')
+    assert not store.register('alice', 'other')
+    assert store.authenticate('alice', 's3cret')
+    assert not store.authenticate('alice', 'wrong')
+    assert not store.authenticate('bob', 's3cret')
+
+    # Quotes are data, not SQL
+    assert store.register('o"brien\'', 'x" OR "1"="1')
+    assert not store.authenticate('o"brien\'', 'anything')
+    store.save_prediction('alice', 2)
+    with store.pool.connection() as conn:
+        assert conn.execute('SELECT PREDICT FROM THEGREAT WHERE USERNAME = ?', ('alice',)).fetchone() == ('2',)
+    store.close()
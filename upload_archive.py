@@ -0,0 +1,37 @@
+# Opt-in archival of uploaded images, written off the request thread
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadArchive:
+    """Write upload bytes into ``folder`` on a background thread
+
+    /predict never touches the disk itself; when archival is enabled the
+    route hands the bytes here and returns immediately. The writer thread
+    is started on first use in each process, so an archive created before
+    a gunicorn fork still works in every worker. Files are written under a
+    temporary name and renamed, so a crash never leaves a truncated image.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def submit(self, filename, data):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-archive')
+                self._pid = os.getpid()
+            return self._executor.submit(self._write, filename, data)
+
+    def _write(self, filename, data):
+        path = os.path.join(self.folder, filename)
+        try:
+            with open(path + '.part', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.part', path)
+        except OSError as e:
+            print(f"Error archiving upload {filename}: {e}")
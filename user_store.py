@@ -0,0 +1,173 @@
+# Credentials and results of the Tkinter desktop client, in MySQL or a local SQLite fallback
+import contextlib
+import hmac
+import queue
+import sqlite3
+import threading
+
+# The desktop client's table; USERNAME is looked up through THEGREAT_USERNAME instead of scanned
+SCHEMA = {
+    'mysql': 'CREATE TABLE IF NOT EXISTS THEGREAT (USERNAME VARCHAR(255) NOT NULL, PASSWORD VARCHAR(255) NOT NULL, '
+             'PREDICT VARCHAR(255))',
+    'sqlite': 'CREATE TABLE IF NOT EXISTS THEGREAT (USERNAME TEXT NOT NULL, PASSWORD TEXT NOT NULL, PREDICT TEXT)',
+}
+
+
+class ConnectionPool:
+    """A few reusable connections, replaced when the server has dropped them
+
+    ``connect()`` opens a new connection. At most ``size`` are open at once;
+    callers wait for a free one. ``is_alive(conn)`` is checked before a
+    connection is handed out, and a connection that raised one of
+    ``disconnect_errors`` is closed instead of returned to the pool.
+    """
+    def __init__(self, connect, size=2, is_alive=None, disconnect_errors=()):
+        self.connect = connect
+        self.size = max(1, int(size))
+        self.is_alive = is_alive
+        self.disconnect_errors = tuple(disconnect_errors)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.reconnects = 0
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        """A live connection for one unit of work: committed on success, rolled back on error"""
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if conn is not None and self.is_alive is not None and not self.is_alive(conn):
+                self._close(conn)
+                self.reconnects += 1
+                conn = None
+            if conn is None:
+                conn = self.connect()
+            try:
+                yield conn
+                conn.commit()
+            except self.disconnect_errors:
+                self._close(conn)
+                conn = None
+                raise
+            except BaseException:
+                conn.rollback()
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class UserStore:
+    """Login, signup and result updates for the desktop client, one indexed row per call
+
+    The same queries run on MySQL and SQLite; they are written with ``?``
+    placeholders and passed as parameters, never formatted into the SQL.
+    A call that loses its connection is retried once on a fresh one.
+    """
+    def __init__(self, pool, dialect):
+        self.pool = pool
+        self.dialect = dialect
+
+    def _sql(self, query):
+        return query.replace('?', '%s') if self.dialect == 'mysql' else query
+
+    def _run(self, query, params=(), fetch=False):
+        for attempt in range(2):
+            try:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(self._sql(query), params)
+                        return cursor.fetchone() if fetch else cursor.rowcount
+                    finally:
+                        cursor.close()
+            except self.pool.disconnect_errors:
+                if attempt:
+                    raise
+                self.pool.reconnects += 1
+
+    def create_schema(self):
+        """Create the table if needed and the USERNAME index that makes login a single-row lookup"""
+        self._run(SCHEMA[self.dialect])
+        if self.dialect == 'sqlite':
+            self._run('CREATE INDEX IF NOT EXISTS THEGREAT_USERNAME ON THEGREAT (USERNAME)')
+            return
+        # MySQL has no CREATE INDEX IF NOT EXISTS, and TEXT columns can only be indexed by prefix
+        if self._run("SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                     "AND table_name = 'THEGREAT' AND index_name = 'THEGREAT_USERNAME'", fetch=True)[0]:
+            return
+        data_type = self._run("SELECT data_type FROM information_schema.columns WHERE table_schema = DATABASE() "
+                              "AND table_name = 'THEGREAT' AND column_name = 'USERNAME'", fetch=True)[0]
+        prefix = '(255)' if str(data_type).lower() in ('text', 'tinytext', 'mediumtext', 'longtext', 'blob') else ''
+        self._run(f'CREATE INDEX THEGREAT_USERNAME ON THEGREAT (USERNAME{prefix})')
+
+    def authenticate(self, username, password):
+        row = self._run('SELECT PASSWORD FROM THEGREAT WHERE USERNAME = ? LIMIT 1', (username,), fetch=True)
+        return row is not None and hmac.compare_digest(str(row[0]).encode(), password.encode())
+
+    def exists(self, username):
+        return self._run('SELECT 1 FROM THEGREAT WHERE USERNAME = ? LIMIT 1', (username,), fetch=True) is not None
+
+    def register(self, username, password):
+        """Add a user; returns False when the username is already taken"""
+        if self.exists(username):
+            return False
+        self._run('INSERT INTO THEGREAT (USERNAME, PASSWORD) VALUES (?, ?)', (username, password))
+        return True
+
+    def save_prediction(self, username, value):
+        self._run('UPDATE THEGREAT SET PREDICT = ? WHERE USERNAME = ?', (str(value), username))
+
+    def close(self):
+        self.pool.close()
+
+
+def mysql_store(pool_size=2, **config):
+    """A UserStore on the MySQL server described by ``config`` (host, user, password, database)"""
+    import mysql.connector
+    from mysql.connector import errors
+
+    pool = ConnectionPool(lambda: mysql.connector.connect(connection_timeout=5, **config), size=pool_size,
+                          is_alive=lambda conn: conn.is_connected(),
+                          disconnect_errors=(errors.OperationalError, errors.InterfaceError))
+    store = UserStore(pool, 'mysql')
+    store.create_schema()
+    return store
+
+
+def sqlite_store(path='desktop_users.db', pool_size=2):
+    """A UserStore in a local SQLite file, for clinics without the MySQL server"""
+    def connect():
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)  # Pooled across the GUI's threads
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    store = UserStore(ConnectionPool(connect, size=pool_size), 'sqlite')
+    store.create_schema()
+    return store
+
+
+def open_store(mysql_config, fallback_path='desktop_users.db', pool_size=2):
+    """The MySQL store, or the local SQLite one when the server cannot be reached"""
+    try:
+        return mysql_store(pool_size=pool_size, **mysql_config)
+    except Exception as e:
+        print(f"MySQL unavailable ({e}), using local database {fallback_path}")
+        return sqlite_store(fallback_path, pool_size=pool_size)